@@ -0,0 +1,138 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import flash
+
+# Case file columns, plus one z_<compound> column per compound of the feed.
+CASE_COLUMNS = ('Tf', 'Pf', 'F', 'T', 'P')
+CHECKPOINT = '_checkpoint.json'
+
+
+def readCases(path, chunksize = 100000, skip = 0):
+    ''' Generator of DataFrames with chunksize cases of a CSV or Parquet case file,
+    starting after the first skip cases. Only one chunk is in memory at a time.
+    Whole chunks (Parquet row groups) before skip are passed over and the first chunk is sliced.'''
+    if path.endswith('.parquet'):
+
+        parquet = pq.ParquetFile(path)
+        done = 0
+        first = 0
+
+        # Row groups before skip are not read at all.
+        while first < parquet.num_row_groups and done + parquet.metadata.row_group(first).num_rows <= skip:
+            done += parquet.metadata.row_group(first).num_rows
+            first += 1
+
+        if first == parquet.num_row_groups:
+            return
+
+        for batch in parquet.iter_batches(batch_size = chunksize, row_groups = range(first, parquet.num_row_groups)):
+
+            if done + batch.num_rows <= skip:
+                done += batch.num_rows
+                continue
+
+            yield batch.slice(max(skip - done, 0)).to_pandas()
+            done += batch.num_rows
+
+    else:
+
+        done = 0
+
+        for chunk in pd.read_csv(path, chunksize = chunksize):
+
+            if done + len(chunk) <= skip:
+                done += len(chunk)
+                continue
+
+            yield chunk.iloc[max(skip - done, 0):]
+            done += len(chunk)
+
+
+def solveCases(cases, table, energy = True):
+    ''' Isothermal flash of a DataFrame of cases with isothermalBatch, returns the results DataFrame:
+    Psi, V, L, x_<compound>, y_<compound> and, with energy, hf, hv, hl and Q.'''
+    z = cases[['z_' + compound for compound in table.compounds]].to_numpy(dtype = float)
+    r = flash.isothermalBatch(cases['T'].to_numpy(dtype = float), cases['P'].to_numpy(dtype = float), z, table,
+                              F = cases['F'].to_numpy(dtype = float), Tf = cases['Tf'].to_numpy(dtype = float),
+                              Pf = cases['Pf'].to_numpy(dtype = float), energy = energy)
+    results = {'Psi': r['Psi'], 'V': r['V'], 'L': r['L']}
+
+    for i, compound in enumerate(table.compounds):
+
+        results['x_' + compound] = r['x'][:, i]
+        results['y_' + compound] = r['y'][:, i]
+
+    if energy:
+
+        for key in ('hf', 'hv', 'hl', 'Q'):
+            results[key] = r[key]
+
+    return pd.DataFrame(results, index = cases.index)
+
+
+def runBatch(cases_path, output_path, chunksize = 100000, energy = True, resume = True, progress = print):
+    ''' Streams a case file (CSV or Parquet) through the vectorized isothermal flash.
+     -> output_path is a directory, every chunk is written as a Parquet part file with the case columns
+        and their results, so the directory is a Parquet dataset that grows while the batch runs.
+     -> A checkpoint file in output_path records the finished cases, with resume a new run continues
+        after them instead of starting again.
+     -> progress receives a line with the cases done and the throughput after every chunk (None is silent).
+     Returns the number of cases solved in this run.'''
+    os.makedirs(output_path, exist_ok = True)
+    checkpoint_path = os.path.join(output_path, CHECKPOINT)
+    state = {'cases': 0, 'parts': 0}
+
+    if resume and os.path.exists(checkpoint_path):
+
+        with open(checkpoint_path, mode = 'r') as checkpoint:
+            state = json.load(checkpoint)
+
+    start = time.perf_counter()
+    solved = 0
+    table = None
+
+    for cases in readCases(cases_path, chunksize, state['cases']):
+
+        if len(cases) == 0:
+            continue
+
+        if table is None:
+
+            missing = [column for column in CASE_COLUMNS if column not in cases.columns]
+
+            if missing:
+                raise ValueError("Missing case columns: {}".format(", ".join(missing)))
+
+            table = flash.PropertyTable([column[2:] for column in cases.columns if column.startswith('z_')])
+
+        results = pd.concat([cases.reset_index(drop = True), solveCases(cases, table, energy).reset_index(drop = True)], axis = 1)
+        part = os.path.join(output_path, 'part-{:06d}.parquet'.format(state['parts']))
+        pq.write_table(pa.Table.from_pandas(results, preserve_index = False), part + '.tmp')
+        os.replace(part + '.tmp', part)
+        # The checkpoint is only updated once the part is complete.
+        state['cases'] += len(cases)
+        state['parts'] += 1
+        solved += len(cases)
+
+        with open(checkpoint_path + '.tmp', mode = 'w') as checkpoint:
+            json.dump(state, checkpoint)
+
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+        if progress is not None:
+            elapsed = time.perf_counter() - start
+            progress("{} cases done, {:.0f} cases/s".format(state['cases'], solved / elapsed if elapsed > 0 else np.inf))
+
+    return solved
+
+
+if __name__ == '__main__':
+
+    import sys
+    # python batch_runner.py cases.csv results/ [chunksize]
+    runBatch(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 100000)
@@ -0,0 +1,460 @@
+import argparse
+import copy
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import flash
+from stream import Stream
+from thermo_cache import thermoCache
+
+COMPONENTS = (2, 5, 20)
+BATCHES = (1, 10, 100, 1000, 10000, 100000)
+# Calculations without a vectorized kernel run one FlashDrum per point, up to LOOP_MAX points.
+LOOP_MAX = 1000
+# The diagram sweeps are sequential continuations, up to SWEEP_MAX grid points.
+SWEEP_MAX = 10000
+# The GEKKO engine builds and solves one model per drum calculation, up to GEKKO_MAX points.
+GEKKO_MAX = 10
+P = 101.325
+
+
+def importTime(module = 'flash', repeat = 5):
+    ''' Wall time in s of importing a module in a fresh interpreter, the best of repeat runs.
+    The interpreter start-up time (python -c "pass") is subtracted.'''
+    def run(code):
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd = HERE, check = True)
+        return time.perf_counter() - start
+
+    base = min(run('pass') for _ in range(repeat))
+    return min(run('import ' + module) for _ in range(repeat)) - base
+
+
+def mixtureTable(n):
+    ''' Property table of n compounds. Up to the size of the database the real compounds are used,
+    larger mixtures repeat them with the vapor pressures scaled between 0.5 and 2 times, so the
+    volatilities stay distinct and the mixture has a two-phase region.'''
+    data = flash.compoundData()
+    names = sorted(data.keys())
+
+    if n <= len(names):
+        return flash.PropertyTable(names[:n])
+
+    synthetic = {}
+
+    for i in range(n):
+
+        name = names[i % len(names)]
+        entry = {group: dict(values) for group, values in data[name].items()}
+        entry['Antoine']['C1'] += np.log(2.0) * (2.0 * i / (n - 1) - 1.0)
+        synthetic['{}_{:03d}'.format(name, i)] = entry
+
+    return flash.PropertyTable(list(synthetic.keys()), synthetic)
+
+
+def _cases(table, N, seed = 0):
+    ''' N random feeds and drum temperatures between their bubble and dew temperatures at P.'''
+    rng = np.random.default_rng(seed)
+    z = rng.dirichlet(np.ones(len(table)), size = N)
+    T_b = flash.bubbleTnp(P, z, table)[0]
+    T_d = flash.dewTnp(P, z, table)[0]
+    T = T_b + rng.uniform(0.2, 0.8, size = N) * (T_d - T_b)
+    return z, T, T_b, T_d
+
+
+def _drums(table, z, T_b, engine = 'numpy'):
+    ''' Drums of an engine with subcooled liquid feeds.'''
+    drums = []
+
+    for zi, Ti in zip(z, T_b):
+
+        drum = flash.FlashDrum(engine = engine)
+        drum.setFeedStream(Stream("FEED", float(Ti) - 10.0, 5 * P, 1.0, dict(zip(table.compounds, zi))))
+        drums.append(drum)
+
+    return drums
+
+
+def _cold(drum, name, *args):
+    ''' Calls a drum method without the bubble and dew temperatures memoized by earlier runs.'''
+    drum.boundaries.clear()
+    return getattr(drum, name)(*args)
+
+
+def _loop(drums, name, *args):
+    ''' One cold drum calculation per point, the benchmark of the engines without a vectorized kernel.'''
+    def run():
+
+        for drum in drums:
+            _cold(drum, name, *args)
+
+    return run
+
+
+def benchBubbleT(table, N, engine = 'numpy'):
+
+    z, T, T_b, T_d = _cases(table, N)
+
+    if engine != 'numpy':
+        return _loop(_drums(table, z, T_b, engine), 'bubbleT', P, table) if N <= GEKKO_MAX else None
+
+    if N == 1:
+        drum = _drums(table, z, T_b)[0]
+        return lambda: _cold(drum, 'bubbleT', P, table)
+
+    return lambda: flash.bubbleTnp(P, z, table)
+
+
+def benchDewT(table, N, engine = 'numpy'):
+
+    z, T, T_b, T_d = _cases(table, N)
+
+    if engine != 'numpy':
+        return _loop(_drums(table, z, T_b, engine), 'dewT', P, table) if N <= GEKKO_MAX else None
+
+    if N == 1:
+        drum = _drums(table, z, T_b)[0]
+        return lambda: _cold(drum, 'dewT', P, table)
+
+    return lambda: flash.dewTnp(P, z, table)
+
+
+def benchBubbleP(table, N):
+
+    z, T, T_b, T_d = _cases(table, N)
+
+    if N == 1:
+        drum = _drums(table, z, T_b)[0]
+        return lambda: drum.bubbleP(float(T[0]), table)
+
+    return lambda: np.sum(z * table.Psat(T), axis = -1)
+
+
+def benchDewP(table, N):
+
+    z, T, T_b, T_d = _cases(table, N)
+
+    if N == 1:
+        drum = _drums(table, z, T_b)[0]
+        return lambda: drum.dewP(float(T[0]), table)
+
+    return lambda: 1 / np.sum(z / table.Psat(T), axis = -1)
+
+
+def _benchIsothermal(table, N, energy, engine):
+
+    z, T, T_b, T_d = _cases(table, N)
+
+    if engine != 'numpy':
+
+        if N > GEKKO_MAX:
+            return None
+
+        drums = _drums(table, z, T_b, engine)
+
+        def run():
+
+            for drum, Ti in zip(drums, T):
+                _cold(drum, 'isothermal', float(Ti), P, table, energy)
+
+        return run
+
+    if N == 1:
+        drum = _drums(table, z, T_b)[0]
+        return lambda: _cold(drum, 'isothermal', float(T[0]), P, table, energy)
+
+    return lambda: flash.isothermalBatch(T, P, z, table, Tf = T_b - 10.0, Pf = 5 * P, energy = energy)
+
+
+def benchIsothermal(table, N, engine = 'numpy'):
+
+    return _benchIsothermal(table, N, False, engine)
+
+
+def benchIsothermalEnergy(table, N, engine = 'numpy'):
+
+    return _benchIsothermal(table, N, True, engine)
+
+
+def benchAdiabatic(table, N, engine = 'numpy'):
+
+    if N > (LOOP_MAX if engine == 'numpy' else GEKKO_MAX):
+        return None
+
+    z, T, T_b, T_d = _cases(table, N)
+    return _loop(_drums(table, z, T_b + 0.5 * (T_d - T_b) + 10.0, engine), 'adiabatic', P, table)
+
+
+def _benchK(table, N, surrogate):
+
+    z, T, T_b, T_d = _cases(table, N)
+
+    if surrogate:
+        # The surrogate is fitted on a copy, the other benchmarks keep the exact equation.
+        table = copy.copy(table)
+        table.fitSurrogate()
+
+    return lambda: table.K(T, P)
+
+
+def benchK(table, N):
+
+    return _benchK(table, N, False)
+
+
+def benchKSurrogate(table, N):
+
+    return _benchK(table, N, True)
+
+
+def benchAntoineInv(table, N):
+
+    Ps = np.geomspace(10.0, 1000.0, N)
+
+    if N == 1:
+        coefficients = table['AntoineInv'][table.compounds[0]]
+        return lambda: flash.AntoineInv(float(Ps[0]), **coefficients)
+
+    return lambda: flash.AntoineInvnp(Ps, table)
+
+
+def benchMeanCP(table, N):
+
+    T1 = np.linspace(250.0, 350.0, N)
+    T2 = T1 + 100.0
+
+    if N == 1:
+        coefficients = tuple(table['CPL'][table.compounds[0]].values())
+        return lambda: flash.meanCP(flash.CP_L, float(T1[0]), float(T2[0]), coefficients)
+
+    return lambda: table.meanCPL(T1, T2)
+
+
+def benchTxySweep(table, N):
+
+    if len(table) != 2 or not (10 <= N <= SWEEP_MAX):
+        return None
+
+    return lambda: flash.TxySweep(P, table, N, atol = None)
+
+
+def benchPxySweep(table, N):
+
+    if len(table) != 2 or not (10 <= N <= SWEEP_MAX):
+        return None
+
+    return lambda: flash.PxySweep(370.0, table, N, atol = None)
+
+
+# name: setup(table, N) -> callable that runs N calculations, or None if the size does not apply.
+# name[gekko] times the same drum calculation with the GEKKO engine, so one baseline holds both engines.
+BENCHMARKS = {'bubbleT': benchBubbleT,
+              'bubbleT[gekko]': functools.partial(benchBubbleT, engine = 'gekko'),
+              'dewT': benchDewT,
+              'dewT[gekko]': functools.partial(benchDewT, engine = 'gekko'),
+              'bubbleP': benchBubbleP,
+              'dewP': benchDewP,
+              'isothermal': benchIsothermal,
+              'isothermal[gekko]': functools.partial(benchIsothermal, engine = 'gekko'),
+              'isothermal_energy': benchIsothermalEnergy,
+              'isothermal_energy[gekko]': functools.partial(benchIsothermalEnergy, engine = 'gekko'),
+              'adiabatic': benchAdiabatic,
+              'adiabatic[gekko]': functools.partial(benchAdiabatic, engine = 'gekko'),
+              'K': benchK,
+              'K_surrogate': benchKSurrogate,
+              'AntoineInv': benchAntoineInv,
+              'meanCP': benchMeanCP,
+              'TxySweep': benchTxySweep,
+              'PxySweep': benchPxySweep}
+
+
+def measure(function, repeat = 5, mintime = 0.05):
+    ''' Times a callable like timeit: the loops of a sample double until it takes mintime s.
+    Returns the best and median time in s of one call over repeat samples, and the loops per sample.'''
+    loops = 1
+
+    while True:
+
+        start = time.perf_counter()
+
+        for _ in range(loops):
+            function()
+
+        elapsed = time.perf_counter() - start
+
+        if elapsed >= mintime:
+            break
+
+        loops *= 2
+
+    samples = [elapsed / loops]
+
+    for _ in range(repeat - 1):
+
+        start = time.perf_counter()
+
+        for _ in range(loops):
+            function()
+
+        samples.append((time.perf_counter() - start) / loops)
+
+    return min(samples), float(np.median(samples)), loops
+
+
+def runSuite(names = None, components = COMPONENTS, batches = BATCHES, repeat = 5, mintime = 0.05, imports = True, progress = print):
+    ''' Runs the benchmarks (every name of BENCHMARKS by default) for every mixture size and batch size.
+    The thermodynamic cache is disabled while timing, so repeated calls measure the calculation.
+     Returns a dict with:
+     -> meta: python, numpy and platform versions, date and git commit of the run.
+     -> results: {"name/C=c/N=n": {"best", "median", "per_point", "loops"}} with times in s,
+        per_point is best / n. With imports, "import/flash" is the import time of flash.py.'''
+    names = list(BENCHMARKS) if names is None else names
+    results = {}
+    enabled = thermoCache.enabled
+    thermoCache.configure(enabled = False)
+
+    try:
+
+        for C in components:
+
+            table = mixtureTable(C)
+
+            for name in names:
+
+                for N in batches:
+
+                    function = BENCHMARKS[name](table, N)
+
+                    if function is None:
+                        continue
+
+                    best, median, loops = measure(function, repeat, mintime)
+                    key = "{}/C={}/N={}".format(name, C, N)
+                    results[key] = {'best': best, 'median': median, 'per_point': best / N, 'loops': loops}
+
+                    if progress is not None:
+                        progress("{:<36} {:>12.3f} us {:>12.3f} us/point".format(key, best * 1e6, best / N * 1e6))
+
+    finally:
+        thermoCache.configure(enabled = enabled)
+
+    if imports:
+
+        best = importTime('flash', repeat)
+        results['import/flash'] = {'best': best, 'median': best, 'per_point': best, 'loops': 1}
+
+        if progress is not None:
+            progress("{:<36} {:>12.3f} ms".format('import/flash', best * 1e3))
+
+    return {'meta': metadata(), 'results': results}
+
+
+def metadata():
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd = HERE, capture_output = True, text = True).stdout.strip()
+    except OSError:
+        commit = ''
+
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit}
+
+
+def saveBaseline(suite, path):
+
+    with open(path, mode = 'w') as baseline:
+        json.dump(suite, baseline, indent = 1, sort_keys = True)
+
+    return path
+
+
+def loadBaseline(path):
+
+    with open(path, mode = 'r') as baseline:
+        return json.load(baseline)
+
+
+def compare(baseline, current, threshold = 0.15, metric = 'best'):
+    ''' Compares two suites benchmark by benchmark on the metric time.
+    Returns the rows (key, baseline, current, ratio) of the common benchmarks, and the keys of
+    the regressions, the benchmarks whose current / baseline ratio is above 1 + threshold.'''
+    rows = []
+    regressions = []
+
+    for key, result in sorted(baseline['results'].items()):
+
+        if key not in current['results']:
+            continue
+
+        ratio = current['results'][key][metric] / result[metric]
+        rows.append((key, result[metric], current['results'][key][metric], ratio))
+
+        if ratio > 1 + threshold:
+            regressions.append(key)
+
+    return rows, regressions
+
+
+def _sizes(values):
+
+    return tuple(int(float(value)) for value in values.split(','))
+
+
+if __name__ == '__main__':
+
+    # python benchmarks.py run --output baseline.json [--quick]
+    # python benchmarks.py compare baseline.json [current.json] [--threshold 0.15]
+    parser = argparse.ArgumentParser(description = 'Flash drum benchmark suite.')
+    commands = parser.add_subparsers(dest = 'command')
+    run = commands.add_parser('run', help = 'run the suite and optionally save it as a JSON baseline')
+    check = commands.add_parser('compare', help = 'compare a run (or a new run) with a JSON baseline, exit status 1 on regressions')
+    check.add_argument('baseline')
+    check.add_argument('current', nargs = '?')
+    check.add_argument('--threshold', type = float, default = 0.15, help = 'allowed slowdown, 0.15 is 15 %%')
+    commands.add_parser('import', help = 'import time of flash.py')
+
+    for command in (run, check):
+        command.add_argument('--output', help = 'JSON file for the results of the run')
+        command.add_argument('--only', help = 'comma separated benchmark names')
+        command.add_argument('--components', default = ','.join(map(str, COMPONENTS)))
+        command.add_argument('--batches', default = ','.join(map(str, BATCHES)))
+        command.add_argument('--repeat', type = int, default = 5)
+        command.add_argument('--quick', action = 'store_true', help = 'components 2,5, batches 1,100,10000 and 3 repeats')
+
+    args = parser.parse_args()
+
+    if args.command in (None, 'import'):
+        print("import flash: {:.1f} ms".format(importTime('flash') * 1000))
+        sys.exit(0)
+
+    if args.quick:
+        args.components, args.batches, args.repeat = '2,5', '1,100,10000', 3
+
+    names = args.only.split(',') if args.only else None
+    current = loadBaseline(args.current) if args.command == 'compare' and args.current else None
+
+    if current is None:
+        current = runSuite(names, _sizes(args.components), _sizes(args.batches), args.repeat)
+
+    if args.output:
+        saveBaseline(current, args.output)
+
+    if args.command == 'compare':
+
+        rows, regressions = compare(loadBaseline(args.baseline), current, args.threshold)
+
+        for key, base, new, ratio in rows:
+            print("{:<36} {:>12.3f} us {:>12.3f} us {:>7.2f}x{}".format(key, base * 1e6, new * 1e6, ratio, '  REGRESSION' if key in regressions else ''))
+
+        print("{} benchmarks, {} regressions".format(len(rows), len(regressions)))
+        sys.exit(1 if regressions else 0)
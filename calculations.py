@@ -0,0 +1,67 @@
+from functools import lru_cache
+import flash
+from stream import Stream
+
+# Stateless calculations keyed on small hashable inputs:
+# -> compounds is a tuple of compound names and z the tuple of their molar fractions (normalized here).
+# -> T in K, P in kPa, F in mol/h, n the number of diagram points.
+# Every call builds its own FlashDrum, so results only depend on the arguments and can be cached by them.
+
+
+@lru_cache(maxsize = 64)
+def propertyTable(compounds):
+    ''' Shared property table of a tuple of compounds.'''
+    return flash.PropertyTable(compounds)
+
+
+def _drum(compounds, z, T = None, P = None, F = 1.0, engine = 'gekko'):
+
+    drum = flash.FlashDrum(engine = engine)
+    drum.setFeedStream(Stream("FEED", T, P, F, dict(zip(compounds, z))))
+    return drum
+
+
+def bubbleT(compounds, z, P, engine = 'gekko'):
+
+    return float(_drum(compounds, z, engine = engine).bubbleT(P, propertyTable(compounds)))
+
+
+def dewT(compounds, z, P, engine = 'gekko'):
+
+    return float(_drum(compounds, z, engine = engine).dewT(P, propertyTable(compounds)))
+
+
+def bubbleP(compounds, z, T):
+
+    return float(_drum(compounds, z).bubbleP(T, propertyTable(compounds)))
+
+
+def dewP(compounds, z, T):
+
+    return float(_drum(compounds, z).dewP(T, propertyTable(compounds)))
+
+
+def isothermal(compounds, z, Tf, Pf, F, T, P, energy = False, engine = 'gekko'):
+    ''' Isothermal flash of a feed at Tf and Pf, returns the stream table (FlashDrum.Streams) and the results (FlashDrum.saveResults).'''
+    drum = _drum(compounds, z, Tf, Pf, F, engine)
+    drum.isothermal(T, P, propertyTable(compounds), energy)
+    return drum.Streams(energy), drum.saveResults()
+
+
+def adiabatic(compounds, z, Pf, F, P, engine = 'gekko'):
+    ''' Adiabatic flash of a saturated liquid feed at Pf (at its bubble temperature), returns the stream table and the results.'''
+    drum = _drum(compounds, z, bubbleT(compounds, z, Pf, engine), Pf, F, engine)
+    drum.adiabatic(P, propertyTable(compounds))
+    return drum.Streams(True), drum.saveResults()
+
+
+def Txy(C1, C2, P, n):
+    ''' Binary Txy diagram: compositions x1 and bubble and dew temperatures as tuples.'''
+    x, T_b, T_d = flash.TxySweep(P, propertyTable((C1, C2)), n)
+    return tuple(x), tuple(T_b), tuple(T_d)
+
+
+def Pxy(C1, C2, T, n):
+    ''' Binary Pxy diagram: compositions x1 and bubble and dew pressures as tuples.'''
+    x, P_b, P_d = flash.PxySweep(T, propertyTable((C1, C2)), n)
+    return tuple(x), tuple(P_b), tuple(P_d)
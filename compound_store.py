@@ -0,0 +1,134 @@
+import csv
+import os
+import numpy as np
+
+# Columns of the coefficient block, the same order as compound_data.csv after the name.
+COLUMNS = ('Tc', 'CPL_C1', 'CPL_C2', 'CPL_C3', 'CPL_C4', 'CPL_C5',
+           'Antoine_C1', 'Antoine_C2', 'Antoine_C3', 'Antoine_C4', 'Antoine_C5',
+           'Hvap_C1', 'Hvap_C2', 'Hvap_C3', 'Hvap_C4',
+           'CPIG_C1', 'CPIG_C2', 'CPIG_C3', 'CPIG_C4', 'CPIG_C5')
+NAME_WIDTH = 64
+CAS_WIDTH = 16
+
+
+def convertCSV(csv_path, store_path):
+    ''' Converts a compound database with the layout of compound_data.csv into a binary compound store.
+    An optional 22nd column holds the CAS number of the compound.
+    The store is a directory with .npy files that are memory-mapped when it is opened:
+     -> coefficients.npy: float64 block (N, 20) with the rows sorted by name.
+     -> names.npy: sorted compound names (N,).
+     -> cas.npy and cas_rows.npy: sorted CAS numbers and the rows they point to.'''
+    names = []
+    cas = []
+    rows = []
+
+    with open(csv_path, mode = 'r') as csv_f:
+
+        for row in csv.reader(csv_f):
+
+            if not row:
+                continue
+
+            # The names and CAS numbers are stored as ASCII bytes.
+            if not row[0].isascii() or len(row[0]) > NAME_WIDTH:
+                raise ValueError("Compound names must be ASCII up to {} characters: {}".format(NAME_WIDTH, row[0]))
+
+            if len(row) > 21 and (not row[21].isascii() or len(row[21]) > CAS_WIDTH):
+                raise ValueError("CAS numbers must be ASCII up to {} characters: {}".format(CAS_WIDTH, row[21]))
+
+            names.append(row[0])
+            rows.append([float(value) for value in row[1:21]])
+            cas.append(row[21] if len(row) > 21 else '')
+
+    order = np.argsort(np.array(names, dtype = 'S{}'.format(NAME_WIDTH)), kind = 'stable')
+    names = np.array(names, dtype = 'S{}'.format(NAME_WIDTH))[order]
+    coefficients = np.array(rows, dtype = np.float64).reshape(-1, len(COLUMNS))[order]
+    cas = np.array(cas, dtype = 'S{}'.format(CAS_WIDTH))[order]
+    cas_order = np.argsort(cas, kind = 'stable')
+    os.makedirs(store_path, exist_ok = True)
+    np.save(os.path.join(store_path, 'coefficients.npy'), np.ascontiguousarray(coefficients))
+    np.save(os.path.join(store_path, 'names.npy'), names)
+    np.save(os.path.join(store_path, 'cas.npy'), cas[cas_order])
+    np.save(os.path.join(store_path, 'cas_rows.npy'), cas_order.astype(np.int64))
+    return store_path
+
+
+class CompoundStore():
+
+    def __init__(self, path):
+        ''' Read-only binary compound database created by convertCSV.
+        Every array is memory-mapped, so opening the store does not read it, a lookup touches
+        O(log N) pages of the name index plus the rows of the requested compounds, and several
+        processes that open the same store share the pages. It can be used as compound_data:
+        store[name] returns the same nested dict layout.'''
+        self.path = path
+        self.coefficients = np.load(os.path.join(path, 'coefficients.npy'), mmap_mode = 'r')
+        self.names = np.load(os.path.join(path, 'names.npy'), mmap_mode = 'r')
+        self.cas = np.load(os.path.join(path, 'cas.npy'), mmap_mode = 'r')
+        self.cas_rows = np.load(os.path.join(path, 'cas_rows.npy'), mmap_mode = 'r')
+
+    def __len__(self):
+
+        return len(self.names)
+
+    def _find(self, index, key):
+
+        if not key.isascii():
+            return None
+
+        key = key.encode('ascii')
+        i = int(np.searchsorted(index, key))
+
+        if i < len(index) and index[i] == key:
+            return i
+
+        return None
+
+    def row(self, name):
+        ''' Row of a compound by name, KeyError if it is not in the store.'''
+        i = self._find(self.names, name)
+
+        if i is None:
+            raise KeyError(name)
+
+        return i
+
+    def rowCAS(self, cas):
+        ''' Row of a compound by CAS number, KeyError if it is not in the store.'''
+        i = self._find(self.cas, cas)
+
+        if i is None:
+            raise KeyError(cas)
+
+        return int(self.cas_rows[i])
+
+    def nameCAS(self, cas):
+        ''' Compound name of a CAS number.'''
+        return self.names[self.rowCAS(cas)].decode()
+
+    def __contains__(self, name):
+
+        return self._find(self.names, name) is not None
+
+    def keys(self):
+        ''' Every compound name, this reads the whole name index.'''
+        return [name.decode() for name in self.names]
+
+    def block(self, compounds):
+        ''' Coefficient rows (k, 20) of a list of compounds, in the given order.'''
+        return np.array(self.coefficients[[self.row(compound) for compound in compounds]], dtype = np.float64)
+
+    def __getitem__(self, name):
+
+        r = [float(value) for value in self.coefficients[self.row(name)]]
+        return {'Antoine': dict(zip(('C1', 'C2', 'C3', 'C4', 'C5'), r[6:11])),
+                'Hvap': dict(zip(('Tc', 'C1', 'C2', 'C3', 'C4'), [r[0]] + r[11:15])),
+                'CPL': dict(zip(('C1', 'C2', 'C3', 'C4', 'C5'), r[1:6])),
+                'CPIG': dict(zip(('C1', 'C2', 'C3', 'C4', 'C5'), r[15:20]))}
+
+
+if __name__ == '__main__':
+
+    import sys
+    # python compound_store.py compound_data.csv compound_data.fds
+    print(convertCSV(sys.argv[1], sys.argv[2]))
@@ -1,16 +1,44 @@
-from gekko import GEKKO
 import numpy as np
-from stream import Stream
+from stream import Stream, StreamBatch, Composition
+from thermo_cache import thermoCache, memoized
+from compound_store import CompoundStore
+from instrumentation import Profiler
 from math import sinh, cosh
-from scipy.integrate import quad
 import csv
-
-m = GEKKO()
+import inspect
+import os
+import sys
+import warnings
+from functools import wraps
+
+# The compound database is read on first use from this path (or the FLASH_COMPOUND_DATA environment variable),
+# a CSV file or a binary compound store directory (see compound_store.py).
+COMPOUND_DATA = os.environ.get('FLASH_COMPOUND_DATA', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compound_data.csv'))
+_compound_data = None
+# PropertyTable surrogates are only evaluated for at least SURROGATE_MIN (temperature, compound) pairs.
+SURROGATE_MIN = 5000
+# Opt-in instrumentation of the hot paths, see instrument().
+profiler = Profiler()
+
+def GEKKO(*args, **kwargs):
+    ''' New GEKKO model, gekko is only imported when a GEKKO solver is used.'''
+    from gekko import GEKKO
+    m = GEKKO(*args, **kwargs)
+
+    if profiler.enabled:
+        m.solve = profiler.wrap('GEKKO.solve', m.solve)
+
+    return m
+
+def _gk(function, x):
+    ''' GEKKO intrinsic function (exp, log) of a symbolic expression, it does not need a model.'''
+    from gekko.gk_operators import GK_Operators
+    return GK_Operators(function + '(' + str(x) + ')')
 
 def Antoine(T, C1, C2, C3, C4, C5):
 
 
-    P = m.exp(C1 + (C2 / T) + (C3 * m.log(T)) + (C4 * (T ** C5)))
+    P = _gk('exp', C1 + (C2 / T) + (C3 * _gk('log', T)) + (C4 * (T ** C5)))
 
     return (P / 1000) # kPa
 
@@ -21,14 +49,61 @@ def Antoinenp(T, C1, C2, C3, C4, C5):
 
     return (P / 1000) # kPa
 
+def _antoineInverse(lnP, A, T0 = None, tol = 1e-12, maxiter = 50):
+    ''' Halley method on ln(T) for ln(Psat(T)) = ln(P), vectorized over pressures and compounds.
+    lnP broadcasts against (..., C) and A is the (C, 5) matrix of Antoine coefficients.
+    ln(Psat) increases with T, so the bracket [100 K, 800 K] is narrowed every iteration
+    and a step that leaves it is replaced by a bisection step.'''
+    lnP = np.asarray(lnP, dtype = float)
+    shape = np.broadcast(lnP, A[:, 0]).shape
+    lnP = np.broadcast_to(lnP, shape)
+    lo = np.full(shape, np.log(100.0))
+    hi = np.full(shape, np.log(800.0))
+    lnT = np.clip(np.log(np.broadcast_to(np.asarray(400.0 if T0 is None else T0, dtype = float), shape)), lo, hi)
+    converged = np.zeros(shape, dtype = bool)
+
+    for _ in range(maxiter):
+
+        T = np.exp(lnT)
+        TC5 = A[:, 3] * T ** A[:, 4]
+        h = A[:, 0] + A[:, 1] / T + A[:, 2] * lnT + TC5 - np.log(1000.0) - lnP
+        dh = -A[:, 1] / T + A[:, 2] + A[:, 4] * TC5
+        d2h = A[:, 1] / T + A[:, 4] ** 2 * TC5
+        lo = np.where(~converged & (h < 0), lnT, lo)
+        hi = np.where(~converged & (h > 0), lnT, hi)
+        new = lnT - np.clip(h / dh / (1 - h * d2h / (2 * dh * dh)), -0.25, 0.25)
+        new = np.where((new <= lo) | (new >= hi) | ~np.isfinite(new), 0.5 * (lo + hi), new)
+        converged = converged | (np.abs(new - lnT) < tol) | (np.abs(h) < tol)
+        lnT = np.where(converged, lnT, new)
+
+        if converged.all():
+            break
+
+    converged = converged & (lnT > np.log(100.0) + 1e-8) & (lnT < np.log(800.0) - 1e-8)
+    return np.exp(lnT), converged
+
+def AntoineInvnp(P, c, T0 = None):
+    ''' Saturation temperatures in K (..., C) of every compound of c at an array of pressures P in kPa.
+    Returns the temperatures and a boolean array with the convergence flags.'''
+    table = propertyTable(c)
+    return _antoineInverse(np.log(np.asarray(P, dtype = float))[..., None], table.Antoine, T0)
+
+@memoized(0)
 def AntoineInv(P, C1, C2, C3, C4, C5):
-    
+
+    T, converged = _antoineInverse(np.log(P), np.array([[C1, C2, C3, C4, C5]], dtype = float))
+
+    if converged[0]:
+        return float(T[0]) # K
+
+    # Fallback: solve the equation with GEKKO.
     m = GEKKO()
     T = m.Var(value = 298.15, lb = 100, ub = 800)
     m.Equation([(m.exp(C1 + (C2 / T) + (C3 * m.log(T)) + (C4 * (T ** C5))) / 1000) - P == 0])
     m.solve(disp=False)
     return float(T.value[0]) # K
 
+@memoized(0)
 def HeatVap(T, Tc, C1, C2, C3, C4):
 
     Tr = T / Tc
@@ -45,14 +120,491 @@ def CP_ig(T, C1, C2, C3, C4, C5):
     CPIG = C1 + C2 * pow((C3 / T) / (sinh(C3 / T)), 2) + C4 * pow((C5 / T) / (cosh(C5 / T)), 2)
     return CPIG/1e6 # kJ / mol K
 
+def intCP_L(T, C1, C2, C3, C4, C5):
+    ''' Antiderivative of CP_L, vectorized over T and the coefficients.'''
+    H = T * (C1 + T * (C2 / 2 + T * (C3 / 3 + T * (C4 / 4 + T * C5 / 5))))
+    return H/1e6 # kJ / mol
+
+def intCP_ig(T, C1, C2, C3, C4, C5):
+    ''' Antiderivative of CP_ig (DIPPR 107), vectorized over T and the coefficients.'''
+    H = C1 * T + C2 * C3 / np.tanh(C3 / T) - C4 * C5 * np.tanh(C5 / T)
+    return H/1e6 # kJ / mol
+
+# The mean heat capacity changes with the window limits at any precision, so they are not rounded in the key.
+@memoized(1, 2, exact = True)
 def meanCP(f, T1, T2, ar):
 
+    if f in _antiderivatives:
+        # Closed form: (H(T2) - H(T1)) / (T2 - T1)
+        F = _antiderivatives[f]
+        return float((F(T2, *ar) - F(T1, *ar)) / (T2 - T1)) # kJ / mol K
+
+    from scipy.integrate import quad
     mcp, err = quad(f, T1, T2, args = ar, limit=1100)
     mcp = mcp / (T2 - T1)
     return mcp # kJ / mol K
 
+_antiderivatives = {CP_L: intCP_L, CP_ig: intCP_ig}
+
+def rachfordRice(z, K, psi0 = None, tol = 1e-12, maxiter = 100, full_output = False):
+    ''' Solves the Rachford-Rice equation for Psi with a bracketed Newton method.
+    z and K are arrays with the components in the last axis, so one call can solve many flashes.
+    The root is searched in [0, 1] narrowed by the asymptotes 1 / (1 - Kmax) and 1 / (1 - Kmin),
+    a Newton step that leaves the bracket is replaced by a bisection step.
+    psi0 is an optional initial guess, with full_output the number of iterations is also returned.'''
+    z = np.asarray(z, dtype = float)
+    K = np.asarray(K, dtype = float)
+    shape = np.broadcast(z, K).shape[:-1]
+    z = np.broadcast_to(z, shape + z.shape[-1:])
+    K = np.broadcast_to(K, shape + K.shape[-1:])
+    Kmax = K.max(axis = -1)
+    Kmin = K.min(axis = -1)
+    f0 = np.sum(z * (K - 1), axis = -1)        # f(Psi = 0): bubble point check
+    f1 = np.sum(z * (K - 1) / K, axis = -1)    # f(Psi = 1): dew point check
+    with np.errstate(divide = 'ignore'):
+        lo = np.where(Kmax > 1, np.maximum(0.0, 1 / (1 - Kmax)), 0.0)
+        hi = np.where(Kmin < 1, np.minimum(1.0, 1 / (1 - Kmin)), 1.0)
+    psi = np.clip(np.broadcast_to(np.asarray(0.5 if psi0 is None else psi0, dtype = float), shape), lo, hi)
+    active = (f0 > 0) & (f1 < 0)
+    iterations = 0
+
+    for _ in range(maxiter):
+
+        if not active.any():
+            break
+
+        iterations += 1
+
+        d = 1 + psi[..., None] * (K - 1)
+        f = np.sum(z * (K - 1) / d, axis = -1)
+        df = -np.sum(z * (K - 1) ** 2 / (d * d), axis = -1)
+        # f(Psi) is monotonically decreasing, so the sign of f moves the bracket.
+        lo = np.where(active & (f > 0), psi, lo)
+        hi = np.where(active & (f < 0), psi, hi)
+        step = np.where(df != 0, f / np.where(df != 0, df, 1.0), 0.0)
+        new = psi - step
+        new = np.where((new <= lo) | (new >= hi), 0.5 * (lo + hi), new)
+        active = active & (np.abs(new - psi) > tol)
+        psi = np.where(active, new, psi)
+
+    psi = np.where(f0 <= 0, 0.0, np.where(f1 >= 0, 1.0, psi))
+
+    if full_output:
+        return psi, iterations
+
+    return psi
+
+def _outletDerivatives(z, K, psi, dpsi, dK, dz):
+    ''' Derivatives of the outlet compositions x = z / (1 + Psi (K - 1)) and y = K x (C, N)
+    given the derivatives of Psi (N,), K (C, N) and z (C, N) with respect to N parameters.'''
+    if psi <= 0:
+        return dz, np.zeros_like(dz)
+
+    if psi >= 1:
+        return np.zeros_like(dz), dz
+
+    D = 1 + psi * (K - 1)
+    x = z / D
+    dx = dz / D[:, None] - (z / D ** 2)[:, None] * (dpsi[None, :] * (K - 1)[:, None] + psi * dK)
+    return dx, K[:, None] * dx + x[:, None] * dK
+
+def _sensitivityDict(names, compounds, dpsi, dx, dy, dT = None):
+    ''' Splits the parameter columns into the sensitivities dict, z is the last group of C columns.'''
+    s = {'compounds': tuple(compounds)}
+
+    for i, name in enumerate(names):
+
+        j = slice(i, i + len(compounds)) if name == 'z' else i
+        scalar = (lambda a: a[j]) if name == 'z' else (lambda a: float(a[j]))
+
+        if dT is not None:
+            s['dT/d' + name] = scalar(dT)
+
+        s['dPsi/d' + name] = scalar(dpsi)
+        s['dx/d' + name] = dx[:, j]
+        s['dy/d' + name] = dy[:, j]
+
+    return s
+
+def isothermalSensitivities(z, K, dlnK, psi, T, P, compounds):
+    ''' Exact derivatives of an isothermal flash solution by implicit differentiation of the Rachford-Rice equation.
+     -> z is the feed composition, K the K values at the drum T and P, dlnK = d ln(K) / d ln(T) and psi the solution.
+     -> compounds are the names in the order of the arrays.
+     Returns a dict with dPsi/dT, dPsi/dP, dPsi/dz (C,), dx/dT, dx/dP, dy/dT, dy/dP (C,) and dx/dz, dy/dz (C, C) where
+     dx/dz[i, j] = d x_i / d z_j with the other feed fractions fixed. Single-phase outlets only depend on z.'''
+    C = len(z)
+    # Parameter columns: T, P, z_1 ... z_C
+    dK = np.hstack([(K * dlnK / T)[:, None], (-K / P)[:, None], np.zeros((C, C))])
+    dz = np.hstack([np.zeros((C, 2)), np.eye(C)])
+
+    if 0 < psi < 1:
+        D = 1 + psi * (K - 1)
+        f_psi = -np.sum(z * (K - 1) ** 2 / D ** 2)
+        f = np.sum((z / D ** 2)[:, None] * dK, axis = 0) + np.sum(((K - 1) / D)[:, None] * dz, axis = 0)
+        dpsi = -f / f_psi
+    else:
+        dpsi = np.zeros(C + 2)
+        dK = np.zeros_like(dK)
+
+    dx, dy = _outletDerivatives(z, K, psi, dpsi, dK, dz)
+    return _sensitivityDict(('T', 'P', 'z'), compounds, dpsi, dx, dy)
+
+def heatCapacityWindow(table, z, P, T_bubble, T_dew):
+    ''' Derivatives (C, N) of the mean liquid and ideal gas heat capacities of the flash energy balances, taken
+    between 0.8 T_bubble and 1.2 T_dew, with respect to the adiabaticSensitivities parameters (P, hf, z_1 ... z_C).
+    The bubble and dew temperatures move with P and z along sum(z K) = 1 and sum(z / K) = 1.'''
+    Kb = table.K(T_bubble, P)
+    Kd = table.K(T_dew, P)
+    sb = np.sum(z * Kb * table.dlnPsat(T_bubble)) / T_bubble
+    sd = np.sum(z / Kd * table.dlnPsat(T_dew)) / T_dew
+    dTb = np.concatenate([[1 / (P * sb), 0.0], -Kb / sb])
+    dTd = np.concatenate([[1 / (P * sd), 0.0], 1 / (Kd * sd)])
+    window = []
+
+    for ideal in (False, True):
+
+        d1, d2 = table.dMeanCP(T_bubble * 0.8, T_dew * 1.2, ideal)
+        window.append(np.outer(d1, 0.8 * dTb) + np.outer(d2, 1.2 * dTd))
+
+    return window
+
+def adiabaticSensitivities(z, K, dlnK, psi, T, P, cpl, hv, dhv, dhf, Tref, compounds, dr = None, single = None):
+    ''' Exact derivatives of an adiabatic flash solution by implicit differentiation of the Rachford-Rice
+    and energy equations, with the drum temperature and Psi as unknowns.
+     -> z, K, dlnK = d ln(K) / d ln(T), psi and T as in isothermalSensitivities, P the drum pressure.
+     -> cpl are the mean liquid heat capacities, hv and dhv the heats of vaporization and their T derivative at T.
+     -> dhf is d hf / dz, the derivative of the feed enthalpy with the other feed fractions fixed.
+     -> compounds are the names in the order of the arrays.
+     -> dr are other explicit derivatives (N,) of the energy residual h - hf, like the heat capacity window terms.
+     -> single is None for two phases, or (dr/dT, dr) of the energy residual of a single-phase outlet.
+     Returns the isothermal keys for P, hf (feed enthalpy, P and z fixed) and z, plus dT/dP, dT/dhf and dT/dz.'''
+    C = len(z)
+    # Parameter columns: P, hf, z_1 ... z_C
+    dz = np.hstack([np.zeros((C, 2)), np.eye(C)])
+    dKdP = np.hstack([(-K / P)[:, None], np.zeros((C, C + 1))])
+    dr = np.zeros(C + 2) if dr is None else dr
+
+    if single is None:
+        D = 1 + psi * (K - 1)
+        dKdT = K * dlnK / T
+        # Rachford-Rice f(Psi, T) and energy r(Psi, T) = h(Psi, T) - hf partial derivatives.
+        f_psi = -np.sum(z * (K - 1) ** 2 / D ** 2)
+        f_T = np.sum(z / D ** 2 * dKdT)
+        r_psi = np.sum(hv * z * K / D ** 2)
+        dv_dK = psi * z * (1 - psi) / D ** 2
+        r_T = np.sum(z * cpl) + psi * np.sum(z * K / D * dhv) + np.sum(hv * dv_dK * dKdT)
+        f = np.sum((z / D ** 2)[:, None] * dKdP, axis = 0) + np.sum(((K - 1) / D)[:, None] * dz, axis = 0)
+        r = np.sum((hv * dv_dK)[:, None] * dKdP, axis = 0) + np.concatenate([[0.0, -1.0], cpl * (T - Tref) + hv * psi * K / D - dhf]) + dr
+        dpsi, dT = -np.linalg.solve(np.array([[f_psi, f_T], [r_psi, r_T]]), np.vstack([f, r]))
+        dK = dKdP + (K * dlnK / T)[:, None] * dT[None, :]
+    else:
+        dT = -(single[1] + dr) / single[0]
+        dpsi = np.zeros(C + 2)
+        dK = np.zeros((C, C + 2))
+
+    dx, dy = _outletDerivatives(z, K, psi, dpsi, dK, dz)
+    return _sensitivityDict(('P', 'hf', 'z'), compounds, dpsi, dx, dy, dT)
+
+def _saturationT(P, z, c, dew, T0, tol, maxiter):
+    ''' Safeguarded Newton method on ln(T) for sum(z * K) = 1 (bubble) or sum(z / K) = 1 (dew).
+    The residual is monotonic in ln(T), so the bracket [100 K, 800 K] is narrowed every iteration
+    and a Newton step that leaves it is replaced by a bisection step.'''
+    table = propertyTable(c)
+    z = np.asarray(z, dtype = float)
+    P = np.asarray(P, dtype = float)
+    shape = np.broadcast(P, z[..., 0]).shape
+    z = np.broadcast_to(z, shape + z.shape[-1:])
+    lnP = np.log(np.broadcast_to(P, shape))
+    lo = np.full(shape, np.log(100.0))
+    hi = np.full(shape, np.log(800.0))
+    lnT = np.clip(np.log(np.broadcast_to(np.asarray(400.0 if T0 is None else T0, dtype = float), shape)), lo, hi)
+    sign = -1.0 if dew else 1.0
+    converged = np.zeros(shape, dtype = bool)
+
+    for _ in range(maxiter):
+
+        T = np.exp(lnT)
+        lnPsat = table.lnPsat(T)
+        dlnPsat = table.dlnPsat(T)
+        w = z * np.exp(sign * (lnPsat - lnP[..., None]))
+        S = np.sum(w, axis = -1)
+        # g(ln T) = sign * ln(sum(z * K^sign)) is increasing for both bubble and dew points.
+        g = sign * np.log(S)
+        dg = np.sum(w * dlnPsat, axis = -1) / S
+        lo = np.where(~converged & (g < 0), lnT, lo)
+        hi = np.where(~converged & (g > 0), lnT, hi)
+        new = lnT - np.clip(g / dg, -0.25, 0.25)
+        new = np.where((new <= lo) | (new >= hi) | ~np.isfinite(new), 0.5 * (lo + hi), new)
+        converged = converged | (np.abs(new - lnT) < tol) | (np.abs(g) < tol)
+        lnT = np.where(converged, lnT, new)
+
+        if converged.all():
+            break
+
+    # A root pinned to the bracket limits is not a solution.
+    converged = converged & (lnT > np.log(100.0) + 1e-8) & (lnT < np.log(800.0) - 1e-8)
+    return np.exp(lnT), converged
+
+def bubbleTnp(P, z, c, T0 = None, tol = 1e-12, maxiter = 100):
+    ''' Bubble temperatures in K for an array of pressures P in kPa and a matrix of compositions z
+    (components in the last axis, in the order of the property table of c). T0 is an optional initial guess.
+    Returns the temperatures and a boolean array with the convergence flags.'''
+    return _saturationT(P, z, c, False, T0, tol, maxiter)
+
+def dewTnp(P, z, c, T0 = None, tol = 1e-12, maxiter = 100):
+    ''' Dew temperatures in K for an array of pressures P in kPa and a matrix of compositions z
+    (components in the last axis, in the order of the property table of c). T0 is an optional initial guess.
+    Returns the temperatures and a boolean array with the convergence flags.'''
+    return _saturationT(P, z, c, True, T0, tol, maxiter)
+
+def _dTdx(T, P, z, table, dew):
+    ''' Slope dT/dx1 of the bubble (or dew) temperature of a binary mixture z = (x1, 1 - x1),
+    from the implicit differentiation of sign * ln(sum(z * K^sign)) = 0.'''
+    sign = -1.0 if dew else 1.0
+    Ks = np.exp(sign * (table.lnPsat(T) - np.log(P)))
+    return -T * sign * (Ks[..., 0] - Ks[..., 1]) / np.sum(z * Ks * table.dlnPsat(T), axis = -1)
+
+def _refine(x, curves, slopes, atol, maxpoints):
+    ''' Midpoints of the intervals where a cubic Hermite interpolation of any curve deviates from the
+    straight line by more than atol, with the Hermite predictions of every curve at those midpoints.'''
+    h = np.diff(x)
+    deviation = [np.abs(h * (d[:-1] - d[1:]) / 8) for d in slopes]
+    refine = np.flatnonzero(np.any(np.array(deviation) > atol, axis = 0))[:max(maxpoints - len(x), 0)]
+    xm = 0.5 * (x[refine] + x[refine + 1])
+    predictions = [0.5 * (y[refine] + y[refine + 1]) + h[refine] * (d[refine] - d[refine + 1]) / 8 for y, d in zip(curves, slopes)]
+    return xm, predictions
+
+def _insert(x, xm, *curves):
+    ''' Merges the refined points into the sorted grid.'''
+    order = np.argsort(np.concatenate([x, xm[0]]), kind = 'stable')
+    return [np.concatenate([y, ym])[order] for y, ym in zip((x,) + curves, xm)]
+
+def TxySweep(P, c, n = 101, atol = 0.05, maxpoints = 401, tol = 1e-12, maxiter = 100):
+    ''' Bubble and dew temperatures in K of a binary mixture (the two compounds of c) at a pressure P in kPa,
+    from x1 = 0 to x1 = 1: the n points of the grid are solved at once with the vectorized bubbleTnp/dewTnp kernel.
+    If atol (K) is not None, midpoints are added where the envelope curves more than atol from a straight line,
+    up to maxpoints, every round of new points is solved as one batch starting from their cubic Hermite predictions.
+    Returns the compositions x1 and the bubble and dew temperatures.'''
+    table = propertyTable(c)
+    x = np.linspace(0.0, 1.0, num = int(n))
+    # The base grid is one vectorized solve per curve.
+    z = np.column_stack([x, 1 - x])
+    T_b = _saturationT(P, z, table, False, None, tol, maxiter)[0]
+    T_d = _saturationT(P, z, table, True, None, tol, maxiter)[0]
+    d_b = _dTdx(T_b, P, z, table, False)
+    d_d = _dTdx(T_d, P, z, table, True)
+
+    while atol is not None and len(x) < maxpoints:
+
+        xm, (Tm_b, Tm_d) = _refine(x, (T_b, T_d), (d_b, d_d), atol, maxpoints)
+
+        if len(xm) == 0:
+            break
+
+        # The Hermite predictions are the initial guesses of the new points.
+        z = np.column_stack([xm, 1 - xm])
+        Tm_b = _saturationT(P, z, table, False, Tm_b, tol, maxiter)[0]
+        Tm_d = _saturationT(P, z, table, True, Tm_d, tol, maxiter)[0]
+        x, T_b, T_d, d_b, d_d = _insert(x, (xm, Tm_b, Tm_d, _dTdx(Tm_b, P, z, table, False), _dTdx(Tm_d, P, z, table, True)), T_b, T_d, d_b, d_d)
+
+    return x, T_b, T_d
+
+def PxySweep(T, c, n = 101, atol = 0.5, maxpoints = 401):
+    ''' Bubble and dew pressures in kPa of a binary mixture (the two compounds of c) at a temperature T in K,
+    from x1 = 0 to x1 = 1. If atol (kPa) is not None, midpoints are added where the dew curve bends more
+    than atol from a straight line, up to maxpoints. Returns the compositions x1 and the bubble and dew pressures.'''
+    Psat = propertyTable(c).Psat(T)
+
+    def boundary(x):
+
+        P_b = x * Psat[0] + (1 - x) * Psat[1]
+        P_d = 1 / (x / Psat[0] + (1 - x) / Psat[1])
+        return P_b, P_d, np.full(len(x), Psat[0] - Psat[1]), -P_d ** 2 * (1 / Psat[0] - 1 / Psat[1])
+
+    x = np.linspace(0.0, 1.0, num = int(n))
+    P_b, P_d, d_b, d_d = boundary(x)
+
+    while atol is not None and len(x) < maxpoints:
+
+        xm, _ = _refine(x, (P_b, P_d), (d_b, d_d), atol, maxpoints)
+
+        if len(xm) == 0:
+            break
+
+        x, P_b, P_d, d_b, d_d = _insert(x, (xm,) + boundary(xm), P_b, P_d, d_b, d_d)
+
+    return x, P_b, P_d
+
+def envelopeCurve(z, c, psi = 0.0, P_min = 1.0, P_max = None, T_max = None, h0 = 0.05, hmax = 0.25, dTmax = 10.0, tol = 1e-10, maxiter = 8):
+    ''' Traces the T-P curve of constant vapor fraction psi (0 is the bubble curve, 1 the dew curve) of a feed z
+    by natural-parameter continuation in ln(P), from P_min up to P_max (kPa) or T_max (K, the highest critical
+    temperature by default). Every step predicts ln(T) with the tangent dln(T)/dln(P) of the last point and
+    corrects it with a chord Newton method that reuses the Jacobian of the last point, the step size h in ln(P)
+    grows when the corrector converges fast and shrinks when it is slow or fails.
+    Returns the arrays of temperatures and pressures and a dict with the steps, rejected steps, residual and
+    Jacobian evaluations.'''
+    table = propertyTable(c)
+    z = np.asarray(z, dtype = float)
+    T_max = float(table.Hvap[:, 0].max()) if T_max is None else T_max
+    lnP_max = np.log(P_max) if P_max is not None else np.inf
+    stats = {'steps': 0, 'rejected': 0, 'residuals': 0, 'jacobians': 0}
+
+    def residual(lnT, lnP):
+
+        stats['residuals'] += 1
+        K = np.exp(table.lnPsat(np.exp(lnT)) - lnP)
+        return np.sum(z * (K - 1) / (1 + psi * (K - 1)))
+
+    def jacobian(lnT, lnP):
+        # Partial derivatives of the Rachford-Rice residual with respect to ln(T) and ln(P).
+        stats['jacobians'] += 1
+        T = np.exp(lnT)
+        K = np.exp(table.lnPsat(T) - lnP)
+        g = z * K / (1 + psi * (K - 1)) ** 2
+        return np.sum(g * table.dlnPsat(T)), -np.sum(g)
+
+    # First point: Newton method from 400 K.
+    lnP = np.log(P_min)
+    lnT = np.log(400.0)
+
+    for _ in range(100):
+
+        f_T, f_P = jacobian(lnT, lnP)
+        step = np.clip(residual(lnT, lnP) / f_T, -0.25, 0.25)
+        lnT = lnT - step
+
+        if abs(step) < tol:
+            break
+
+    T = [np.exp(lnT)]
+    P = [P_min]
+    f_T, f_P = jacobian(lnT, lnP)
+    h = h0
+
+    while lnP < lnP_max and T[-1] < T_max and h > 1e-6:
+
+        slope = -f_P / f_T
+        # The step is also limited by the temperature change, so the curve keeps its resolution.
+        h = min(h, hmax, lnP_max - lnP, dTmax / max(abs(slope) * T[-1], 1e-12))
+        lnP_new = lnP + h
+        lnT_new = lnT + slope * h
+        converged = False
+
+        for k in range(1, maxiter + 1):
+
+            step = residual(lnT_new, lnP_new) / f_T
+            lnT_new = lnT_new - step
+
+            if abs(step) < tol:
+                converged = True
+                break
+
+        if not converged or not np.isfinite(lnT_new):
+
+            stats['rejected'] += 1
+            h = 0.5 * h
+            continue
+
+        stats['steps'] += 1
+        lnT, lnP = lnT_new, lnP_new
+        T.append(np.exp(lnT))
+        P.append(np.exp(lnP))
+        f_T, f_P = jacobian(lnT, lnP)
+        h = h * 1.5 if k <= 3 else (h * 0.7 if k >= 6 else h)
+
+    T = np.array(T)
+    P = np.array(P)
+    inside = T <= T_max
+    return T[inside], P[inside], stats
+
+def feedEnthalpy(z, Tf, Pf, Tf_bubble, Tf_dew, table, cpl, cpig, Tref = 298.15):
+    ''' Molar enthalpies (..., C) of the feed components at the feed temperature Tf and pressure Pf, hf = sum(z h).
+     -> Liquid feeds (Tf <= Tf_bubble) are liquid from Tref, vapor feeds (Tf >= Tf_dew) liquid up to the saturation
+        temperature of each compound at Pf, vaporization and ideal gas up to Tf.
+     -> Two-phase feeds add the heat of vaporization of the vapor fraction of the feed flash at Tf and Pf.
+     The flash energy balances use the same outlet enthalpies, so hf is independent of the drum conditions.'''
+    Tf = np.asarray(Tf, dtype = float)
+    Pf = np.asarray(Pf, dtype = float)
+    K = table.K(Tf, Pf)
+    psi = np.asarray(rachfordRice(z, K))[..., None]
+    tb = table.Tsat(Pf)
+    h_liquid = cpl * (Tf[..., None] - Tref)
+    h_vapor = cpl * (tb - Tref) + table.HeatVap(tb, componentwise = True) + cpig * (Tf[..., None] - tb)
+    h_mixture = h_liquid + psi * K / (1 + psi * (K - 1)) * table.HeatVap(Tf)
+    liquid = np.asarray(Tf <= Tf_bubble)[..., None]
+    vapor = np.asarray(Tf >= Tf_dew)[..., None]
+    return np.where(liquid, h_liquid, np.where(vapor, h_vapor, h_mixture))
+
+def isothermalBatch(T, P, z, c, F = 1.0, Tf = None, Pf = None, energy = False, Tref = 298.15):
+    ''' Simulates N isothermal flash drums at once.
+     -> T and P are arrays (N,) with the operating temperatures in K and pressures in kPa.
+     -> z is a (N, C) matrix of feed molar compositions, with the columns in the order of the property table of c.
+     -> F, Tf and Pf are the feed molar flows, temperatures and pressures (scalars or arrays (N,)),
+        Tf and Pf are only required for the energy balance.
+     Returns a dict with the arrays Psi, x, y, V and L, and hf, hv, hl and Q if energy is True.'''
+    T = np.atleast_1d(np.asarray(T, dtype = float))
+    P = np.atleast_1d(np.asarray(P, dtype = float))
+    z = np.atleast_2d(np.asarray(z, dtype = float))
+    z = z / np.sum(z, axis = -1, keepdims = True)
+    N = np.broadcast(T, P, z[:, 0]).shape[0]
+    T = np.broadcast_to(T, (N,))
+    P = np.broadcast_to(P, (N,))
+    z = np.broadcast_to(z, (N, z.shape[1]))
+    F = np.broadcast_to(np.asarray(F, dtype = float), (N,))
+    table = propertyTable(c)
+    # Raoult's law K matrix (N, C)
+    K = table.K(T, P)
+    Psi = rachfordRice(z, K)
+    x = z / (1 + Psi[:, None] * (K - 1))
+    y = x * K
+    # Single phase outlets have no composition for the missing phase.
+    x = np.where(Psi[:, None] >= 1, 0.0, x)
+    y = np.where(Psi[:, None] <= 0, 0.0, np.where(Psi[:, None] >= 1, z, y))
+    V = Psi * F
+    L = F - V
+    results = {'Psi': Psi, 'x': x, 'y': y, 'V': V, 'L': L}
+
+    if energy:
+
+        Tf = np.broadcast_to(np.asarray(Tf, dtype = float), (N,))
+        Pf = np.broadcast_to(np.asarray(Pf, dtype = float), (N,))
+        Tf_bubble, _ = bubbleTnp(Pf, z, c)
+        Tf_dew, _ = dewTnp(Pf, z, c)
+        T_bubble, _ = bubbleTnp(P, z, c)
+        T_dew, _ = dewTnp(P, z, c)
+        # Saturation temperature of every pure component at the drum pressure.
+        tb = table.Tsat(P)
+        cpl = table.meanCPL(T_bubble * 0.8, T_dew * 1.2)
+        cpig = table.meanCPig(T_bubble * 0.8, T_dew * 1.2)
+        Tc = T[:, None]
+        hvap_T = table.HeatVap(T)
+        hvap_tb = table.HeatVap(tb, componentwise = True)
+        h_liquid = cpl * (Tc - Tref)
+        h_vapor = cpl * (tb - Tref) + hvap_tb + cpig * (Tc - tb)
+        h_mixture = cpl * (Tc - Tref) + hvap_T
+        hf = np.sum(z * feedEnthalpy(z, Tf, Pf, Tf_bubble, Tf_dew, table, cpl, cpig, Tref), axis = -1)
+        hl = np.sum(x * h_liquid, axis = -1)
+        hv = np.sum(y * np.where((Psi >= 1)[:, None], h_vapor, h_mixture), axis = -1)
+        results.update({'hf': hf, 'hv': hv, 'hl': hl, 'Q': V * hv + L * hl - F * hf})
+
+    return results
+
+def isothermalStreams(feed, T, P, c, energy = False, Tref = 298.15):
+    ''' Isothermal flash of a StreamBatch of feeds at arrays of temperatures T in K and pressures P in kPa,
+    with isothermalBatch. Returns the vapor and liquid outlets as StreamBatch objects, with their enthalpies
+    if energy is True (the heat Q is only returned by isothermalBatch).'''
+    table = propertyTable(c)
+    z = feed.mComposition if feed.index.names == table.compounds else np.column_stack([feed.mComposition[:, feed.index.positions[name]] if name in feed.index.positions else np.zeros(len(feed)) for name in table.compounds])
+    r = isothermalBatch(T, P, z, table, feed.molarFlow, feed.Temperature, feed.Pressure, energy, Tref)
+    T = np.broadcast_to(np.asarray(T, dtype = float), (len(feed),))
+    P = np.broadcast_to(np.asarray(P, dtype = float), (len(feed),))
+    vapor = StreamBatch(table.compounds, r['y'], T, P, r['V'], r.get('hv'), "VAPOR")
+    liquid = StreamBatch(table.compounds, r['x'], T, P, r['L'], r.get('hl'), "LIQUID")
+    return vapor, liquid
+
 def parameters(compounds):
 
+    compound_data = compoundData()
     p = {'Antoine': {compound: compound_data[compound]['Antoine'] for compound in compounds},
          'AntoineInv' : {compound: compound_data[compound]['Antoine'] for compound in compounds}, 
          'Hvap' : {compound: compound_data[compound]['Hvap'] for compound in compounds},
@@ -61,22 +613,371 @@ def parameters(compounds):
 
     return p
 
+def readCompoundData(path):
+    ''' Reads a compound database with the layout of compound_data.csv.'''
+    with open(path, mode = 'r') as csv_f:
+        reader = csv.reader(csv_f)
+        compound_data = {row[0]: {'Antoine': {'C1': float(row[7]), 'C2': float(row[8]), 'C3': float(row[9]), 'C4': float(row[10]), 'C5': float(row[11])},
+                                    'Hvap': {'Tc': float(row[1]), 'C1': float(row[12]), 'C2': float(row[13]), 'C3': float(row[14]), 'C4': float(row[15])},
+                                    'CPL': {'C1': float(row[2]), 'C2': float(row[3]), 'C3': float(row[4]), 'C4': float(row[5]), 'C5': float(row[6])},
+                                    'CPIG': {'C1': float(row[16]), 'C2': float(row[17]), 'C3': float(row[18]), 'C4': float(row[19]), 'C5': float(row[20])}} for row in reader}
+
+    return compound_data
+
+def compoundData():
+    ''' The compound database, it is read from COMPOUND_DATA on the first call and cached.'''
+    global _compound_data
+
+    if _compound_data is None:
+        _compound_data = CompoundStore(COMPOUND_DATA) if os.path.isdir(COMPOUND_DATA) else readCompoundData(COMPOUND_DATA)
+
+    return _compound_data
+
+def setCompoundData(path):
+    ''' Changes the compound database file, it is read again on the next use.'''
+    global COMPOUND_DATA, _compound_data
+    COMPOUND_DATA = path
+    _compound_data = None
+    thermoCache.clear()
+
+def __getattr__(name):
+    # flash.compound_data is still available, loaded on first access.
+    if name == 'compound_data':
+        return compoundData()
+
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+class PropertyTable():
+
+    def __init__(self, compounds, data = None):
+        ''' Compiled properties of a set of compounds.
+         The coefficients are stored as contiguous arrays (C, 5) in the order of compounds:
+         -> Antoine: C1 ... C5 of the extended Antoine equation.
+         -> Hvap: Tc, C1 ... C4 of the heat of vaporization equation.
+         -> CPL: C1 ... C5 of the liquid heat capacity polynomial.
+         -> CPIG: C1 ... C5 of the ideal gas heat capacity equation.
+         -> index maps every compound name to its column.
+         data is a dict like compoundData(), the module database is used by default.'''
+        data = compoundData() if data is None else data
+        self.compounds = tuple(compounds)
+        self.index = {compound: i for i, compound in enumerate(self.compounds)}
+
+        if isinstance(data, CompoundStore):
+            # Slice the coefficient rows of the store directly.
+            block = data.block(self.compounds)
+            self.Antoine = np.ascontiguousarray(block[:, 6:11])
+            self.Hvap = np.ascontiguousarray(block[:, [0, 11, 12, 13, 14]])
+            self.CPL = np.ascontiguousarray(block[:, 1:6])
+            self.CPIG = np.ascontiguousarray(block[:, 15:20])
+
+        else:
+            self.Antoine = self._stack(data, 'Antoine', ('C1', 'C2', 'C3', 'C4', 'C5'))
+            self.Hvap = self._stack(data, 'Hvap', ('Tc', 'C1', 'C2', 'C3', 'C4'))
+            self.CPL = self._stack(data, 'CPL', ('C1', 'C2', 'C3', 'C4', 'C5'))
+            self.CPIG = self._stack(data, 'CPIG', ('C1', 'C2', 'C3', 'C4', 'C5'))
+
+        self._groups = None
+        self._saturation = None
+        self.clearSurrogate()
+
+    def _stack(self, data, group, keys):
+
+        return np.ascontiguousarray([[data[compound][group][key] for key in keys] for compound in self.compounds], dtype = float)
+
+    @classmethod
+    def fromParameters(cls, c):
+        ''' Builds the table from the nested dicts returned by parameters().'''
+        compounds = list(c['Antoine'].keys())
+        data = {compound: {'Antoine': c['Antoine'][compound],
+                           'Hvap': c['Hvap'][compound],
+                           'CPL': c['CPL'][compound],
+                           'CPIG': c['CPig'][compound]} for compound in compounds}
+        return cls(compounds, data)
+
+    def __len__(self):
+
+        return len(self.compounds)
+
+    def __getitem__(self, group):
+        ''' Dict view with the same layout as parameters(), e.g. table['Antoine'][compound]['C1'].'''
+        if self._groups is None:
+
+            names = {'Antoine': ('C1', 'C2', 'C3', 'C4', 'C5'), 'Hvap': ('Tc', 'C1', 'C2', 'C3', 'C4'),
+                     'CPL': ('C1', 'C2', 'C3', 'C4', 'C5'), 'CPIG': ('C1', 'C2', 'C3', 'C4', 'C5')}
+            self._groups = {group: {compound: dict(zip(keys, [float(value) for value in getattr(self, group)[i]]))
+                                    for i, compound in enumerate(self.compounds)} for group, keys in names.items()}
+            self._groups['AntoineInv'] = self._groups['Antoine']
+            self._groups['CPig'] = self._groups['CPIG']
+
+        return self._groups[group]
+
+    def composition(self, mC):
+        ''' Molar composition dict as an array in the table order, missing compounds are zero.'''
+        if isinstance(mC, Composition):
+            return mC.array(self.compounds)
+
+        return np.array([mC.get(compound, 0.0) for compound in self.compounds], dtype = float)
+
+    def lnPsat(self, T):
+        ''' ln of the vapor pressures in kPa (..., C) for an array of temperatures T in K.'''
+        if self.surrogate is not None:
+            return self._surrogateValues(T, 0)
+
+        return self._lnPsat(T)
+
+    def dlnPsat(self, T):
+        ''' d ln(Psat) / d ln(T) (..., C) for an array of temperatures T in K.'''
+        if self.surrogate is not None:
+            return self._surrogateValues(T, 1)
+
+        return self._dlnPsat(T)
+
+    def _lnPsat(self, T):
+        # Extended Antoine equation.
+        T = np.asarray(T, dtype = float)[..., None]
+        A = self.Antoine
+        return A[:, 0] + A[:, 1] / T + A[:, 2] * np.log(T) + A[:, 3] * T ** A[:, 4] - np.log(1000.0)
+
+    def _dlnPsat(self, T):
+
+        T = np.asarray(T, dtype = float)[..., None]
+        A = self.Antoine
+        return -A[:, 1] / T + A[:, 2] + A[:, 3] * A[:, 4] * T ** A[:, 4]
+
+    def fitSurrogate(self, T_min = 200.0, T_max = None, degree = None, tol = 1e-8, n = 20000):
+        ''' Replaces the extended Antoine equation in lnPsat and dlnPsat (so in Psat, K and the bubble/dew kernels)
+        with Chebyshev polynomials of 1 / T between T_min and T_max (the highest critical temperature by default).
+        Every compound is fitted on the same range, so a batch evaluation is one Vandermonde matrix of the
+        temperatures times the (degree + 1, C) coefficients, without the log and the fractional power per compound.
+         -> degree is the polynomial degree, by default the lowest even degree up to 40 with a maximum error below tol,
+            a RuntimeWarning reports a fit that does not reach tol.
+         -> The error of ln(Psat), i.e. the relative error of Psat, is measured against the exact equation on n points
+            of the range and on the fitting nodes.
+         Temperatures outside the range, and calls with less than SURROGATE_MIN (temperature, compound) pairs,
+         use the exact equation. Returns self.surrogate, a dict with the range, the degree, tol, the achieved error
+         and the maximum error of every compound {compound: error}, clearSurrogate() removes it.'''
+        from numpy.polynomial import chebyshev
+        self.clearSurrogate()
+        T_max = float(self.Hvap[:, 0].max()) if T_max is None else float(T_max)
+        T_min = float(T_min)
+
+        if not 0 < T_min < T_max:
+            raise ValueError('The surrogate range must be 0 < T_min < T_max, got {} and {}'.format(T_min, T_max))
+
+        # u = -1 at T_max and 1 at T_min.
+        a, b = 1 / T_max, 1 / T_min
+        T_check = 2 / ((b - a) * np.linspace(-1.0, 1.0, n) + a + b)
+        exact = self._lnPsat(T_check)
+
+        for m in ([degree] if degree is not None else range(4, 41, 2)):
+
+            nodes = np.cos(np.pi * (np.arange(m + 1) + 0.5) / (m + 1))
+            coef = chebyshev.chebfit(nodes, self._lnPsat(2 / ((b - a) * nodes + a + b)), m)
+            error = np.abs(chebyshev.chebvander(np.linspace(-1.0, 1.0, n), m) @ coef - exact).max(axis = 0)
+
+            if error.max() <= tol:
+                break
+
+        if error.max() > tol:
+            warnings.warn("The surrogate of degree {} has a maximum ln(Psat) error of {:.3g} above tol = {:.3g}, "
+                          "narrow the range or raise tol".format(m, error.max(), tol), RuntimeWarning)
+
+        # d ln(Psat) / d ln(T) = -(1 / T) d ln(Psat) / d(1 / T) = -(2 / (b - a)) (1 / T) d ln(Psat) / du
+        dcoef = chebyshev.chebder(coef) * 2 / (b - a)
+        self._chebyshev = (a, b, coef, dcoef, chebyshev.chebvander)
+        self.surrogate = {'T_min': T_min, 'T_max': T_max, 'degree': m, 'tol': tol, 'error': float(error.max()),
+                          'max_error': dict(zip(self.compounds, [float(value) for value in error]))}
+        return self.surrogate
+
+    def clearSurrogate(self):
+
+        self.surrogate = None
+        self._chebyshev = None
+
+    def _surrogateValues(self, T, derivative):
+        ''' ln(Psat) (derivative 0) or d ln(Psat) / d ln(T) (derivative 1) with the surrogate, exact outside its range.'''
+        a, b, coef, dcoef, chebvander = self._chebyshev
+        T = np.asarray(T, dtype = float)
+        shape = T.shape
+        T = T.ravel()
+
+        # A few temperatures are cheaper with the exact equation than with the Vandermonde matrix.
+        if len(T) * len(self) < SURROGATE_MIN:
+            return (self._dlnPsat if derivative else self._lnPsat)(T).reshape(shape + (len(self),))
+
+        u = (2 / T - a - b) / (b - a)
+        inside = np.abs(u) <= 1
+
+        if derivative:
+            values = chebvander(np.clip(u, -1, 1), len(dcoef) - 1) @ dcoef * (-1 / T)[:, None]
+        else:
+            values = chebvander(np.clip(u, -1, 1), len(coef) - 1) @ coef
+
+        if not inside.all():
+            values[~inside] = (self._dlnPsat if derivative else self._lnPsat)(T[~inside])
+
+        return values.reshape(shape + (len(self),))
+
+    def Psat(self, T):
+        ''' Vapor pressures in kPa (..., C) for an array of temperatures T in K.'''
+        return np.exp(self.lnPsat(T))
+
+    def K(self, T, P):
+        ''' Ideal K values (..., C) with Raoult's Law for arrays of temperatures in K and pressures in kPa.'''
+        return self.Psat(T) / np.asarray(P, dtype = float)[..., None]
+
+    def saturationTable(self, n = 256):
+        ''' Precomputes the saturation curve of every compound on a uniform ln(P) grid of n nodes
+        between Psat(100 K) and Psat(800 K), used by Tsat for O(1) lookups.'''
+        lnP = self.lnPsat(np.array([100.0, 800.0]))
+        lnP0 = lnP[0]
+        dlnP = (lnP[1] - lnP[0]) / (n - 1)
+        grid = lnP0 + dlnP * np.arange(n)[:, None]
+        lnT = np.log(_antoineInverse(grid, self.Antoine)[0])
+        lnT[0], lnT[-1] = np.log(100.0), np.log(800.0)
+        self._saturation = (lnP0, dlnP, np.ascontiguousarray(lnT.T))
+        return self._saturation
+
+    def Tsat(self, P):
+        ''' Saturation temperatures in K (..., C) of every compound at an array of pressures P in kPa.
+        The saturation table gives a linear interpolation that is polished with one Halley step,
+        pressures outside the table are solved with the full Halley method.'''
+        lnP0, dlnP, lnT_grid = self._saturation if self._saturation is not None else self.saturationTable()
+        lnP = np.log(np.asarray(P, dtype = float))[..., None]
+        s = (lnP - lnP0) / dlnP
+        n = lnT_grid.shape[1]
+        inside = (s >= 0) & (s <= n - 1)
+        i = np.clip(s.astype(int), 0, n - 2)
+        w = np.clip(s - i, 0.0, 1.0)
+        columns = np.arange(len(self))
+        lnT = (1 - w) * lnT_grid[columns, i] + w * lnT_grid[columns, i + 1]
+        T, converged = _antoineInverse(lnP, self.Antoine, np.exp(lnT), maxiter = 1)
+
+        if not inside.all():
+            T = np.where(inside, T, _antoineInverse(lnP, self.Antoine)[0])
+
+        return T
+
+    def HeatVap(self, T, componentwise = False):
+        ''' Heats of vaporization in kJ/mol (..., C) for an array of temperatures T in K.
+        If componentwise is True, T is already (..., C) with one temperature per compound.'''
+        T = np.asarray(T, dtype = float)
+        T = T if componentwise else T[..., None]
+        H = self.Hvap
+        Tr = T / H[:, 0]
+        return H[:, 1] * (1 - Tr) ** (H[:, 2] + H[:, 3] * Tr + H[:, 4] * Tr * Tr) / 1e6
+
+    def dHeatVap(self, T, componentwise = False):
+        ''' Temperature derivatives of the heats of vaporization in kJ/mol K (..., C), T as in HeatVap.'''
+        T = np.asarray(T, dtype = float)
+        T = T if componentwise else T[..., None]
+        H = self.Hvap
+        Tr = T / H[:, 0]
+        e = H[:, 2] + H[:, 3] * Tr + H[:, 4] * Tr * Tr
+        dlnH = ((H[:, 3] + 2 * H[:, 4] * Tr) * np.log(1 - Tr) - e / (1 - Tr)) / H[:, 0]
+        return self.HeatVap(T, componentwise = True) * dlnH
+
+    def meanCPL(self, T1, T2):
+        ''' Mean liquid heat capacities in kJ/mol K (..., C) between the arrays of temperatures T1 and T2.'''
+        T1 = np.asarray(T1, dtype = float)[..., None]
+        T2 = np.asarray(T2, dtype = float)[..., None]
+        return (intCP_L(T2, *self.CPL.T) - intCP_L(T1, *self.CPL.T)) / (T2 - T1)
+
+    def meanCPig(self, T1, T2):
+        ''' Mean ideal gas heat capacities in kJ/mol K (..., C) between the arrays of temperatures T1 and T2.'''
+        T1 = np.asarray(T1, dtype = float)[..., None]
+        T2 = np.asarray(T2, dtype = float)[..., None]
+        return (intCP_ig(T2, *self.CPIG.T) - intCP_ig(T1, *self.CPIG.T)) / (T2 - T1)
+
+    def dMeanCP(self, T1, T2, ideal = False):
+        ''' Derivatives (d / dT1, d / dT2) of the mean liquid (or, with ideal, ideal gas) heat capacities (C,) between T1 and T2.'''
+        if ideal:
+            C = self.CPIG.T
+            cp1, cp2 = [(C[0] + C[1] * ((C[2] / T) / np.sinh(C[2] / T)) ** 2 + C[3] * ((C[4] / T) / np.cosh(C[4] / T)) ** 2) / 1e6 for T in (T1, T2)]
+            mean = self.meanCPig(T1, T2)
+        else:
+            cp1, cp2 = CP_L(T1, *self.CPL.T), CP_L(T2, *self.CPL.T)
+            mean = self.meanCPL(T1, T2)
+
+        return (mean - cp1) / (T2 - T1), (cp2 - mean) / (T2 - T1)
+
+def propertyTable(c):
+    ''' Returns c if it is already a PropertyTable, otherwise compiles the dict from parameters().'''
+    if isinstance(c, PropertyTable):
+        return c
+
+    return PropertyTable.fromParameters(c)
+
+
+
+
+
+def _resultCached(kind):
+    ''' FlashDrum method decorator: with a drum resultCache (result_cache.ResultCache) the result is looked up
+    by the feed, the arguments, the engine and the property data of c before it is calculated. The bubble and
+    dew temperatures store their value, the flash drums the state of the drum and its streams.'''
+    def decorator(method):
+
+        signature = inspect.signature(method)
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+
+            cache = self.resultCache
+
+            if cache is None or kwargs.get('sensitivity'):
+                return method(self, *args, **kwargs)
+
+            arguments = signature.bind(self, *args, **kwargs)
+            arguments.apply_defaults()
+            arguments = dict(arguments.arguments)
+            table = propertyTable(arguments.pop('c'))
+            state = [self.engine] + [value for name, value in arguments.items() if name not in ('self', 'sensitivity')]
+
+            if kind != 'saturation':
+                state += [self.feed.getT(), self.feed.getP(), self.feed.getmF(), self.Tref]
+
+            key = cache.key(method.__name__, table, self.feed.getmC(), state)
+            value = cache.get(key)
+
+            if value is not None:
+                return self._restore(value) if kind != 'saturation' else value
+
+            value = method(self, *args, **kwargs)
+            cache.put(key, self._snapshot() if kind != 'saturation' else float(value))
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def _phaseBoundary(method):
+    ''' FlashDrum bubbleT/dewT decorator: memoizes the temperature per pressure, engine and vapor pressure data
+    in self.boundaries, the phase-boundary record of the current feed that setFeedStream clears.'''
+    @wraps(method)
+    def wrapper(self, P, c):
 
-with open('compound_data.csv', mode = 'r') as csv_f:
-    reader = csv.reader(csv_f)
-    compound_data = {row[0]: {'Antoine': {'C1': float(row[7]), 'C2': float(row[8]), 'C3': float(row[9]), 'C4': float(row[10]), 'C5': float(row[11])},
-                                'Hvap': {'Tc': float(row[1]), 'C1': float(row[12]), 'C2': float(row[13]), 'C3': float(row[14]), 'C4': float(row[15])},
-                                'CPL': {'C1': float(row[2]), 'C2': float(row[3]), 'C3': float(row[4]), 'C4': float(row[5]), 'C5': float(row[6])},
-                                'CPIG': {'C1': float(row[16]), 'C2': float(row[17]), 'C3': float(row[18]), 'C4': float(row[19]), 'C5': float(row[20])}} for row in reader}
-    csv_f.close()
+        # A parameters() dict is keyed on its Antoine coefficients, it is not compiled into a PropertyTable.
+        if isinstance(c, PropertyTable):
+            data = (c.compounds, c.Antoine.tobytes())
+        else:
+            data = tuple((key, tuple(values.values())) for key, values in c['Antoine'].items())
+
+        key = (method.__name__, float(P), self.engine, data)
 
+        if key not in self.boundaries:
+            self.boundaries[key] = method(self, P, c)
 
+        return self.boundaries[key]
 
+    return wrapper
 
 
 class FlashDrum():
 
-    def __init__(self, mode = 'Isothermal'):
+    def __init__(self, mode = 'Isothermal', engine = 'gekko', resultCache = None):
         ''' The Flash Drum has one inlet stream and two outlet stream.
          The program uses the class Stream to represent the inlet and outlet process streams.
          -> feed is the inlet object from the class Stream.
@@ -88,6 +989,11 @@ class FlashDrum():
          -> Temperature is the Flash Drum operating temperature in K.
          -> Pressure is the Flash Drum operating pressure kPa.
          -> Tref is the reference temperature in K for the energy balance calculations. 
+         -> engine is the solver used for the Rachford-Rice equation, default is "gekko", it also can be "numpy".
+         -> iterations are the outer and inner iterations of the last adiabatic flash with the numpy engine.
+         -> sensitivities are the derivatives of the last flash solved with sensitivity = True.
+         -> resultCache is an optional persistent result_cache.ResultCache for isothermal, bubbleT and dewT.
+         -> boundaries are the bubble and dew temperatures of the feed already solved, by pressure.
          This class only works with pressure in kPa and temperature in K. '''
         self.feed = Stream("FEED")
         self.vapor = Stream("VAPOR")
@@ -98,11 +1004,18 @@ class FlashDrum():
         self.Temperature = None
         self.Pressure = None
         self.Tref = 298.15
+        self.engine = engine
+        self.iterations = None
+        self.sensitivities = None
+        self.resultCache = resultCache
+        self.boundaries = {}
+        self._slope = None
 
 
     def setFeedStream(self, inletStream = Stream("FEED")):
-        '''Set the feed stream properties.'''
+        '''Set the feed stream properties, a new feed clears the phase-boundary record.'''
         inletStream.normalize()
+        self.boundaries = {}
         self.feed.setT(inletStream.Temperature)
         self.feed.setP(inletStream.Pressure)
         self.feed.setmF(inletStream.molarFlow)
@@ -208,19 +1121,19 @@ class FlashDrum():
                 'Temeperature': self.feed.getT(),
                 'Pressure': self.feed.getP(),
                 'Molar Flow': self.feed.getmF(),
-                'Molar Composition': self.feed.getmC(),
+                'Molar Composition': dict(self.feed.getmC()),
                 'Enthalpy': self.feed.getH()}
         vapor = {'name': self.vapor.getName(),
                 'Temeperature': self.vapor.getT(),
                 'Pressure': self.vapor.getP(),
                 'Molar Flow': self.vapor.getmF(),
-                'Molar Composition': self.vapor.getmC(),
+                'Molar Composition': dict(self.vapor.getmC()),
                 'Enthalpy': self.vapor.getH()}
         liquid = {'name': self.liquid.getName(),
                 'Temeperature': self.liquid.getT(),
                 'Pressure': self.liquid.getP(),
                 'Molar Flow': self.liquid.getmF(),
-                'Molar Composition': self.liquid.getmC(),
+                'Molar Composition': dict(self.liquid.getmC()),
                 'Enthalpy': self.liquid.getH()}
         Q = self.Heat
         Psi = self.psi
@@ -232,40 +1145,74 @@ class FlashDrum():
         return  results
 
 
+    def _snapshot(self):
+        ''' Results of the drum as JSON values, see _restore.'''
+        streams = {name: [stream.getT(), stream.getP(), stream.getmF(), stream.getH(), {key: float(value) for key, value in stream.getmC().items()}]
+                   for name, stream in (('vapor', self.vapor), ('liquid', self.liquid))}
+        return {'mode': self.mode, 'psi': float(self.psi), 'Heat': self.Heat, 'Temperature': self.Temperature, 'Pressure': self.Pressure,
+                'iterations': self.iterations, 'slope': self._slope, 'feed': self.feed.getH(), 'streams': streams}
+
+
+    def _restore(self, snapshot):
+        ''' Sets the results of the drum from a _snapshot.'''
+        self.mode = snapshot['mode']
+        self.psi = snapshot['psi']
+        self.Heat = snapshot['Heat']
+        self.Temperature = snapshot['Temperature']
+        self.Pressure = snapshot['Pressure']
+        self.iterations = snapshot['iterations']
+        self._slope = snapshot['slope']
+        self.feed.setH(snapshot['feed'])
+
+        for name, (T, P, mF, H, mC) in snapshot['streams'].items():
+
+            stream = getattr(self, name)
+            stream.setT(T)
+            stream.setP(P)
+            stream.setmF(mF)
+            stream.setH(H)
+            stream.setmC(mC)
+
+
+    def _clearOutlets(self):
+        # Zero outlet compositions on the feed components, the solvers then set every compound in place.
+        index = self.feed.getmC().index
+        self.vapor.setmC(Composition(index = index))
+        self.liquid.setmC(Composition(index = index))
+
+    def _setOutlets(self, x, y):
+        # Liquid and vapor compositions from arrays (or scalars) in the order of the feed components.
+        index = self.feed.getmC().index
+        self.liquid.setmC(Composition(np.broadcast_to(x, len(index)), index))
+        self.vapor.setmC(Composition(np.broadcast_to(y, len(index)), index))
+
+    def feedComposition(self, c):
+        ''' Feed molar composition as an array in the component order of c.'''
+        return propertyTable(c).composition(self.feed.getmC())
+
+
     def idealK(self, T, P, c):
         ''' Caculates an ideal K parameter with Raoult's Law'''
         Psat = Antoine(T, **c)
         return Psat / P
 
 
-    def isothermal(self, T, P, c, energy = False):
-        ''' Simulates an Isothermal Flash Drum given an operating temperature and pressure.'''
+    @_resultCached('flash')
+    def isothermal(self, T, P, c, energy = False, sensitivity = False):
+        ''' Simulates an Isothermal Flash Drum given an operating temperature and pressure.
+        With sensitivity the exact derivatives of Psi, x and y with respect to T, P and the feed
+        composition are stored in self.sensitivities (see isothermalSensitivities).'''
         self.mode = "Isothermal"
         self.vapor.setT(T)
         self.vapor.setP(P)
         self.liquid.setT(T)
         self.liquid.setP(P)
-        self.vapor.setmC(None)
-        self.liquid.setmC(None)
+        self._clearOutlets()
         Tf_bubble = self.bubbleT(self.feed.getP(), c)
         Tf_dew = self.dewT(self.feed.getP(), c)
         T_bubble = self.bubbleT(P, c)
         T_dew = self.dewT(P, c)
         Tf = self.feed.getT()
-        Tf_mode = None
-        # Check for the feedstream condition
-        if Tf <= Tf_bubble:
-
-            Tf_mode = "liquid"
-
-        elif Tf >= Tf_dew:
-
-            Tf_mode = "vapor"
-
-        else:
-
-            Tf_mode = "mixture"
-
         Tref = self.Tref            
         cpl = {}
         cpig = {}
@@ -274,6 +1221,13 @@ class FlashDrum():
         hl = {}
         tb = {}
 
+        if energy:
+            # Feed enthalpy at the feed conditions, shared with the adiabatic flash.
+            table = propertyTable(c)
+            h = feedEnthalpy(table.composition(self.feed.getmC()), Tf, self.feed.getP(), Tf_bubble, Tf_dew, table,
+                             table.meanCPL(T_bubble * 0.8, T_dew * 1.2), table.meanCPig(T_bubble * 0.8, T_dew * 1.2), Tref)
+            hf = {key: self.feed.getmC(key) * float(h[table.index[key]]) for key in self.feed.getmC().keys()}
+
         ### MATERIAL BALANCE AND ENERGY BALANCE
         # Check if the operating temperature is between the limits for the PSI calculations.
 
@@ -285,10 +1239,7 @@ class FlashDrum():
             self.vapor.setmF(0) 
             self.liquid.setmF(self.feed.getmF())
 
-            for key in self.feed.getmC().keys():
-
-                self.liquid.setmC((self.feed.getmC(key)), key)
-                self.vapor.setmC(0, key)
+            self._setOutlets(self.feed.getmC().array(), 0.0)
 
             ## ENERGY BALANCE, if enabled ...
             if energy:
@@ -297,21 +1248,6 @@ class FlashDrum():
                     # Mean heat capacity
                     cpl[key] = meanCP(CP_L, T_bubble * 0.8,  T_dew * 1.2, tuple([value for value in c['CPL'][key].values()]))
                     # Enthalply calculation.
-                    if Tf_mode == "liquid":
-
-                        hf[key] = self.feed.getmC(key) * cpl[key] * (Tf - Tref)
-                        
-
-                    elif Tf_mode == "vapor":
-
-                        cpig[key] = meanCP(CP_ig, T_bubble * 0.8,  T_dew * 1.2, tuple([value for value in c['CPig'][key].values()]))
-                        tb[key] = AntoineInv(P, **c['AntoineInv'][key])
-                        hf[key] = self.feed.getmC(key) * (cpl[key] * (tb[key] - Tref) + HeatVap(tb[key], **c['Hvap'][key]) + cpig[key] * (T - tb[key]))
-
-                    else:
-
-                         hf[key] = self.feed.getmC(key) * (cpl[key] * (T - Tref) + HeatVap(T, **c['Hvap'][key]))
-
                     hl[key] = self.liquid.getmC(key) * cpl[key] * (T - Tref)
                     hv[key] = 0.0
 
@@ -329,10 +1265,7 @@ class FlashDrum():
             self.vapor.setmF(self.feed.getmF()) 
             self.liquid.setmF(0)
 
-            for key in self.feed.getmC().keys():
-
-                self.liquid.setmC(0, key)
-                self.vapor.setmC(self.feed.getmC(key), key)
+            self._setOutlets(0.0, self.feed.getmC().array())
 
             ## ENERGY BALANCE, if enabled ...
             if energy:
@@ -342,19 +1275,6 @@ class FlashDrum():
                     cpl[key] = meanCP(CP_L, T_bubble * 0.8,  T_dew * 1.2, tuple([value for value in c['CPL'][key].values()]))
                     cpig[key] = meanCP(CP_ig, T_bubble * 0.8,  T_dew * 1.2, tuple([value for value in c['CPig'][key].values()]))
                     # Enthalply calculation.
-                    if Tf_mode == "liquid":
-
-                        hf[key] = self.feed.getmC(key) * cpl[key] * (Tf - Tref)                        
-
-                    elif Tf_mode == "vapor":
-
-                        tb[key] = AntoineInv(P, **c['AntoineInv'][key])
-                        hf[key] = self.feed.getmC(key) * (cpl[key] * (tb[key] - Tref) + HeatVap(tb[key], **c['Hvap'][key]) + cpig[key] * (T - tb[key]))
-
-                    else:
-
-                         hf[key] = self.feed.getmC(key) * (cpl[key] * (T - Tref) + HeatVap(T, **c['Hvap'][key]))
-
                     hl[key] = 0
                     tb[key] = AntoineInv(P, **c['AntoineInv'][key])
                     hv[key] = self.vapor.getmC(key) * (cpl[key] * (tb[key] - Tref) + HeatVap(tb[key], **c['Hvap'][key]) + cpig[key] * (T - tb[key]))
@@ -369,29 +1289,38 @@ class FlashDrum():
         # DRUM TEMPERATURE BETWEEN BUBBLE AND DEW TEMPERATURES
         else:
             ## MATERIAL BALANCE
-            # Create a gekko model for solve the equations system
-            m = GEKKO()        
-            # Ki calculations.
-            Ki = {}
+            if self.engine == 'numpy':
+                # Solve the Rachford-Rice equation with NumPy.
+                table = propertyTable(c)
+                K = table.K(T, P)
+                Ki = {key: float(K[table.index[key]]) for key in self.feed.getmC().keys()}
+                self.psi = float(rachfordRice(table.composition(self.feed.getmC()), K))
 
-            for key in self.feed.getmC().keys():
+            else:
+                # Create a gekko model for solve the equations system
+                m = GEKKO()        
+                # Ki calculations.
+                Ki = {}
+
+                for key in self.feed.getmC().keys():
+
+                    K = m.Intermediate(self.idealK(T,P, c['Antoine'][key]))
+                    Ki[key] = K
+                
+                Psi = m.Var(value=0.5, lb= 0.0, ub = 1.0)
+                x = sum([((self.feed.getmC(key) * (1 - Ki[key])) / (1 + Psi * (Ki[key] - 1))) for key in Ki.keys()])
+                m.Equation([x == 0])
+                m.solve(disp=False) 
+                self.psi = float(Psi.value[0]) 
+                Ki = {key: Ki[key][0] for key in Ki.keys()}
 
-                K = m.Intermediate(self.idealK(T,P, c['Antoine'][key]))
-                Ki[key] = K
-            
-            Psi = m.Var(value=0.5, lb= 0.0, ub = 1.0)
-            x = sum([((self.feed.getmC(key) * (1 - Ki[key])) / (1 + Psi * (Ki[key] - 1))) for key in Ki.keys()])
-            m.Equation([x == 0])
-            m.solve(disp=False) 
-            self.psi = float(Psi.value[0]) 
             # Calulate vapor and liquid molar flows.
             self.vapor.setmF(self.psi * self.feed.getmF()) 
             self.liquid.setmF(self.feed.getmF() - self.vapor.getmF())
             # Calculate vapor and liquid molar compositions
-            for key in Ki.keys():
-
-                self.liquid.setmC((self.feed.getmC(key)) / (1 + self.psi * (Ki[key][0] - 1)), key)
-                self.vapor.setmC(self.liquid.getmC(key)  * Ki[key][0], key)
+            K = np.array([Ki[key] for key in self.feed.getmC().keys()], dtype = float)
+            x = self.feed.getmC().array() / (1 + self.psi * (K - 1))
+            self._setOutlets(x, x * K)
         
             ## ENERGY BALANCE, if enabled ...        
             if energy:
@@ -400,20 +1329,6 @@ class FlashDrum():
                     # Mean heat capacity
                     cpl[key] = meanCP(CP_L, T_bubble * 0.8,  T_dew * 1.2, tuple([value for value in c['CPL'][key].values()]))
                     # Enthalply calculation.
-                    if Tf_mode == "liquid":
-
-                        hf[key] = self.feed.getmC(key) * cpl[key] * (Tf - Tref)                     
-
-                    elif Tf_mode == "vapor":
-
-                        cpig[key] = meanCP(CP_ig, T_bubble * 0.8,  T_dew * 1.2, tuple([value for value in c['CPig'][key].values()]))
-                        tb[key] = AntoineInv(P, **c['AntoineInv'][key])
-                        hf[key] = self.feed.getmC(key) * (cpl[key] * (tb[key] - Tref) + HeatVap(tb[key], **c['Hvap'][key]) + cpig[key] * (T - tb[key]))
-
-                    else:
-
-                         hf[key] = self.feed.getmC(key) * (cpl[key] * (T - Tref) + HeatVap(T, **c['Hvap'][key]))
-
                     hl[key] = self.liquid.getmC(key) * cpl[key] * (T - Tref)
                     hv[key] = self.vapor.getmC(key) * (cpl[key] * (T - Tref) + HeatVap(T, **c['Hvap'][key]))
 
@@ -424,15 +1339,26 @@ class FlashDrum():
                 # Energy balance for heat (Q) caculation.
                 self.Heat = self.vapor.getmF() * self.vapor.getH() + self.liquid.getmF() * self.liquid.getH() - self.feed.getmF() * self.feed.getH()
 
+        if sensitivity:
+
+            table = propertyTable(c)
+            self.sensitivities = isothermalSensitivities(table.composition(self.feed.getmC()), table.K(T, P), table.dlnPsat(T),
+                                                         self.psi, T, P, table.compounds)
+
+
+    def adiabatic(self, P, c, T0 = None, sensitivity = False):
+        ''' It makes adibatic flash caculations given an operating pressure.
+        With the numpy engine T0 is an optional initial guess of the drum temperature (warm start).
+        With sensitivity the exact derivatives of T, Psi, x and y with respect to P, the feed enthalpy and
+        the feed composition are stored in self.sensitivities (see adiabaticSensitivities).'''
+        if self.engine == 'numpy':
+            return self.adiabaticNumpy(P, c, T0, sensitivity = sensitivity)
 
-    def adiabatic(self, P, c):
-        ''' It makes adibatic flash caculations given an operating pressure.'''
         self.mode ="Adiabatic"
         self.Pressure = P
         self.vapor.setP(P)
         self.liquid.setP(P)
-        self.vapor.setmC(None)
-        self.liquid.setmC(None)        
+        self._clearOutlets()
         Tf_bubble = self.bubbleT(self.feed.getP(), c)
         Tf_dew = self.dewT(self.feed.getP(), c)
         Tf = self.feed.getT()
@@ -506,10 +1432,9 @@ class FlashDrum():
             self.vapor.setmF( self.psi * self.feed.getmF()) 
             self.liquid.setmF(self.feed.getmF() - self.vapor.getmF())
             # Calculate vapor and liquid molar compositions
-            for key in Ki.keys():
-
-                self.liquid.setmC((self.feed.getmC(key)) / (1 + self.psi * (Ki[key] - 1)), key)
-                self.vapor.setmC(self.liquid.getmC(key)  * Ki[key], key)
+            K = np.array([Ki[key] for key in self.feed.getmC().keys()], dtype = float)
+            x = self.feed.getmC().array() / (1 + self.psi * (K - 1))
+            self._setOutlets(x, x * K)
 
             #Real Energy Balance        
             for key in self.feed.getmC().keys():
@@ -529,6 +1454,17 @@ class FlashDrum():
             self.liquid.setT(self.Temperature)
             self.Heat = Q
 
+            if sensitivity:
+
+                table = propertyTable(c)
+                z = table.composition(self.feed.getmC())
+                T = self.Temperature
+                cpl = table.meanCPL(T_bubble * 0.8, T_dew * 1.2)
+                dcpl = heatCapacityWindow(table, z, P, T_bubble, T_dew)[0]
+                self.sensitivities = adiabaticSensitivities(z, table.K(T, P), table.dlnPsat(T), self.psi, T, P, cpl, table.HeatVap(T),
+                                                            table.dHeatVap(T), cpl * (Tf - Tref), Tref, table.compounds,
+                                                            (z * (T - Tf)) @ dcpl)
+
         else:
 
             self.mode ="Adiabatic: NO SOLVED!"
@@ -542,16 +1478,210 @@ class FlashDrum():
             self.liquid.setP(0)
             self.Heat = 0
 
-            for key in self.feed.getmC().keys():
-
-                self.vapor.setmC(0, key)
-                self.liquid.setmC(0, key)
+            self._clearOutlets()
 
         
 
 
+    def adiabaticNumpy(self, P, c, T0 = None, tol = 1e-10, maxiter = 100, sensitivity = False):
+        ''' Adiabatic flash for liquid, vapor and two-phase feeds with a nested NumPy solver.
+        The inner loop solves the Rachford-Rice equation at a drum temperature and the outer loop is a
+        safeguarded secant method on the enthalpy residual h(T) - hf between the bubble and dew temperatures.
+        T0 is an optional initial guess of the drum temperature, the outer and inner (Rachford-Rice)
+        iterations are stored in self.iterations. With sensitivity the derivatives of the solution are
+        stored in self.sensitivities.'''
+        table = propertyTable(c)
+        self.mode ="Adiabatic"
+        self.Pressure = P
+        self.vapor.setP(P)
+        self.liquid.setP(P)
+        self._clearOutlets()
+        z = table.composition(self.feed.getmC())
+        Tf = self.feed.getT()
+        Pf = self.feed.getP()
+        Tref = self.Tref
+        T_bubble = self.bubbleT(P, table)
+        T_dew = self.dewT(P, table)
+        Tf_bubble = self.bubbleT(Pf, table)
+        Tf_dew = self.dewT(Pf, table)
+        # Mean heat capacities
+        cpl = table.meanCPL(T_bubble * 0.8, T_dew * 1.2)
+        cpig = table.meanCPig(T_bubble * 0.8, T_dew * 1.2)
+
+        def vaporH(T, Ps):
+            # Liquid up to the saturation temperature of each compound, vaporization and ideal gas up to T.
+            tb = table.Tsat(Ps)
+            return cpl * (tb - Tref) + table.HeatVap(tb, componentwise = True) + cpig * (T - tb)
+
+        # Feed enthalpy at the feed conditions, the same as the isothermal flash.
+        dhf = feedEnthalpy(z, Tf, Pf, Tf_bubble, Tf_dew, table, cpl, cpig, Tref)
+        hf = np.sum(z * dhf)
+        # d hf / d cpl and d hf / d cpig
+        hf_cp = (z * (Tf - Tref), 0.0)
+
+        if Tf >= Tf_dew:
+
+            tb_f = table.Tsat(Pf)
+            hf_cp = (z * (tb_f - Tref), z * (Tf - tb_f))
+
+        elif Tf > Tf_bubble:
+
+            K = table.K(Tf, Pf)
+            psi_f = rachfordRice(z, K)
+            D = 1 + psi_f * (K - 1)
+            hv_f = table.HeatVap(Tf)
+            # d hf / dz through the feed vapor fraction, dPsi_f / dz from the Rachford-Rice equation.
+            dpsi_f = ((K - 1) / D) / np.sum(z * (K - 1) ** 2 / D ** 2)
+            dhf = dhf + np.sum(hv_f * z * K / D ** 2) * dpsi_f
+
+        outer = 0
+        inner = 0
+        clamped = False
+        h_bubble = np.sum(z * cpl * (T_bubble - Tref))
+        h_dew = np.sum(z * (cpl * (T_dew - Tref) + table.HeatVap(T_dew)))
+
+        ## LIQUID OUTLET: the feed enthalpy is below the bubble point enthalpy.
+        if hf <= h_bubble:
+
+            T = Tref + hf / np.sum(z * cpl)
+            psi = 0.0
+            K = table.K(T, P)
+
+        ## VAPOR OUTLET: the feed enthalpy is above the dew point enthalpy.
+        elif hf >= h_dew:
+
+            # The vapor enthalpy is linear in T.
+            tb = table.Tsat(P)
+            T = (hf - np.sum(z * (cpl * (tb - Tref) + table.HeatVap(tb, componentwise = True) - cpig * tb))) / np.sum(z * cpig)
+            # Between the two-phase and the vapor enthalpies of the dew point there is no adiabatic solution,
+            # the drum stays at the dew point and self.Heat reports the duty of the energy balance.
+            clamped = T < T_dew
+            T = max(T, T_dew)
+            psi = 1.0
+            K = table.K(T, P)
+
+        ## TWO PHASES: secant method on h(T) - hf, bracketed by [T_bubble, T_dew].
+        else:
+
+            def residual(T, psi0):
+
+                K = table.K(T, P)
+                psi, n = rachfordRice(z, K, psi0, full_output = True)
+                y = z * K / (1 + psi * (K - 1))
+                return np.sum(z * cpl * (T - Tref)) + psi * np.sum(y * table.HeatVap(T)) - hf, psi, K, n
+
+            lo, r_lo = T_bubble, h_bubble - hf
+            hi, r_hi = T_dew, h_dew - hf
+            warm = T0 is not None and T_bubble < T0 < T_dew
+            T = T0 if warm else 0.5 * (T_bubble + T_dew)
+            psi = self.psi if warm and 0 < self.psi < 1 else None
+            # A warm start also reuses the slope dh/dT of the previous solution for the first step.
+            slope = self._slope if warm else None
+            T_old, r_old = (lo, r_lo) if abs(T - lo) > abs(T - hi) else (hi, r_hi)
+
+            for outer in range(1, maxiter + 1):
+
+                r, psi, K, n = residual(T, psi)
+                inner += n
+
+                if r < 0:
+                    lo, r_lo = T, r
+                else:
+                    hi, r_hi = T, r
+
+                if r != r_old:
+                    slope = slope if outer == 1 and slope else (r - r_old) / (T - T_old)
+                    T_new = T - r / slope
+                else:
+                    T_new = 0.5 * (lo + hi)
+
+                if not (lo < T_new < hi):
+                    T_new = 0.5 * (lo + hi)
+
+                T_old, r_old = T, r
+
+                if abs(T_new - T) < tol * T or r == 0:
+                    break
+
+                T = T_new
+
+            psi = float(psi)
+            self._slope = slope
+
+        self.psi = psi
+        self.Temperature = float(T)
+        self.iterations = {'outer': outer, 'inner': inner}
+        x = z / (1 + psi * (K - 1)) if psi < 1 else np.zeros(len(z))
+        y = x * K if psi < 1 else z
+        y = y if psi > 0 else np.zeros(len(z))
+        # Calulate vapor and liquid molar flows.
+        self.vapor.setmF(psi * self.feed.getmF())
+        self.liquid.setmF(self.feed.getmF() - self.vapor.getmF())
+        # Calculate vapor and liquid molar compositions
+        order = [table.index[key] for key in self.feed.getmC().keys()]
+        self._setOutlets(x[order], y[order])
+
+        # Energy balance
+        self.feed.setH(float(hf))
+        self.liquid.setH(float(np.sum(x * cpl * (T - Tref))))
+
+        if psi >= 1:
+            self.vapor.setH(float(np.sum(y * vaporH(T, P))))
+        else:
+            self.vapor.setH(float(np.sum(y * (cpl * (T - Tref) + table.HeatVap(T)))))
+
+        self.Heat = self.vapor.getmF() * self.vapor.getH() + self.liquid.getmF() * self.liquid.getH() - self.feed.getmF() * self.feed.getH()
+        self.vapor.setT(self.Temperature)
+        self.liquid.setT(self.Temperature)
+
+        if clamped:
+            warnings.warn("No adiabatic solution at P = {} kPa, the drum is held at the dew point with Q = {:.6g} kJ".format(P, self.Heat),
+                          RuntimeWarning)
+
+        if sensitivity:
+
+            single = None
+            h_cp = (z * (T - Tref), 0.0)
+
+            if psi <= 0:
+                # h = sum(z cpl (T - Tref))
+                single = (np.sum(z * cpl), np.concatenate([[0.0, -1.0], cpl * (T - Tref) - dhf]))
+            elif psi >= 1:
+                # h = sum(z (a + cpig T)), a depends on P through the saturation temperatures.
+                a = cpl * (tb - Tref) + table.HeatVap(tb, componentwise = True) - cpig * tb
+                dtb = tb / (P * np.diag(table.dlnPsat(tb)))
+                dhdP = np.sum(z * (cpl + table.dHeatVap(tb, componentwise = True) - cpig) * dtb)
+                single = (np.sum(z * cpig), np.concatenate([[dhdP, -1.0], a + cpig * T - dhf]))
+                h_cp = (z * (tb - Tref), z * (T - tb))
+
+            if clamped:
+                # T = T_dew(P, z) does not depend on the feed enthalpy nor on the heat capacities.
+                Kd = table.K(T_dew, P)
+                sd = np.sum(z / Kd * table.dlnPsat(T_dew)) / T_dew
+                single = (-1.0, np.concatenate([[1 / (P * sd), 0.0], 1 / (Kd * sd)]))
+                h_cp = hf_cp
+
+            dcpl, dcpig = heatCapacityWindow(table, z, P, T_bubble, T_dew)
+            dr = (h_cp[0] - hf_cp[0]) @ dcpl + (h_cp[1] - hf_cp[1]) * np.ones(len(z)) @ dcpig
+            # The heats of vaporization at T only enter the two-phase energy balance.
+            hv, dhv = (table.HeatVap(T), table.dHeatVap(T)) if single is None else (None, None)
+            self.sensitivities = adiabaticSensitivities(z, K, table.dlnPsat(T), psi, T, P, cpl, hv, dhv, dhf, Tref,
+                                                        table.compounds, dr, single)
+
+
+    @_phaseBoundary
+    @_resultCached('saturation')
     def bubbleT(self, P, c):
         ''' Bubble temperature calculation given an operating pressure.'''
+        if self.engine == 'numpy':
+
+            T, converged = bubbleTnp(P, self.feedComposition(c), c)
+
+            if not converged:
+                raise ValueError("Bubble temperature not found at P = {} kPa".format(P))
+
+            return float(T)
+
         m = GEKKO()
 
         T = m.Var(value = 298.15, lb = 0.0, ub = 800.0)
@@ -568,8 +1698,19 @@ class FlashDrum():
         return round(T.value[0], 2)
 
 
+    @_phaseBoundary
+    @_resultCached('saturation')
     def dewT(self, P, c ):
         ''' Dew temperature calculation given an operating pressure.'''
+        if self.engine == 'numpy':
+
+            T, converged = dewTnp(P, self.feedComposition(c), c)
+
+            if not converged:
+                raise ValueError("Dew temperature not found at P = {} kPa".format(P))
+
+            return float(T)
+
         m = GEKKO()
 
         T = m.Var(value = 298.15, lb = 200.0, ub = 800.0)
@@ -586,16 +1727,68 @@ class FlashDrum():
         return round(T.value[0], 2)
 
 
+    def phaseEnvelope(self, c, psi = (), P_min = 1.0, P_max = None, T_max = None, **options):
+        ''' Phase envelope of the feed in the T-P plane: bubble and dew curves and optional lines of constant
+        vapor fraction (psi values), traced with envelopeCurve between P_min and P_max kPa.
+        Returns a dict with (T, P) arrays for "bubble", "dew" and every psi in "quality", and the solver "stats".'''
+        table = propertyTable(c)
+        z = table.composition(self.feed.getmC())
+        envelope = {'quality': {}, 'stats': {}}
+
+        for name, value in [('bubble', 0.0), ('dew', 1.0)] + [(q, q) for q in psi]:
+
+            T, P, stats = envelopeCurve(z, table, value, P_min, P_max, T_max, **options)
+
+            if name in ('bubble', 'dew'):
+                envelope[name] = (T, P)
+            else:
+                envelope['quality'][name] = (T, P)
+
+            envelope['stats'][name] = stats
+
+        return envelope
+
+
     def bubbleP(self, T, c):
         ''' Bubble pressure calculation given an operating temperature.'''
-        P = sum([self.feed.getmC(key) * Antoinenp(T, **c['Antoine'][key]) for key in self.feed.getmC().keys()])
+        table = propertyTable(c)
+        P = np.sum(table.composition(self.feed.getmC()) * table.Psat(T))
 
         return P
 
 
     def dewP(self, T, c):
         ''' Dew pressure calculation given an operating temperature.'''
-        P = sum([self.feed.getmC(key) / Antoinenp(T, **c['Antoine'][key]) for key in self.feed.getmC().keys()]) ** (-1)
+        table = propertyTable(c)
+        P = np.sum(table.composition(self.feed.getmC()) / table.Psat(T)) ** (-1)
 
         return round(P, 3)
 
+
+# Functions and methods wrapped by instrument(), CP_L and CP_ig are keys of _antiderivatives so they stay untouched.
+_INSTRUMENTED = ('GEKKO', 'AntoineInv', 'AntoineInvnp', 'HeatVap', 'meanCP', 'rachfordRice', '_saturationT', 'bubbleTnp', 'dewTnp',
+                 'TxySweep', 'PxySweep', 'envelopeCurve', 'isothermalBatch', 'isothermalStreams', 'isothermalSensitivities',
+                 'adiabaticSensitivities', 'compoundData')
+_INSTRUMENTED_METHODS = ((PropertyTable, ('K', 'Tsat', 'saturationTable', 'HeatVap', 'meanCPL', 'meanCPig')),
+                         (FlashDrum, ('isothermal', 'adiabatic', 'adiabaticNumpy', 'bubbleT', 'dewT', 'bubbleP', 'dewP', 'phaseEnvelope')))
+
+def instrument(enabled = True, clear = True):
+    ''' Turns the instrumentation on or off and returns flash.profiler.
+     -> Enabled, the hot-path functions and the PropertyTable and FlashDrum methods are replaced by wrappers that
+        count the calls, add up their wall time and record nested spans (GEKKO models also record "GEKKO.solve").
+     -> Disabled, the original functions are restored, so the instrumentation costs nothing.
+     -> clear resets the recorded results.
+     The results are exported with profiler.report(), profiler.saveJSON(path) and profiler.saveChromeTrace(path).'''
+    profiler.unpatch()
+
+    if clear:
+        profiler.clear()
+
+    if enabled:
+
+        profiler.patch(sys.modules[__name__], _INSTRUMENTED)
+
+        for owner, names in _INSTRUMENTED_METHODS:
+            profiler.patch(owner, names, owner.__name__ + '.')
+
+    return profiler
@@ -1,52 +1,47 @@
 import streamlit as st
-import flash as fd
+import calculations as calc
 from stream import Stream
 import plotly.graph_objects as go
-import numpy as np
 
-@st.cache(show_spinner = False)
-def showBubbleT(flash_item, P, c):
+# The cached functions only take small hashable arguments (tuples of compounds and fractions, T, P, n),
+# st.cache is shared by every session and keeps at most max_entries results per function.
+MAX_ENTRIES = 256
 
-    return flash_item.bubbleT(P, c)
+@st.cache(show_spinner = False, max_entries = MAX_ENTRIES)
+def showBubbleT(compounds, z, P):
 
-@st.cache(show_spinner = False)
-def showBubbleP(flash_item, T, c):
+    return calc.bubbleT(compounds, z, P)
 
-    return flash_item.bubbleP(T, c)
+@st.cache(show_spinner = False, max_entries = MAX_ENTRIES)
+def showBubbleP(compounds, z, T):
 
-@st.cache(show_spinner = False)
-def showDewT(flash_item, P, c):
+    return calc.bubbleP(compounds, z, T)
 
-    return flash_item.dewT(P, c)
+@st.cache(show_spinner = False, max_entries = MAX_ENTRIES)
+def showDewT(compounds, z, P):
 
-@st.cache(show_spinner = False)
-def showDewP(flash_item, T, c):
+    return calc.dewT(compounds, z, P)
 
-    return flash_item.dewP(T, c)
+@st.cache(show_spinner = False, max_entries = MAX_ENTRIES)
+def showDewP(compounds, z, T):
 
-@st.cache(show_spinner = False)
-def showIsothermal(flash_item, T, P, c, energy):
-    flash_item.isothermal(T, P, c, energy)
-    return flash_item.Streams(energy)
+    return calc.dewP(compounds, z, T)
 
-@st.cache(show_spinner = False)
-def showAdiabatic(flash_item, P, c):
-    flash_item.adiabatic(P, c)
-    return flash_item.Streams(True)
+@st.cache(show_spinner = False, max_entries = MAX_ENTRIES)
+def showIsothermal(compounds, z, Tf, Pf, F, T, P, energy):
 
-@st.cache(show_spinner = False)
-def Txy_diagram(flash_item, C1, C2, P, c, n):
+    return calc.isothermal(compounds, z, Tf, Pf, F, T, P, energy)[0]
 
-    x = np.linspace(0.0, 1.0, num = int(n))
-    T_b = []
-    T_d = []
+@st.cache(show_spinner = False, max_entries = MAX_ENTRIES)
+def showAdiabatic(compounds, z, Pf, F, P):
 
-    for xi in x:
+    return calc.adiabatic(compounds, z, Pf, F, P)[0]
 
-        fraction_d = {C1: xi, C2: 1 - xi}        
-        flash_item.setFeedStream(Stream(mComposition = fraction_d))
-        T_b.append(flash_item.bubbleT(P, c))
-        T_d.append(flash_item.dewT(P, c))
+# The figures are not mutated by the app, so their output hash check is skipped.
+@st.cache(show_spinner = False, max_entries = MAX_ENTRIES, allow_output_mutation = True)
+def Txy_diagram(C1, C2, P, n):
+
+    x, T_b, T_d = calc.Txy(C1, C2, P, n)
 
     figTxy = go.Figure()
     figTxy.add_trace(go.Scatter(x = x, y = T_b, mode = "lines+markers", name = "Bubble points", line = {'color': '#3D78FD', 'width': 3.5}, marker = {'color': '#3D78FD', 'symbol': 0, 'size': 10}))
@@ -72,20 +67,11 @@ def Txy_diagram(flash_item, C1, C2, P, c, n):
 
     return figTxy
 
-@st.cache(show_spinner = False)
-def Pxy_diagram(flash_item, C1, C2, T, c, n):
-
-    x = np.linspace(0.0, 1.0, num = int(n))
-    P_b = []
-    P_d = []
+@st.cache(show_spinner = False, max_entries = MAX_ENTRIES, allow_output_mutation = True)
+def Pxy_diagram(C1, C2, T, n):
 
-    for xi in x:
+    x, P_b, P_d = calc.Pxy(C1, C2, T, n)
 
-        fraction_d = {C1: xi, C2: 1 - xi}        
-        flash_item.setFeedStream(Stream(mComposition = fraction_d))
-        P_b.append(flash_item.bubbleP(T, c))
-        P_d.append(flash_item.dewP(T, c))
-    
     figPxy = go.Figure()
     figPxy.add_trace(go.Scatter(x = x, y = P_b, mode = "lines+markers", name = "Bubble points", line = {'color': '#3D78FD', 'width': 3.5}, marker = {'color': '#3D78FD', 'symbol': 0, 'size': 10}))
     figPxy.add_trace(go.Scatter(x = x, y = P_d, mode = "lines+markers", name = "Dew points", line = {'color': '#3DFDB2', 'width': 3.5}, marker = {'color': '#3DFDB2', 'symbol': 0, 'size': 10}))
@@ -119,9 +105,6 @@ simulations = st.container()
 diagrams = st.container()
 footer = st.container()
 compounds = ["benzene", "toluene", "chlorobenzene", "p-xylene",  "styrene"]
-flash_c = fd.FlashDrum()
-flash_s = fd.FlashDrum()
-flash_d = fd.FlashDrum()
 
 with header:
     st.title("FLASH DRUM 🔥!")
@@ -154,13 +137,14 @@ with mixture:
         fraction[i] = st.number_input(label=i, key="Component_" + i, min_value=0.0000, max_value=1.0000, step=0.0001, format = "%.4f", value = 0.0)
 
     current_mixture = [key for key in fraction.keys()]
-    components = fd.parameters(current_mixture)  
     nonZero = sum([z for z in fraction.values()])
 
     if nonZero > 0:
 
         feed_Stream = Stream(mComposition = fraction)
-        feed_Stream.normalize()        
+        feed_Stream.normalize()
+        # Hashable mixture for the cached calculations.
+        mixture_c, mixture_z = (tuple(values) for values in zip(*feed_Stream.getmC().items()))
 
 if len(fraction) > 1 and nonZero > 0:
 
@@ -173,8 +157,6 @@ if len(fraction) > 1 and nonZero > 0:
         st.markdown("And for a dew point $\Psi = 1$, the equation is:")
         st.latex(r'''f(\Psi = 1) = \sum_{i}^{C}\frac{z_{i}}{K_{i}} - 1 = 0''')
 
-        stream_c = Stream(mComposition = feed_Stream.getmC())
-        flash_c.setFeedStream(stream_c)
         st.subheader("1.1- BubbleT point")
 
         with st.form(key = "BubbleT"):
@@ -194,7 +176,7 @@ if len(fraction) > 1 and nonZero > 0:
                         st.markdown("**Temperature**")
 
                         with st.spinner('Calculating...'):
-                            st.markdown("**{:.2f} K**".format(showBubbleT(flash_c, P1, components)))
+                            st.markdown("**{:.2f} K**".format(showBubbleT(mixture_c, mixture_z, P1)))
                             st.success("Calculations complete!")
 
         st.subheader("1.2- BubbleP point")
@@ -217,7 +199,7 @@ if len(fraction) > 1 and nonZero > 0:
 
                         with st.spinner('Calculating...'):
 
-                            st.markdown("**{:.2f} kPa**".format(showBubbleP(flash_c, T1, components)))
+                            st.markdown("**{:.2f} kPa**".format(showBubbleP(mixture_c, mixture_z, T1)))
                             st.success("Calculations complete!")
 
         st.subheader("1.3- DewT point")
@@ -240,7 +222,7 @@ if len(fraction) > 1 and nonZero > 0:
 
                         with st.spinner('Calculating...'):
 
-                            st.markdown("**{:.2f} K**".format(showDewT(flash_c, P2, components)))
+                            st.markdown("**{:.2f} K**".format(showDewT(mixture_c, mixture_z, P2)))
                             st.success("Calculations complete!")
 
         st.subheader("1.4- DewP point")
@@ -263,7 +245,7 @@ if len(fraction) > 1 and nonZero > 0:
 
                         with st.spinner('Calculating...'):
 
-                            st.markdown("**{:.2f} kPa**".format(showDewP(flash_c, T2, components)))
+                            st.markdown("**{:.2f} kPa**".format(showDewP(mixture_c, mixture_z, T2)))
                             st.success("Calculations complete!")
         
     with simulations:
@@ -285,8 +267,6 @@ if len(fraction) > 1 and nonZero > 0:
             Tfeed = st.number_input(label = "Feedstream temperature in K", min_value=250.0, max_value=800.0, step=1.0, format = "%.2f")
             Pfeed = st.number_input(label = "Feedstream pressure in kPa", min_value= 10.0, max_value=1100.0, step = 10.0, format="%.2f")
             mFfeed = st.number_input(label = "Feedstream molar flow in mol/h", min_value= 1, max_value=1000000, step = 1)
-            stream_s = Stream(name = "FEED", Temperature = Tfeed, Pressure = Pfeed, mComposition = feed_Stream.getmC(), molarFlow= mFfeed)
-            flash_s.setFeedStream(stream_s)
             T3 = st.number_input(label = "Drum Temperature in K", min_value=250.0, max_value=800.0, step=1.0, format = "%.2f")
             P3 = st.number_input(label = "Drum Pressure in kPa",min_value= 10.0, max_value=1100.0, step = 10.0, format = "%.2f")
             energyBalance = st.checkbox(label = "Energy balance")
@@ -296,7 +276,7 @@ if len(fraction) > 1 and nonZero > 0:
 
                 with st.spinner("Calculating..."):
 
-                    ifd = showIsothermal(flash_s, T3, P3, components, energyBalance)
+                    ifd = showIsothermal(mixture_c, mixture_z, Tfeed, Pfeed, mFfeed, T3, P3, energyBalance)
                     st.text(ifd)
                     st.success("Calculations complete!")
   
@@ -307,13 +287,11 @@ if len(fraction) > 1 and nonZero > 0:
         st.latex(r'''f(T) = Vh_{V} + Lh_{L} - Fh_{F} = 0''')
         with st.form(key = "AdiabaticFlash feed"):
 
-            
-            flash_s.setFeedStream(Stream(mComposition = feed_Stream.getmC()))
+
+            # The feed is a saturated liquid at its bubble temperature.
             Pfeeda = st.number_input(label = "Feedstream pressure in kPa", min_value= 10.0, max_value=1100.0, step = 10.0, format="%.2f")
             mFfeeda = st.number_input(label = "Feedstream molar flow in mol/h", min_value= 1, max_value=1000000, step = 1)
-            stream_sa = Stream(name = "FEED", Temperature = flash_s.bubbleT(Pfeeda, components), Pressure = Pfeeda, mComposition = feed_Stream.getmC(), molarFlow= mFfeeda)
             buttonAFF = st.form_submit_button("Save feedstream!")
-            flash_s.setFeedStream(stream_sa)
 
         with st.form(key = "AdiabaticFlash drum"):
             P4 = st.number_input(label = "Drum Pressure in kPa", min_value= 10.0, max_value=Pfeeda, step = 10.0, format="%.2f")
@@ -323,7 +301,7 @@ if len(fraction) > 1 and nonZero > 0:
 
                 with st.spinner("Calculating..."):
 
-                    afd = showAdiabatic(flash_s, P4, components)
+                    afd = showAdiabatic(mixture_c, mixture_z, Pfeeda, mFfeeda, P4)
                     st.text(afd)
                     st.success("Calculations complete!")
 
@@ -334,8 +312,6 @@ if len(fraction) > 1 and nonZero > 0:
             For drawing this diagram bubble points and dew points are calculated by changing the composition to obtain different points. \
                 The more points for the diagram, the longer it will take to draw it.")
         
-        components_d = fd.parameters(current_mixture)
-        
         colD1, colD2 = st.columns([1, 1])
 
         with colD1:
@@ -369,7 +345,7 @@ if len(fraction) > 1 and nonZero > 0:
 
                     with st.spinner("Generating diagram Txy..."):
                         
-                        figTxy = Txy_diagram(flash_d, C1, C2, P_dTxy, components_d, n)                                
+                        figTxy = Txy_diagram(C1, C2, P_dTxy, n)                                
                         st.plotly_chart(figTxy)
                            
         st.subheader("3.2- P vs xy Diagram")
@@ -391,7 +367,7 @@ if len(fraction) > 1 and nonZero > 0:
 
                     with st.spinner("Generating diagram Pxy..."):
 
-                        figPxy = Pxy_diagram(flash_d, C1, C2, T_dPxy, components_d, n)  
+                        figPxy = Pxy_diagram(C1, C2, T_dPxy, n)  
                         st.plotly_chart(figPxy)
 
 with footer:
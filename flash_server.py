@@ -0,0 +1,437 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import flash
+import parallel
+
+KINDS = ('bubbleT', 'dewT', 'bubbleP', 'dewP', 'isothermal', 'adiabatic')
+# Required fields of every kind besides the feed composition z.
+FIELDS = {'bubbleT': ('P',), 'dewT': ('P',), 'bubbleP': ('T',), 'dewP': ('T',), 'isothermal': ('T', 'P'), 'adiabatic': ('P', 'feed')}
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+def solveBatch(kind, compounds, energy, cases):
+    ''' Solves a micro-batch of cases of one kind and compound set in a worker process.
+    The bubble/dew points and the isothermal flashes use the vectorized kernels, the adiabatic
+    flashes run one numpy engine FlashDrum per case. Returns one result dict per case,
+    a case that fails returns {"error": message}.'''
+    if kind == 'adiabatic':
+
+        results = []
+
+        for case in cases:
+
+            try:
+                results.append(parallel.runCase(dict(case, kind = 'adiabatic')))
+            except Exception as error:
+                results.append({'error': "{}: {}".format(type(error).__name__, error)})
+
+        return results
+
+    try:
+        return _solveVectorized(kind, compounds, energy, cases)
+    except Exception as error:
+
+        if len(cases) == 1:
+            return [{'error': "{}: {}".format(type(error).__name__, error)}]
+
+        # A case that breaks the batch only fails its own request.
+        return [solveBatch(kind, compounds, energy, [case])[0] for case in cases]
+
+
+def _solveVectorized(kind, compounds, energy, cases):
+
+    table = parallel._table(compounds)
+    z = np.array([[float(case['z'].get(compound, 0.0)) for compound in compounds] for case in cases])
+    z /= z.sum(axis = 1, keepdims = True)
+    column = lambda name, default = None: np.array([float(case.get(name, default)) for case in cases])
+
+    if kind in ('bubbleT', 'dewT'):
+
+        T, converged = (flash.bubbleTnp if kind == 'bubbleT' else flash.dewTnp)(column('P'), z, table)
+        return [{'T': float(Ti)} if ok else {'error': "{} not found".format(kind)} for Ti, ok in zip(T, converged)]
+
+    if kind in ('bubbleP', 'dewP'):
+
+        Psat = table.Psat(column('T'))
+        P = np.sum(z * Psat, axis = 1) if kind == 'bubbleP' else 1 / np.sum(z / Psat, axis = 1)
+        return [{'P': float(Pi)} for Pi in P]
+
+    feed = [case.get('feed', {}) for case in cases]
+    r = flash.isothermalBatch(column('T'), column('P'), z, table, F = np.array([float(f.get('F', 1.0)) for f in feed]),
+                              Tf = np.array([float(f['T']) for f in feed]) if energy else None,
+                              Pf = np.array([float(f['P']) for f in feed]) if energy else None, energy = energy)
+    results = []
+
+    for i in range(len(cases)):
+
+        result = {'Psi': float(r['Psi'][i]), 'V': float(r['V'][i]), 'L': float(r['L'][i]),
+                  'x': dict(zip(compounds, r['x'][i].tolist())), 'y': dict(zip(compounds, r['y'][i].tolist()))}
+
+        if energy:
+            result.update({key: float(r[key][i]) for key in ('hf', 'hv', 'hl', 'Q')})
+
+        results.append(result)
+
+    return results
+
+
+def validateCase(kind, case):
+    ''' Checks a request body of kind and returns the case with its numbers as floats, so a malformed request
+    gets 400 before it reaches a micro-batch. Raises ValueError with the reason.'''
+    if not isinstance(case, dict):
+        raise ValueError("The body must be a JSON object")
+
+    missing = [field for field in ('z',) + FIELDS[kind] if field not in case]
+
+    if missing:
+        raise ValueError("Missing fields: {}".format(", ".join(missing)))
+
+    def number(value, name, positive = True):
+
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value):
+            raise ValueError("{} must be a finite number".format(name))
+
+        if (value <= 0) if positive else (value < 0):
+            raise ValueError("{} must be {}".format(name, "positive" if positive else "non-negative"))
+
+        return float(value)
+
+    if not isinstance(case['z'], dict) or not case['z']:
+        raise ValueError("z must be an object {compound: fraction}")
+
+    valid = dict(case, z = {str(compound): number(value, "z[{}]".format(compound), False) for compound, value in case['z'].items()})
+
+    if sum(valid['z'].values()) <= 0:
+        raise ValueError("z must have positive fractions")
+
+    for name in ('T', 'P'):
+
+        if name in FIELDS[kind] or (name in case and kind != 'adiabatic'):
+            valid[name] = number(case[name], name)
+
+    if 'energy' in case and not isinstance(case['energy'], bool):
+        raise ValueError("energy must be true or false")
+
+    energy = kind == 'isothermal' and case.get('energy', False)
+
+    if 'feed' in case or energy:
+
+        feed = case.get('feed')
+
+        if not isinstance(feed, dict):
+            raise ValueError("feed must be an object {T, P, F}")
+
+        required = ('T', 'P') if energy or kind == 'adiabatic' else ()
+        missing = [name for name in required if name not in feed]
+
+        if missing:
+            raise ValueError("The energy balance needs the feed {}".format(" and ".join(missing)))
+
+        valid['feed'] = {name: number(feed[name], "feed " + name) for name in ('T', 'P', 'F') if name in feed}
+
+    return valid
+
+
+async def readMessage(reader):
+    ''' Reads an HTTP/1.1 message: returns the start line, the headers (lower case names) and the body,
+    or None if the connection was closed.'''
+    line = await reader.readline()
+
+    if not line:
+        return None
+
+    headers = {}
+
+    while True:
+
+        header = await reader.readline()
+
+        if header in (b'\r\n', b'\n', b''):
+            break
+
+        name, _, value = header.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    return line.decode('latin-1').strip(), headers, body
+
+
+class FlashServer():
+
+    def __init__(self, host = '127.0.0.1', port = 8080, window = 0.002, max_batch = 1024, max_queue = 100000, workers = None, compound_data = None):
+        ''' Asyncio HTTP/JSON server of the flash calculations.
+         -> POST /bubbleT, /dewT (P), /bubbleP, /dewP (T), /isothermal (T, P, optional feed and energy) and
+            /adiabatic (P, feed) with a JSON body {"z": {compound: fraction}, ...}, feed is {"T", "P", "F"}.
+         -> GET /metrics returns the queue depth, throughput, batch sizes and latency percentiles, GET /health "ok".
+         -> Requests of the same kind and compound set that arrive within window s are solved as one micro-batch
+            (up to max_batch cases) in a pool of workers processes, os.cpu_count() by default.
+         -> Over max_queue waiting cases new requests get 503.
+         -> compound_data is the compound database path of the workers, flash.COMPOUND_DATA by default.'''
+        self.host = host
+        self.port = port
+        self.window = window
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.workers = workers or os.cpu_count() or 1
+        self.compound_data = compound_data or flash.COMPOUND_DATA
+        self.executor = None
+        self.server = None
+        self._batches = {}
+        self._timers = {}
+        self._queued = 0
+        self._running = 0
+        self._latencies = deque(maxlen = 10000)
+        self._batch_sizes = deque(maxlen = 1000)
+        self._counters = {'requests': 0, 'errors': 0, 'rejected': 0, 'batches': 0, 'cases': 0}
+        self._connections = set()
+        self._start = time.perf_counter()
+
+
+    async def start(self):
+
+        self.executor = ProcessPoolExecutor(max_workers = self.workers, initializer = parallel._initWorker, initargs = (self.compound_data,))
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+
+    async def close(self):
+        ''' Stops accepting connections, cancels the open keep-alive connections and the pending batch timers
+        and shuts the workers down.'''
+        self.server.close()
+
+        for timer in self._timers.values():
+            timer.cancel()
+
+        self._timers = {}
+        connections = list(self._connections)
+
+        for task in connections:
+            task.cancel()
+
+        await asyncio.gather(*connections, return_exceptions = True)
+        await self.server.wait_closed()
+        self.executor.shutdown()
+
+
+    def submit(self, kind, case):
+        ''' Queues a validated case in the micro-batch of its kind and compound set, returns the future of its result.'''
+        compounds = tuple(sorted(case['z']))
+        energy = bool(case.get('energy', False)) if kind == 'isothermal' else False
+        key = (kind, compounds, energy)
+        future = asyncio.get_running_loop().create_future()
+        batch = self._batches.setdefault(key, [])
+        batch.append((case, future))
+        self._queued += 1
+
+        if len(batch) >= self.max_batch:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+
+        return future
+
+
+    def _flush(self, key):
+
+        timer = self._timers.pop(key, None)
+
+        if timer is not None:
+            timer.cancel()
+
+        batch = self._batches.pop(key, [])
+
+        if batch:
+            asyncio.ensure_future(self._run(key, batch))
+
+
+    async def _run(self, key, batch):
+
+        kind, compounds, energy = key
+        self._queued -= len(batch)
+        self._running += len(batch)
+        self._counters['batches'] += 1
+        self._counters['cases'] += len(batch)
+        self._batch_sizes.append(len(batch))
+
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, solveBatch, kind, compounds, energy, [case for case, future in batch])
+        except Exception as error:
+            results = [{'error': "{}: {}".format(type(error).__name__, error)}] * len(batch)
+        finally:
+            self._running -= len(batch)
+
+        for (case, future), result in zip(batch, results):
+
+            if not future.done():
+                future.set_result(result)
+
+
+    def metrics(self):
+
+        latencies = np.array(self._latencies) * 1000 if self._latencies else np.zeros(1)
+        uptime = time.perf_counter() - self._start
+        return dict(self._counters,
+                    queue_depth = self._queued,
+                    in_flight = self._running,
+                    workers = self.workers,
+                    uptime = uptime,
+                    requests_per_s = self._counters['requests'] / uptime if uptime > 0 else 0.0,
+                    mean_batch = float(np.mean(self._batch_sizes)) if self._batch_sizes else 0.0,
+                    latency_ms = {'p50': float(np.percentile(latencies, 50)), 'p95': float(np.percentile(latencies, 95)),
+                                  'p99': float(np.percentile(latencies, 99)), 'max': float(latencies.max())})
+
+
+    async def _respond(self, method, path, body):
+        ''' Status and JSON response of a request.'''
+        name = path.split('?')[0].strip('/')
+
+        if method == 'GET' and name == 'metrics':
+            return 200, self.metrics()
+
+        if method == 'GET' and name == 'health':
+            return 200, 'ok'
+
+        if name not in KINDS:
+            return 404, {'error': "Unknown endpoint /{}".format(name)}
+
+        if method != 'POST':
+            return 405, {'error': "Use POST"}
+
+        try:
+            case = validateCase(name, json.loads(body or b'{}'))
+        except ValueError as error:
+            return 400, {'error': str(error)}
+
+        if self._queued >= self.max_queue:
+            self._counters['rejected'] += 1
+            return 503, {'error': "Queue full"}
+
+        result = await self.submit(name, case)
+        return (500 if 'error' in result else 200), result
+
+
+    async def _handle(self, reader, writer):
+        ''' One client connection, HTTP/1.1 keep-alive unless the client asks to close it.'''
+        task = asyncio.current_task()
+        self._connections.add(task)
+
+        try:
+
+            while True:
+
+                message = await readMessage(reader)
+
+                if message is None:
+                    break
+
+                start = time.perf_counter()
+                line, headers, body = message
+                method, path = (line.split(' ') + ['', ''])[:2]
+                self._counters['requests'] += 1
+                status, result = await self._respond(method, path, body)
+
+                if status != 200:
+                    self._counters['errors'] += 1
+
+                payload = json.dumps(result).encode()
+                close = headers.get('connection', '').lower() == 'close'
+                writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                    status, REASONS[status], len(payload), 'close' if close else 'keep-alive').encode() + payload)
+                await writer.drain()
+                self._latencies.append(time.perf_counter() - start)
+
+                if close:
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+
+async def serve(host = '127.0.0.1', port = 8080, **options):
+
+    server = await FlashServer(host, port, **options).start()
+    print("Flash server on http://{}:{}".format(server.host, server.port))
+
+    async with server.server:
+        await server.server.serve_forever()
+
+
+async def loadTest(host = '127.0.0.1', port = 8080, requests = 10000, concurrency = 64, kind = 'isothermal', compounds = ('benzene', 'toluene'), seed = 0):
+    ''' Load generator: concurrency keep-alive clients send requests random cases of kind to the server.
+    Returns the throughput in requests/s, the latency percentiles in ms and the non 200 responses.'''
+    rng = np.random.default_rng(seed)
+    payloads = []
+
+    for _ in range(min(requests, 1000)):
+
+        case = {'z': dict(zip(compounds, rng.dirichlet(np.ones(len(compounds))).tolist()))}
+        case.update({'bubbleT': {'P': 101.325}, 'dewT': {'P': 101.325}, 'bubbleP': {'T': 370.0}, 'dewP': {'T': 370.0},
+                     'isothermal': {'T': float(rng.uniform(360.0, 390.0)), 'P': 101.325},
+                     'adiabatic': {'P': 101.325, 'feed': {'T': 420.0, 'P': 500.0, 'F': 1.0}}}[kind])
+        body = json.dumps(case).encode()
+        payloads.append("POST /{} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(kind, host, len(body)).encode() + body)
+
+    latencies = []
+    failures = 0
+    sent = 0
+
+    async def client():
+
+        nonlocal failures, sent
+        reader, writer = await asyncio.open_connection(host, port)
+
+        while sent < requests:
+
+            payload = payloads[sent % len(payloads)]
+            sent += 1
+            start = time.perf_counter()
+            writer.write(payload)
+            await writer.drain()
+            line, headers, body = await readMessage(reader)
+            latencies.append(time.perf_counter() - start)
+
+            if line.split(' ')[1] != '200':
+                failures += 1
+
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return {'requests': len(latencies), 'failures': failures, 'seconds': elapsed, 'requests_per_s': len(latencies) / elapsed,
+            'latency_ms': {'p50': float(np.percentile(latencies, 50)), 'p95': float(np.percentile(latencies, 95)),
+                           'p99': float(np.percentile(latencies, 99)), 'max': float(latencies.max())}}
+
+
+if __name__ == '__main__':
+
+    # python flash_server.py serve [--port 8080]
+    # python flash_server.py load [--port 8080] [--requests 10000] [--concurrency 64] [--kind isothermal]
+    parser = argparse.ArgumentParser(description = 'Flash calculation HTTP server and load generator.')
+    parser.add_argument('command', choices = ('serve', 'load'))
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('--window', type = float, default = 0.002, help = 'micro-batch window in s')
+    parser.add_argument('--max-batch', type = int, default = 1024)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--requests', type = int, default = 10000)
+    parser.add_argument('--concurrency', type = int, default = 64)
+    parser.add_argument('--kind', default = 'isothermal', choices = KINDS)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        asyncio.run(serve(args.host, args.port, window = args.window, max_batch = args.max_batch, workers = args.workers))
+    else:
+        print(json.dumps(asyncio.run(loadTest(args.host, args.port, args.requests, args.concurrency, args.kind)), indent = 1))
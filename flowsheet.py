@@ -0,0 +1,262 @@
+import numpy as np
+from flash import propertyTable
+from stream import Stream
+
+
+class Flowsheet():
+
+    def __init__(self, c):
+        ''' Flowsheet of FlashDrum units connected through streams.
+         -> c is the property table (or parameters() dict) of every compound of the flowsheet.
+         -> feeds are the external inlet streams, units the drums with their operating specification.
+         -> Every unit mixes all its inlet streams (total flow and composition, flow-weighted temperature and
+            the lowest pressure) into its feed stream, so recycles are connected like any other stream.
+         -> Recycle loops are torn, the tear streams (component molar flows and temperature) are converged
+            with Wegstein or Broyden acceleration.
+         -> evaluations counts the unit calculations and iterations the tear iterations of the last solve.'''
+        self.table = propertyTable(c)
+        self.feeds = {}
+        self.units = {}
+        self.inlets = {}
+        self.streams = {}
+        self.tears = []
+        self.sequence = []
+        self.evaluations = 0
+        self.iterations = 0
+        self.converged = False
+
+
+    def addFeed(self, name, stream):
+        ''' External feed stream of the flowsheet.'''
+        stream.normalize()
+        flows = stream.getmF() * stream.getmC().array(self.table.compounds)
+        self.feeds[name] = stream
+        self.streams[(name, 'feed')] = (flows, stream.getT(), stream.getP())
+
+
+    def addUnit(self, name, drum, mode = 'isothermal', T = None, P = None, energy = False):
+        ''' Flash drum unit, mode is "isothermal" (T and P in K and kPa) or "adiabatic" (P in kPa).'''
+        self.units[name] = (drum, {'mode': mode, 'T': T, 'P': P, 'energy': energy})
+        self.inlets[name] = []
+
+
+    def connect(self, source, target, port = 'feed'):
+        ''' Connects an external feed (source is its name) or the "vapor" or "liquid" outlet (port)
+        of the unit source to an inlet of the unit target.'''
+        self.inlets[target].append((source, 'feed' if source in self.feeds else port))
+
+
+    def order(self):
+        ''' Chooses the tear streams, the unit outlets that close a recycle loop in a depth-first search
+        from the units in the order they were added, and the calculation sequence of the remaining acyclic graph.'''
+        edges = {name: [] for name in self.units}
+
+        for target, inlets in self.inlets.items():
+
+            for source, port in inlets:
+
+                if source in self.units:
+                    edges[source].append((target, port))
+
+        self.tears = []
+        state = {}
+
+        def visit(unit):
+
+            state[unit] = 'open'
+
+            for target, port in edges[unit]:
+
+                if state.get(target) == 'open':
+                    if (unit, port) not in self.tears:
+                        self.tears.append((unit, port))
+                elif target not in state:
+                    visit(target)
+
+            state[unit] = 'closed'
+
+        for unit in self.units:
+
+            if unit not in state:
+                visit(unit)
+
+        # Kahn topological sort without the torn streams.
+        pending = {unit: sum(1 for source, port in self.inlets[unit] if source in self.units and (source, port) not in self.tears) for unit in self.units}
+        self.sequence = []
+        ready = [unit for unit in self.units if pending[unit] == 0]
+
+        while ready:
+
+            unit = ready.pop(0)
+            self.sequence.append(unit)
+
+            for target, port in edges[unit]:
+
+                if (unit, port) not in self.tears:
+
+                    pending[target] -= 1
+
+                    if pending[target] == 0:
+                        ready.append(target)
+
+        return self.tears, self.sequence
+
+
+    def _mix(self, name):
+        ''' Mixed feed stream of a unit.'''
+        inlets = [self.streams[inlet] for inlet in self.inlets[name] if inlet in self.streams]
+        flows = sum(inlet[0] for inlet in inlets)
+        F = float(np.sum(flows))
+        T = sum(np.sum(inlet[0]) * inlet[1] for inlet in inlets) / F if F > 0 else None
+        P = min(inlet[2] for inlet in inlets)
+        return flows, F, T, P
+
+
+    def runUnit(self, name):
+        ''' Calculates a unit from its current inlet streams, the drum keeps its last solution as the initial
+        guess (warm start) of the next calculation.'''
+        drum, spec = self.units[name]
+        flows, F, T, P = self._mix(name)
+        self.evaluations += 1
+
+        if F <= 0:
+
+            zero = (np.zeros(len(self.table)), spec['T'], spec['P'])
+            self.streams[(name, 'vapor')] = zero
+            self.streams[(name, 'liquid')] = zero
+            return
+
+        drum.setFeedStream(Stream("FEED", T, P, F, dict(zip(self.table.compounds, flows / F))))
+
+        if spec['mode'] == 'isothermal':
+            drum.isothermal(spec['T'], spec['P'], self.table, spec['energy'])
+        else:
+            drum.adiabatic(spec['P'], self.table, T0 = drum.Temperature)
+
+        for port, outlet in (('vapor', drum.vapor), ('liquid', drum.liquid)):
+            self.streams[(name, port)] = (outlet.getmF() * np.asarray(outlet.getmC().array(self.table.compounds), dtype = float), outlet.getT(), outlet.getP())
+
+
+    def _tearVector(self):
+
+        return np.concatenate([np.append(self.streams[tear][0], self.streams[tear][1]) for tear in self.tears]) if self.tears else np.zeros(0)
+
+
+    def _setTears(self, x):
+
+        C = len(self.table)
+
+        for i, tear in enumerate(self.tears):
+
+            values = x[i * (C + 1):(i + 1) * (C + 1)]
+            self.streams[tear] = (np.maximum(values[:C], 0.0), values[C], self.units[tear[0]][1]['P'])
+
+
+    def solve(self, method = 'wegstein', tol = 1e-8, maxiter = 200, qmin = -5.0, qmax = 0.0, maxstep = 50.0):
+        ''' Converges the flowsheet. Tear streams without a value start empty at the drum conditions.
+         -> method is "wegstein" (bounded per-variable acceleration factor q in [qmin, qmax]),
+            "broyden" (Broyden update of the inverse Jacobian of x - g(x)) or "direct" (direct substitution).
+         -> tol is the tolerance of the tear flows relative to the total feed flow of the flowsheet,
+            and of the tear temperatures relative to their value.
+         -> The accelerated steps are scaled down so no tear flow changes by more than the total feed flow
+            and no tear temperature by more than maxstep K.
+         The iterations stop as not converged when a pass returns non-finite or negative values, or when the
+         scaled residual grows for 10 iterations in a row. The tear streams keep the outlets of the last pass.
+         Returns True if the tear streams converged.'''
+        self.order()
+        self.evaluations = 0
+        C = len(self.table)
+
+        for tear in self.tears:
+
+            if tear not in self.streams:
+                spec = self.units[tear[0]][1]
+                self.streams[tear] = (np.zeros(C), spec['T'] if spec['T'] is not None else 298.15, spec['P'])
+
+        def g(x):
+
+            self._setTears(x)
+
+            for unit in self.sequence:
+                self.runUnit(unit)
+
+            return self._tearVector()
+
+        F = sum(float(np.sum(self.streams[(name, 'feed')][0])) for name in self.feeds) or 1.0
+        # Every tear is C flows and a temperature.
+        flow = np.tile(np.append(np.ones(C, dtype = bool), False), len(self.tears))
+        x = self._tearVector()
+        gx = x
+        x_old = g_old = None
+        H = None
+        residual = np.inf
+        growing = 0
+        self.converged = False
+
+        for self.iterations in range(1, maxiter + 1):
+
+            gx = g(x)
+            f = gx - x
+
+            if not np.all(np.isfinite(gx)) or np.any(gx[flow] < 0):
+                break
+
+            scale = np.where(flow, F, 1 + np.abs(x))
+
+            if np.all(np.abs(f) <= tol * scale):
+                self.converged = True
+                break
+
+            norm = np.max(np.abs(f) / scale)
+            growing = growing + 1 if norm > residual else 0
+            residual = norm
+
+            if growing >= 10:
+                break
+
+            if method == 'wegstein' and x_old is not None:
+
+                dx = x - x_old
+                s = np.divide(gx - g_old, dx, out = np.zeros_like(dx), where = dx != 0)
+                q = np.clip(np.divide(s, s - 1, out = np.zeros_like(s), where = s != 1), qmin, qmax)
+                x_new = q * x + (1 - q) * gx
+
+            elif method == 'broyden':
+
+                if H is None:
+                    H = -np.eye(len(x))
+                else:
+                    dx = x - x_old
+                    df = f - (g_old - x_old)
+                    Hdf = H @ df
+                    denominator = dx @ Hdf
+
+                    if denominator != 0:
+                        H += np.outer(dx - Hdf, dx @ H) / denominator
+
+                x_new = x - H @ f
+
+            else:
+
+                x_new = gx
+
+            # Bounded step in the direction of the accelerated update.
+            step = x_new - x
+            ratio = np.max(np.abs(step) / np.where(flow, F, maxstep), initial = 0.0)
+
+            if ratio > 1:
+                x_new = x + step / ratio
+
+            x_old, g_old = x, gx
+            x = x_new
+
+        self._setTears(gx)
+        return self.converged
+
+
+    def stream(self, source, port = 'feed'):
+        ''' Stream object of a flowsheet stream.'''
+        flows, T, P = self.streams[(source, port)]
+        F = float(np.sum(flows))
+        composition = flows / F if F > 0 else flows
+        return Stream("{} {}".format(source, port).upper(), T, P, F, dict(zip(self.table.compounds, composition)))
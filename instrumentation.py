@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+
+class Profiler():
+
+    def __init__(self, maxevents = 100000):
+        ''' Call counters, wall times and nested spans of instrumented functions.
+         -> functions: {name: {'calls', 'time', 'self'}}, time is the cumulative wall time in s and self
+            the time without the instrumented calls made inside.
+         -> spans: the same per call path ("isothermal/bubbleT/bubbleTnp"), so every FlashDrum call is split
+            in the time of its nested calls.
+         -> events are the individual calls for the Chrome trace, up to maxevents (the counters keep counting).
+         Nothing is measured until patch() replaces the functions with their wrappers, unpatch() restores them.'''
+        self.maxevents = maxevents
+        self.functions = {}
+        self.spans = {}
+        self.events = []
+        self.dropped = 0
+        self._patched = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+
+    def _stack(self):
+
+        stack = getattr(self._local, 'stack', None)
+
+        if stack is None:
+            stack = self._local.stack = []
+
+        return stack
+
+
+    def enter(self, name):
+        ''' Opens a span, every enter must be followed by its exit.'''
+        stack = self._stack()
+        path = stack[-1][1] + '/' + name if stack else name
+        # [name, path, start, time of the children]
+        stack.append([name, path, time.perf_counter(), 0.0])
+
+
+    def exit(self):
+
+        end = time.perf_counter()
+        stack = self._stack()
+        name, path, start, children = stack.pop()
+        elapsed = end - start
+
+        if stack:
+            stack[-1][3] += elapsed
+
+        with self._lock:
+
+            function = self.functions.setdefault(name, {'calls': 0, 'time': 0.0, 'self': 0.0})
+            function['calls'] += 1
+            function['time'] += elapsed
+            function['self'] += elapsed - children
+            span = self.spans.setdefault(path, {'calls': 0, 'time': 0.0})
+            span['calls'] += 1
+            span['time'] += elapsed
+
+            if len(self.events) < self.maxevents:
+                self.events.append((name, path, start - self._start, elapsed, threading.get_ident()))
+            else:
+                self.dropped += 1
+
+
+    def span(self, name):
+        ''' Context manager of a user span, e.g. with profiler.span("case 12"): ...'''
+        profiler = self
+
+        class Span():
+
+            def __enter__(self):
+
+                profiler.enter(name)
+                return self
+
+            def __exit__(self, *exception):
+
+                profiler.exit()
+                return False
+
+        return Span()
+
+
+    def wrap(self, name, function):
+        ''' Instrumented version of function.'''
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+
+            self.enter(name)
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.exit()
+
+        wrapper.__wrapped_profiler__ = self
+        return wrapper
+
+
+    def patch(self, owner, names, prefix = ''):
+        ''' Replaces the attributes names of owner (a module or a class) with instrumented wrappers,
+        the recorded name is prefix + name. Attributes that are already instrumented are skipped.'''
+        for name in names:
+
+            original = owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)
+
+            if getattr(original, '__wrapped_profiler__', None) is self:
+                continue
+
+            self._patched.append((owner, name, original))
+            setattr(owner, name, self.wrap(prefix + name, original))
+
+
+    def unpatch(self):
+        ''' Restores every patched attribute, so the instrumentation costs nothing.'''
+        while self._patched:
+
+            owner, name, original = self._patched.pop()
+            setattr(owner, name, original)
+
+
+    @property
+    def enabled(self):
+
+        return bool(self._patched)
+
+
+    def clear(self):
+
+        with self._lock:
+            self.functions = {}
+            self.spans = {}
+            self.events = []
+            self.dropped = 0
+            self._start = time.perf_counter()
+
+
+    def report(self):
+        ''' Counters and spans as a dict, sorted by cumulative time.'''
+        order = lambda items: dict(sorted(items, key = lambda item: -item[1]['time']))
+
+        with self._lock:
+            return {'functions': order((name, dict(value)) for name, value in self.functions.items()),
+                    'spans': order((path, dict(value)) for path, value in self.spans.items()),
+                    'events': len(self.events), 'dropped': self.dropped}
+
+
+    def saveJSON(self, path):
+
+        with open(path, mode = 'w') as report:
+            json.dump(self.report(), report, indent = 1)
+
+        return path
+
+
+    def chromeTrace(self):
+        ''' The recorded calls as Chrome trace complete events (chrome://tracing, Perfetto).'''
+        with self._lock:
+            return {'traceEvents': [{'name': name, 'cat': path, 'ph': 'X', 'ts': start * 1e6, 'dur': elapsed * 1e6,
+                                     'pid': os.getpid(), 'tid': thread} for name, path, start, elapsed, thread in self.events],
+                    'displayTimeUnit': 'ms'}
+
+
+    def saveChromeTrace(self, path):
+
+        with open(path, mode = 'w') as trace:
+            json.dump(self.chromeTrace(), trace)
+
+        return path
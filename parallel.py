@@ -0,0 +1,127 @@
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import flash
+from stream import Stream
+
+# Property tables of the worker, one per component set, and the compound database they were built from.
+_tables = {}
+_data = None
+
+
+class CaseError():
+
+    def __init__(self, index, error):
+        ''' Error of one case of run_cases, it takes the place of the case result.
+         -> index is the position of the case.
+         -> type and message describe the exception, traceback is its formatted traceback.'''
+        self.index = index
+        self.type = type(error).__name__
+        self.message = str(error)
+        self.traceback = traceback.format_exc()
+
+    def __repr__(self):
+
+        return "CaseError({}, {}: {})".format(self.index, self.type, self.message)
+
+
+def _initWorker(path):
+    ''' Worker initializer: loads the compound database once per process.'''
+    if path is not None:
+        flash.setCompoundData(path)
+
+    flash.compoundData()
+
+
+def _table(compounds):
+
+    global _data
+    data = flash.compoundData()
+
+    # flash.setCompoundData loads a new database, the tables of the old one are dropped.
+    if data is not _data:
+        _tables.clear()
+        _data = data
+
+    key = tuple(compounds)
+
+    if key not in _tables:
+        _tables[key] = flash.PropertyTable(key)
+
+    return _tables[key]
+
+
+def runCase(case):
+    ''' Runs one case, a dict with:
+     -> kind: "isothermal", "adiabatic", "bubbleT", "dewT", "bubbleP" or "dewP".
+     -> z: feed molar composition dict {compound: fraction}.
+     -> T and/or P: operating temperature in K and pressure in kPa.
+     -> feed (optional): dict with the feed T, P and F (molar flow), required by the flash drums.
+     -> energy (optional): energy balance of the isothermal flash, default False.
+     -> engine (optional): FlashDrum engine, default "numpy".
+     The flash drums return FlashDrum.saveResults(), the bubble and dew points a number.'''
+    c = _table(case['z'].keys())
+    drum = flash.FlashDrum(engine = case.get('engine', 'numpy'))
+    feed = case.get('feed', {})
+    drum.setFeedStream(Stream("FEED", feed.get('T'), feed.get('P'), feed.get('F', 1.0), dict(case['z'])))
+    kind = case['kind']
+
+    if kind == 'isothermal':
+        drum.isothermal(case['T'], case['P'], c, case.get('energy', False))
+        return drum.saveResults()
+
+    if kind == 'adiabatic':
+        drum.adiabatic(case['P'], c)
+        return drum.saveResults()
+
+    if kind in ('bubbleT', 'dewT'):
+        return getattr(drum, kind)(case['P'], c)
+
+    if kind in ('bubbleP', 'dewP'):
+        return float(getattr(drum, kind)(case['T'], c))
+
+    raise ValueError("Unknown case kind: {}".format(kind))
+
+
+def _runChunk(chunk):
+    ''' Runs a chunk of (index, case) pairs, an exception only replaces the result of its case.'''
+    results = []
+
+    for index, case in chunk:
+
+        try:
+            results.append(runCase(case))
+        except Exception as error:
+            results.append(CaseError(index, error))
+
+    return results
+
+
+def run_cases(cases, workers = None, chunksize = None, compound_data = None):
+    ''' Runs independent flash/bubble/dew cases (see runCase) over a pool of worker processes.
+     -> workers is the number of processes, os.cpu_count() by default; 1 runs the cases in this process.
+     -> chunksize is the number of cases sent to a worker at once, by default about 4 chunks per worker.
+     -> compound_data is the compound database path loaded by every worker, flash.COMPOUND_DATA by default.
+     Returns the results in the order of the cases, a case that fails returns a CaseError instead.'''
+    cases = list(cases)
+    workers = workers or os.cpu_count() or 1
+    chunksize = chunksize or max(1, -(-len(cases) // (workers * 4)))
+    indexed = list(enumerate(cases))
+    chunks = [indexed[i:i + chunksize] for i in range(0, len(indexed), chunksize)]
+    path = compound_data or flash.COMPOUND_DATA
+
+    if workers == 1:
+
+        # The cases run in this process, its compound database is restored afterwards.
+        previous = flash.COMPOUND_DATA
+
+        try:
+            _initWorker(compound_data)
+            return [result for chunk in chunks for result in _runChunk(chunk)]
+        finally:
+
+            if compound_data is not None:
+                flash.setCompoundData(previous)
+
+    with ProcessPoolExecutor(max_workers = workers, initializer = _initWorker, initargs = (path,)) as executor:
+        return [result for results in executor.map(_runChunk, chunks) for result in results]
@@ -0,0 +1,258 @@
+import math
+import numpy as np
+import flash
+from stream import Stream
+
+# Regions of a table row: subcooled liquid (T_min to the bubble line), two phases (bubble to dew line)
+# and superheated vapor (dew line to T_max).
+REGIONS = ('liquid', 'two-phase', 'vapor')
+OUTPUTS = ('Psi', 'x', 'y', 'Q')
+
+
+class ResponseTable():
+
+    def __init__(self, feed, T_range, P_range, c = None, nT = 65, nP = 33, Tref = 298.15):
+        ''' Tabulated isothermal flash response (Psi, x, y and Q) of a fixed feed Stream over a T-P rectangle.
+         -> T_range = (T_min, T_max) in K and P_range = (P_min, P_max) in kPa.
+         -> c is the PropertyTable of the feed compounds, built from the database by default.
+         -> nP rows of pressures, uniform in ln(P). The bubble and dew temperatures of every row are solved exactly,
+            they split the row in the liquid, two-phase and vapor regions with nT nodes each, so the kinks of the
+            response at the phase boundaries lie on the grid instead of inside a cell.
+         -> Between rows the boundaries are cubic Hermite interpolations in ln(P) with their exact slopes.
+         The error estimate of the queries in a cell is the largest error of the bilinear interpolation at the centers
+         of the cell and its neighbors, against the exact solution (flash.isothermalBatch, the numpy engine of
+         FlashDrum.isothermal with energy). save() writes the table to a .npz file and ResponseTable.load() reads it.'''
+        composition = feed.getmC()
+        self.table = flash.PropertyTable(tuple(composition.keys())) if c is None else c
+        # The compositions and coefficients follow the order of the property table, not the feed.
+        self.compounds = tuple(self.table.compounds)
+        self.z = self.table.composition(composition)
+        self.z = self.z / self.z.sum()
+        self.feed = np.array([feed.getT(), feed.getP(), feed.getmF()], dtype = float)
+        self.Tref = float(Tref)
+        self.T_range = np.array(T_range, dtype = float)
+        self.P_range = np.array(P_range, dtype = float)
+
+        if not (0 < self.T_range[0] < self.T_range[1] and 0 < self.P_range[0] < self.P_range[1]):
+            raise ValueError('The table needs 0 < T_min < T_max and 0 < P_min < P_max')
+
+        if nT < 2 or nP < 2:
+            raise ValueError('The table needs at least 2 nodes per region and 2 pressures')
+
+        self.lnP = np.linspace(*np.log(self.P_range), nP)
+        self.s = np.linspace(0.0, 1.0, nT)
+        self.boundaries = self._boundaries(np.exp(self.lnP))
+        self._setup()
+        # values[region, row, node] = [Psi, Q, x_1 ... x_C, y_1 ... y_C]
+        T = self._nodes(self.boundaries[0], self.boundaries[2], self.s)
+        P = np.broadcast_to(np.exp(self.lnP)[None, :, None], T.shape)
+        self.values = self._exact(T.ravel(), P.ravel()).reshape(T.shape + (-1,))
+        self.error = self._cellErrors()
+
+    def _setup(self):
+        # Cubic coefficients of the Hermite interpolation of the bubble and dew lines on every interval of ln(P).
+        h = self.lnP[1] - self.lnP[0]
+        self._h = float(h)
+        self._dT = float(self.T_range[1] - self.T_range[0]) / (len(self.s) - 1)
+        cubic = []
+
+        for T, dT in (self.boundaries[:2], self.boundaries[2:]):
+
+            y0, y1, m0, m1 = T[:-1], T[1:], h * dT[:-1], h * dT[1:]
+            cubic.append(np.column_stack([y0, m0, 3 * (y1 - y0) - 2 * m0 - m1, 2 * (y0 - y1) + m0 + m1]))
+
+        self._cubic = np.array(cubic)
+        # Floats of the single query path.
+        self._lnP0 = float(self.lnP[0])
+        self._T_range = tuple(float(T) for T in self.T_range)
+        self._P_range = tuple(float(P) for P in self.P_range)
+
+    def _boundaries(self, P):
+        ''' Exact bubble and dew temperatures at the pressures P and their slopes d T / d ln(P) (4, N).'''
+        z = np.broadcast_to(self.z, (len(P), len(self.z)))
+        T_bubble = flash.bubbleTnp(P, z, self.table)[0]
+        T_dew = flash.dewTnp(P, z, self.table)[0]
+        # Along sum(z K) = 1 and sum(z / K) = 1 with d ln(K) = dlnPsat d ln(T) - d ln(P).
+        Kb = self.table.K(T_bubble, P)
+        Kd = self.table.K(T_dew, P)
+        dT_bubble = 1 / np.sum(z * Kb * self.table.dlnPsat(T_bubble), axis = -1)
+        dT_dew = 1 / np.sum(z / Kd * self.table.dlnPsat(T_dew), axis = -1)
+        return np.array([T_bubble, T_bubble * dT_bubble, T_dew, T_dew * dT_dew])
+
+    def _edges(self, T_bubble, T_dew):
+        ''' Temperature limits (low, high) of the liquid, two-phase and vapor regions (3, 2, ...). The single phase
+        regions reach at least one node spacing beyond the phase boundaries, also outside the rectangle, so no region
+        of a row is empty.'''
+        T_min, T_max = self.T_range
+        return np.array([[np.minimum(T_min, T_bubble - self._dT), T_bubble], [T_bubble, T_dew], [T_dew, np.maximum(T_max, T_dew + self._dT)]])
+
+    def _nodes(self, T_bubble, T_dew, s):
+        ''' Temperatures (3, N, n) of the fractions s of every region. They are kept 1e-6 K inside the regions, so the
+        nodes on a phase boundary take the values of their own side (e.g. the incipient vapor of the two-phase region).'''
+        low, high = self._edges(T_bubble, T_dew)[:, :, :, None].transpose(1, 0, 2, 3)
+        return np.clip(low + (high - low) * s, low + 1e-6, high - 1e-6)
+
+    def _exact(self, T, P):
+        ''' Packed exact responses [Psi, Q, x, y] (N, 2 + 2 C) at arrays of temperatures and pressures.'''
+        Tf, Pf, F = self.feed
+        r = flash.isothermalBatch(T, P, self.z, self.table, F, Tf, Pf, energy = True, Tref = self.Tref)
+        return np.column_stack([r['Psi'], r['Q'], r['x'], r['y']])
+
+    def _locate(self, T, P):
+        ''' Region, row, node and bilinear weights of arrays of queries, with the interpolated phase boundaries.'''
+        t = (np.log(P) - self.lnP[0]) / self._h
+        j = np.clip(t.astype(int), 0, len(self.lnP) - 2)
+        u = np.clip(t - j, 0.0, 1.0)
+        c = self._cubic[:, j]
+        T_bubble, T_dew = c[..., 0] + u * (c[..., 1] + u * (c[..., 2] + u * c[..., 3]))
+        liquid, vapor = T < T_bubble, T >= T_dew
+        region = 1 - liquid + vapor
+        low = np.where(liquid, np.minimum(self.T_range[0], T_bubble - self._dT), np.where(vapor, T_dew, T_bubble))
+        high = np.where(liquid, T_bubble, np.where(vapor, np.maximum(self.T_range[1], T_dew + self._dT), T_dew))
+        s = np.clip((T - low) / (high - low), 0.0, 1.0) * (len(self.s) - 1)
+        i = np.minimum(s.astype(int), len(self.s) - 2)
+        return region, j, u, i, s - i, T_bubble, T_dew
+
+    def _interpolate(self, region, j, u, i, w):
+
+        v = self.values
+        return (((1 - u) * (1 - w))[:, None] * v[region, j, i] + ((1 - u) * w)[:, None] * v[region, j, i + 1] +
+                (u * (1 - w))[:, None] * v[region, j + 1, i] + (u * w)[:, None] * v[region, j + 1, i + 1])
+
+    def _cellErrors(self):
+        ''' Error estimates of Psi, x, y and Q (3, nP - 1, nT - 1, 4) from the bilinear interpolation at the cell centers.'''
+        nP, nT = len(self.lnP), len(self.s)
+        P = np.exp(0.5 * (self.lnP[1:] + self.lnP[:-1]))
+        T_bubble, _, T_dew, _ = self._boundaries(P)
+        T = self._nodes(T_bubble, T_dew, 0.5 * (self.s[1:] + self.s[:-1]))
+        P = np.broadcast_to(P[None, :, None], T.shape)
+        region, j, i = [index.ravel() for index in np.meshgrid(np.arange(3), np.arange(nP - 1), np.arange(nT - 1), indexing = 'ij')]
+        half = np.full(len(region), 0.5)
+        difference = np.abs(self._interpolate(region, j, half, i, half) - self._exact(T.ravel(), P.ravel()))
+        C = len(self.compounds)
+        error = np.column_stack([difference[:, 0], difference[:, 2:2 + C].max(axis = 1), difference[:, 2 + C:].max(axis = 1), difference[:, 1]])
+        error = error.reshape(3, nP - 1, nT - 1, 4)
+        # The center error of a cell can vanish where the curvature changes sign, every cell takes the largest
+        # error of its neighbors in the same region.
+        padded = np.pad(error, ((0, 0), (1, 1), (1, 1), (0, 0)), mode = 'edge')
+        return np.max([padded[:, a:a + nP - 1, b:b + nT - 1] for a in range(3) for b in range(3)], axis = 0)
+
+    def query(self, T, P, margin = 0.05, tol = None):
+        ''' Interpolated responses at arrays of temperatures T in K and pressures P in kPa (broadcast together).
+        Queries outside the rectangle, within margin K of the bubble or dew line, or (with tol) with an
+        error estimate above tol are solved exactly.
+         Returns a dict with the arrays Psi, x, y and Q as in flash.isothermalBatch, error, a dict with the
+         error estimates of Psi, x, y and Q (zero for the exact points), and exact, the mask of exact points.'''
+        if np.ndim(T) == 0 and np.ndim(P) == 0:
+
+            single = self._querySingle(float(T), float(P), margin, tol)
+
+            if single is not None:
+                return single
+
+        T, P = np.broadcast_arrays(np.atleast_1d(np.asarray(T, dtype = float)), np.atleast_1d(np.asarray(P, dtype = float)))
+        T, P = T.ravel(), P.ravel()
+        region, j, u, i, w, T_bubble, T_dew = self._locate(T, P)
+        values = self._interpolate(region, j, u, i, w)
+        error = self.error[region, j, i]
+        exact = ((T < self.T_range[0]) | (T > self.T_range[1]) | (P < self.P_range[0]) | (P > self.P_range[1]) |
+                 (np.abs(T - T_bubble) < margin) | (np.abs(T - T_dew) < margin))
+
+        if tol is not None:
+            exact |= error.max(axis = 1) > tol
+
+        if exact.any():
+            values[exact] = self._exact(T[exact], P[exact])
+            error[exact] = 0.0
+
+        return self._results(values, error, exact)
+
+    def _querySingle(self, T, P, margin, tol):
+        ''' _locate and _interpolate of one query with floats, None if it needs the exact solver.'''
+        T_min, T_max = self._T_range
+        P_min, P_max = self._P_range
+
+        if not (T_min <= T <= T_max and P_min <= P <= P_max):
+            return None
+
+        n = len(self.s)
+        t = (math.log(P) - self._lnP0) / self._h
+        j = min(int(t), len(self.lnP) - 2)
+        u = min(t - j, 1.0)
+        (b0, b1, b2, b3), (d0, d1, d2, d3) = self._cubic[:, j].tolist()
+        T_bubble = b0 + u * (b1 + u * (b2 + u * b3))
+        T_dew = d0 + u * (d1 + u * (d2 + u * d3))
+
+        if abs(T - T_bubble) < margin or abs(T - T_dew) < margin:
+            return None
+
+        if T < T_bubble:
+            region, low, high = 0, min(T_min, T_bubble - self._dT), T_bubble
+        elif T < T_dew:
+            region, low, high = 1, T_bubble, T_dew
+        else:
+            region, low, high = 2, T_dew, max(T_max, T_dew + self._dT)
+
+        s = min(max((T - low) / (high - low), 0.0), 1.0) * (n - 1)
+        i = min(int(s), n - 2)
+        w = s - i
+        error = self.error[region, j, i][None]
+
+        if tol is not None and error.max() > tol:
+            return None
+
+        weights = np.array([[(1 - u) * (1 - w), (1 - u) * w, u * (1 - w), u * w]])
+        values = weights @ self.values[region, (j, j, j + 1, j + 1), (i, i + 1, i, i + 1)]
+        return self._results(values, error, np.zeros(1, dtype = bool))
+
+    def _results(self, values, error, exact):
+
+        C = len(self.compounds)
+        return {'Psi': values[:, 0], 'x': values[:, 2:2 + C], 'y': values[:, 2 + C:], 'Q': values[:, 1],
+                'error': dict(zip(OUTPUTS, error.T)), 'exact': exact}
+
+    def maxError(self):
+        ''' Largest error estimates of Psi, x, y and Q over the table, per region.'''
+        return {name: dict(zip(OUTPUTS, [float(value) for value in self.error[r].max(axis = (0, 1))])) for r, name in enumerate(REGIONS)}
+
+    def save(self, path):
+        ''' Writes the table to a compressed .npz file.'''
+        np.savez_compressed(path, compounds = np.array(self.compounds), z = self.z, feed = self.feed, Tref = self.Tref,
+                            T_range = self.T_range, P_range = self.P_range, lnP = self.lnP, s = self.s,
+                            boundaries = self.boundaries, values = self.values, error = self.error,
+                            Antoine = self.table.Antoine, Hvap = self.table.Hvap, CPL = self.table.CPL, CPIG = self.table.CPIG)
+        return path
+
+    @classmethod
+    def load(cls, path, c = None):
+        ''' Reads a table written by save(). Without c, the PropertyTable of the exact solver is rebuilt from the
+        stored coefficients, so the fallback matches the tabulated values, c must list the compounds in the stored order.'''
+        self = cls.__new__(cls)
+
+        with np.load(path, allow_pickle = False) as data:
+
+            self.compounds = tuple(str(compound) for compound in data['compounds'])
+            self.Tref = float(data['Tref'])
+
+            for name in ('z', 'feed', 'T_range', 'P_range', 'lnP', 's', 'boundaries', 'values', 'error'):
+                setattr(self, name, data[name])
+
+            self._setup()
+
+            if c is None:
+
+                groups = {'Antoine': ('C1', 'C2', 'C3', 'C4', 'C5'), 'Hvap': ('Tc', 'C1', 'C2', 'C3', 'C4'),
+                          'CPL': ('C1', 'C2', 'C3', 'C4', 'C5'), 'CPIG': ('C1', 'C2', 'C3', 'C4', 'C5')}
+                c = flash.PropertyTable(self.compounds, {compound: {group: dict(zip(keys, data[group][k])) for group, keys in groups.items()}
+                                                         for k, compound in enumerate(self.compounds)})
+
+        if tuple(c.compounds) != self.compounds:
+            raise ValueError('The property table must list the compounds in the order of the table: {}'.format(", ".join(self.compounds)))
+
+        self.table = c
+        return self
+
+    def feedStream(self):
+        ''' The tabulated feed as a Stream.'''
+        Tf, Pf, F = self.feed
+        return Stream("FEED", float(Tf), float(Pf), float(F), dict(zip(self.compounds, [float(value) for value in self.z])))
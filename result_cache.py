@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+# Version of the stored values, a new version drops the results of the old one.
+FORMAT = 2
+# Default cache file, or the FLASH_RESULT_CACHE environment variable.
+RESULT_CACHE = os.environ.get('FLASH_RESULT_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'flash_drum', 'results.sqlite'))
+
+
+def dataHash(path):
+    ''' sha256 of a compound database, a CSV file or the coefficient and name files of a compound store.'''
+    digest = hashlib.sha256()
+    files = [os.path.join(path, name) for name in ('coefficients.npy', 'names.npy')] if os.path.isdir(path) else [path]
+
+    for name in files:
+
+        with open(name, mode = 'rb') as data:
+
+            for block in iter(lambda: data.read(1 << 20), b''):
+                digest.update(block)
+
+    return digest.hexdigest()
+
+
+def tableDigest(table):
+    ''' sha256 of the compounds and coefficients of a PropertyTable, part of every result key.'''
+    digest = hashlib.sha256(json.dumps(table.compounds).encode())
+
+    for block in (table.Antoine, table.Hvap, table.CPL, table.CPIG):
+        digest.update(np.ascontiguousarray(block, dtype = float).tobytes())
+
+    return digest.hexdigest()
+
+
+class ResultCache():
+
+    def __init__(self, path = None, maxsize = 100000, digits = 6, data = None):
+        ''' Persistent, content-addressed cache of flash and bubble/dew results in a SQLite file.
+         -> path is the database file, RESULT_CACHE by default.
+         -> maxsize is the maximum number of results, the least recently used ones are evicted.
+         -> digits is the number of decimals of the state variables (T, P, flows) in the key,
+            the compositions are normalized and rounded to digits + 4 decimals.
+         -> data is the compound database file, flash.COMPOUND_DATA by default. When its content changes
+            the stored results are dropped, besides that every key includes the coefficients of its compounds.
+         The file is in WAL mode, so several processes can read and write it at the same time,
+         every process (and thread) uses its own connection. A hit does not write, the access times
+         of the hits are written in one transaction every maxsize / 100 hits and before an eviction.'''
+        self.path = RESULT_CACHE if path is None else path
+        self.maxsize = maxsize
+        self.digits = digits
+        self.data = data
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._puts = 0
+        self._used = {}
+        self._connect()
+
+
+    def _connect(self):
+
+        connection = getattr(self._local, 'connection', None)
+
+        # A forked process can not reuse the connection of its parent.
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok = True)
+        connection = sqlite3.connect(self.path, timeout = 30.0, isolation_level = None)
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, used REAL NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        self._checkData(connection)
+        return connection
+
+
+    def _checkData(self, connection):
+        ''' Drops every result if the compound database or FORMAT changed since they were stored.'''
+        if self.data is None:
+            import flash
+            self.data = flash.COMPOUND_DATA
+
+        current = '{}:{}'.format(dataHash(self.data), FORMAT)
+
+        with connection:
+
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute("SELECT value FROM meta WHERE name = 'data'").fetchone()
+
+            if row is None or row[0] != current:
+                connection.execute('DELETE FROM results')
+                connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('data', ?)", (current,))
+
+
+    def key(self, kind, table, z, state = ()):
+        ''' Content address of a result:
+         -> kind is the calculation ("isothermal", "bubbleT" ...) with its options, e.g. the engine.
+         -> table is the PropertyTable of the compounds, z the feed composition {compound: fraction}.
+         -> state is a tuple of numbers (T, P, flows ...) and other JSON values.'''
+        z = [(compound, float(value)) for compound, value in z.items()]
+        total = sum(value for compound, value in z)
+        composition = sorted((compound, round(value / total, self.digits + 4)) for compound, value in z)
+        state = [round(float(value), self.digits) if isinstance(value, (int, float, np.number)) and not isinstance(value, bool) else value
+                 for value in state]
+        content = json.dumps([kind, composition, state, tableDigest(table)], sort_keys = True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+
+    def get(self, key):
+        ''' Stored value of a key or None.'''
+        connection = self._connect()
+        row = connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._used[key] = time.time()
+
+        if len(self._used) >= max(1, self.maxsize // 100):
+            self.touch()
+
+        return json.loads(row[0])
+
+
+    def touch(self):
+        ''' Writes the access times of the hits since the last write.'''
+        used, self._used = self._used, {}
+
+        if not used:
+            return
+
+        connection = self._connect()
+
+        with connection:
+
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('UPDATE results SET used = ? WHERE key = ?', [(value, key) for key, value in used.items()])
+
+
+    def put(self, key, value):
+        ''' Stores a JSON value, every maxsize / 100 stores the oldest results beyond maxsize are evicted.'''
+        connection = self._connect()
+        connection.execute('INSERT OR REPLACE INTO results (key, value, used) VALUES (?, ?, ?)', (key, json.dumps(value), time.time()))
+        self._puts += 1
+
+        if self._puts >= max(1, self.maxsize // 100):
+            self._puts = 0
+            self.evict()
+
+
+    def evict(self):
+        ''' Drops the least recently used results beyond maxsize.'''
+        self.touch()
+        connection = self._connect()
+
+        with connection:
+
+            connection.execute('BEGIN IMMEDIATE')
+            size = connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+            if size > self.maxsize:
+                connection.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)', (size - self.maxsize,))
+
+
+    def clear(self):
+
+        self._connect().execute('DELETE FROM results')
+        self._used = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self):
+
+        return self._connect().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+
+    def stats(self):
+
+        calls = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit ratio': self.hits / calls if calls else 0.0,
+                'size': len(self),
+                'maxsize': self.maxsize}
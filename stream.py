@@ -1,5 +1,131 @@
+from collections.abc import MutableMapping
+from numbers import Number
+import weakref
+import numpy as np
+
+# Exact types checked before the slower numbers.Number test of Composition.__setitem__.
+_NUMBERS = (float, int, np.float64)
+
+class ComponentIndex():
+
+    __slots__ = ('names', 'positions', '__weakref__')
+    # Indexes in use by some composition, an index is dropped with its last composition.
+    _interned = weakref.WeakValueDictionary()
+
+    def __init__(self, names):
+        ''' Ordered component names and their positions in the composition arrays.
+        Use ComponentIndex.of(names), so every stream with the same components shares one index.'''
+        self.names = tuple(names)
+        self.positions = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def of(cls, names):
+
+        names = tuple(names)
+        index = cls._interned.get(names)
+
+        if index is None:
+            index = cls._interned[names] = cls(names)
+
+        return index
+
+    def extended(self, name):
+        ''' Shared index with one more component at the end.'''
+        return ComponentIndex.of(self.names + (name,))
+
+    def __len__(self):
+
+        return len(self.names)
+
+    def __eq__(self, other):
+
+        return isinstance(other, ComponentIndex) and self.names == other.names
+
+    def __hash__(self):
+
+        return hash(self.names)
+
+    def __reduce__(self):
+
+        return (ComponentIndex.of, (self.names,))
+
+
+class Composition(MutableMapping):
+
+    __slots__ = ('index', '_array')
+
+    def __init__(self, mC = None, index = None):
+        ''' Molar composition stored as a NumPy array tied to a shared ComponentIndex,
+        with the dict interface (composition[compound], keys(), values(), items() ...).'''
+        if isinstance(mC, Composition):
+            self.index = mC.index
+            self._array = mC._array.copy()
+        elif index is not None:
+            self.index = index
+            self._array = np.zeros(len(index)) if mC is None else np.array(mC, dtype = float)
+        else:
+            mC = {} if mC is None else mC
+            self.index = ComponentIndex.of(mC.keys())
+            self._array = np.fromiter(mC.values(), dtype = float, count = len(mC))
+
+    def __getitem__(self, key):
+
+        value = self._array[self.index.positions[key]]
+        return value if self._array.dtype == object else float(value)
+
+    def __setitem__(self, key, value):
+
+        if type(value) not in _NUMBERS and not isinstance(value, Number) and self._array.dtype != object:
+            # Symbolic values (GEKKO expressions) are kept in an object array.
+            self._array = self._array.astype(object)
+
+        position = self.index.positions.get(key)
+
+        if position is None:
+            self.index = self.index.extended(key)
+            array = np.empty(len(self._array) + 1, dtype = self._array.dtype)
+            array[:-1] = self._array
+            array[-1] = value
+            self._array = array
+        else:
+            self._array[position] = value
+
+    def __delitem__(self, key):
+
+        position = self.index.positions[key]
+        self.index = ComponentIndex.of(self.index.names[:position] + self.index.names[position + 1:])
+        self._array = np.delete(self._array, position)
+
+    def __iter__(self):
+
+        return iter(self.index.names)
+
+    def __len__(self):
+
+        return len(self.index)
+
+    def __contains__(self, key):
+
+        return key in self.index.positions
+
+    def __repr__(self):
+
+        return repr(dict(self.items()))
+
+    def array(self, names = None):
+        ''' Composition array in the order of names (a sequence or a ComponentIndex), missing compounds are zero.
+        The array is a copy, changing it does not change the composition.'''
+        if names is None or names == self.index or tuple(getattr(names, 'names', names)) == self.index.names:
+            return self._array.copy()
+
+        positions = self.index.positions
+        return np.array([self._array[positions[name]] if name in positions else 0.0 for name in getattr(names, 'names', names)])
+
+
 class Stream():
 
+    __slots__ = ('name', 'Temperature', 'Pressure', 'molarFlow', '_composition', 'Enthalpy')
+
     def __init__(self, name = "stream_000", Temperature = None,  Pressure = None, molarFlow = 0.0, mComposition = None, Enthalpy = None):
         self.name =  name
         self.Temperature = Temperature
@@ -8,6 +134,16 @@ class Stream():
         self.mComposition = mComposition
         self.Enthalpy = Enthalpy
 
+    @property
+    def mComposition(self):
+
+        return self._composition
+
+    @mComposition.setter
+    def mComposition(self, mC):
+
+        self._composition = None if mC is None else Composition(mC)
+
     def setName(self, name):
        self.name = name
 
@@ -22,10 +158,10 @@ class Stream():
 
     def setmC(self, mC, key = None):
         if key != None:
-            self.mComposition[key] = mC
+            self._composition[key] = mC
         else:
-            if mC == None:
-                self.mComposition = {}
+            if mC is None:
+                self._composition = Composition()
             else:
                 self.mComposition = mC
 
@@ -46,20 +182,70 @@ class Stream():
 
     def getmC(self, key = None):
         if key != None:
-            return self.mComposition[key] 
+            return self._composition[key]
         else:
-            return self.mComposition
+            return self._composition
 
     def getH(self):
         return self.Enthalpy
 
     def normalize(self):
-        
-        Z = sum([zi for zi in self.mComposition.values()])
+
+        Z = self._composition._array.sum()
 
         if not ((Z == 1.0) or (Z == 1)):
 
-            for key in self.mComposition.keys():
+            self._composition._array /= Z
+
+
+class StreamBatch():
+
+    __slots__ = ('name', 'index', 'Temperature', 'Pressure', 'molarFlow', 'mComposition', 'Enthalpy')
+
+    def __init__(self, components, mComposition, Temperature = None, Pressure = None, molarFlow = 1.0, Enthalpy = None, name = "batch_000"):
+        ''' N streams with the same components stored as arrays:
+         -> components are the compound names (or a ComponentIndex) of the composition columns.
+         -> mComposition is the (N, C) matrix of molar compositions.
+         -> Temperature, Pressure, molarFlow and Enthalpy are arrays (N,) or scalars shared by every stream.'''
+        self.name = name
+        self.index = components if isinstance(components, ComponentIndex) else ComponentIndex.of(components)
+        self.mComposition = np.atleast_2d(np.asarray(mComposition, dtype = float))
+        N = len(self.mComposition)
+        self.Temperature = None if Temperature is None else np.broadcast_to(np.asarray(Temperature, dtype = float), (N,)).copy()
+        self.Pressure = None if Pressure is None else np.broadcast_to(np.asarray(Pressure, dtype = float), (N,)).copy()
+        self.molarFlow = np.broadcast_to(np.asarray(molarFlow, dtype = float), (N,)).copy()
+        self.Enthalpy = None if Enthalpy is None else np.broadcast_to(np.asarray(Enthalpy, dtype = float), (N,)).copy()
+
+    @classmethod
+    def fromStreams(cls, streams, name = "batch_000"):
+        ''' Packs a list of Stream objects, the components are the union in order of appearance.'''
+        names = []
+
+        for stream in streams:
+            names += [key for key in stream.getmC().keys() if key not in names]
 
-                self.mComposition[key] = self.mComposition[key] / Z
+        index = ComponentIndex.of(names)
+        return cls(index, [stream.getmC().array(index) for stream in streams],
+                   [stream.getT() for stream in streams] if all(stream.getT() is not None for stream in streams) else None,
+                   [stream.getP() for stream in streams] if all(stream.getP() is not None for stream in streams) else None,
+                   [stream.getmF() for stream in streams],
+                   [stream.getH() for stream in streams] if all(stream.getH() is not None for stream in streams) else None,
+                   name)
+
+    def __len__(self):
+
+        return len(self.mComposition)
+
+    def __getitem__(self, i):
+        ''' The i-th stream as a Stream object.'''
+        value = lambda array: None if array is None else float(array[i])
+        return Stream("{}_{}".format(self.name, i), value(self.Temperature), value(self.Pressure), float(self.molarFlow[i]),
+                      Composition(self.mComposition[i], self.index), value(self.Enthalpy))
+
+    def toStreams(self):
+
+        return [self[i] for i in range(len(self))]
+
+    def normalize(self):
 
+        self.mComposition /= self.mComposition.sum(axis = 1, keepdims = True)
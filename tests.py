@@ -1,5 +1,608 @@
 from flash import *
-from stream import Stream
+from stream import Stream, StreamBatch
+from flowsheet import Flowsheet
+import asyncio
+import json
+import pytest
+import copy
+import math
+import shutil
+from result_cache import ResultCache
+from thermo_cache import ThermoCache
+from compound_store import CompoundStore, convertCSV
+from response_table import ResponseTable
+from parallel import run_cases
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from batch_runner import readCases, runBatch, solveCases
+import flash_server
+import calculations
+import flash
+from scipy.integrate import quad
+
+
+def test_meanCP_closed_form():
+    ''' The closed form mean heat capacities must match the quad integration.'''
+    c = parameters(list(compoundData().keys()))
+    table = PropertyTable(list(compoundData().keys()))
+    T1 = np.array([250.0, 298.15, 350.0, 400.0])
+    T2 = np.array([300.0, 450.0, 600.0, 400.5])
+    cpl = table.meanCPL(T1, T2)
+    cpig = table.meanCPig(T1, T2)
+
+    for key, i in table.index.items():
+
+        for n in range(len(T1)):
+
+            ref_l = quad(CP_L, T1[n], T2[n], args = tuple(c['CPL'][key].values()), limit=1100)[0] / (T2[n] - T1[n])
+            ref_ig = quad(CP_ig, T1[n], T2[n], args = tuple(c['CPig'][key].values()), limit=1100)[0] / (T2[n] - T1[n])
+            assert abs(cpl[n, i] - ref_l) <= 1e-9 * abs(ref_l)
+            assert abs(cpig[n, i] - ref_ig) <= 1e-9 * abs(ref_ig)
+            assert abs(meanCP(CP_L, T1[n], T2[n], tuple(c['CPL'][key].values())) - ref_l) <= 1e-9 * abs(ref_l)
+
+    # The memo keys the window limits exactly, a limit closer than its rounding is another result.
+    coefficients = tuple(c['CPL']['benzene'].values())
+    assert meanCP(CP_L, 300.0, 400.0, coefficients) == meanCP(CP_L, 300.0, 400.0, coefficients)
+    assert meanCP(CP_L, 300.0, 400.0 + 4e-7, coefficients) == table.meanCPL(300.0, 400.0 + 4e-7)[table.index['benzene']]
+    assert meanCP(CP_L, 300.0, 400.0 + 4e-7, coefficients) != meanCP(CP_L, 300.0, 400.0, coefficients)
+
+
+def test_sensitivities():
+    ''' The analytic sensitivities must match central finite differences.'''
+    table = PropertyTable(['benzene', 'toluene', 'p-xylene'])
+    z = {'benzene': 0.3, 'toluene': 0.4, 'p-xylene': 0.3}
+
+    def drum(P, T = None, Tf = 420.0):
+
+        fd = FlashDrum(engine = 'numpy')
+        fd.setFeedStream(Stream('Feed', Tf, 500.0, 1.0, z))
+
+        if T is None:
+            fd.adiabatic(P, table, sensitivity = True)
+        else:
+            fd.isothermal(T, P, table, sensitivity = True)
+
+        return fd
+
+    h = 1e-3
+    s = drum(101.325, 380.0).sensitivities
+    assert abs(s['dPsi/dT'] - (drum(101.325, 380.0 + h).psi - drum(101.325, 380.0 - h).psi) / (2 * h)) <= 1e-6
+    assert abs(s['dPsi/dP'] - (drum(101.325 + h, 380.0).psi - drum(101.325 - h, 380.0).psi) / (2 * h)) <= 1e-6
+    h = 1e-2
+    s = drum(101.325).sensitivities
+    assert abs(s['dT/dP'] - (drum(101.325 + h).Temperature - drum(101.325 - h).Temperature) / (2 * h)) <= 1e-5
+    assert abs(s['dPsi/dP'] - (drum(101.325 + h).psi - drum(101.325 - h).psi) / (2 * h)) <= 1e-7
+
+
+def test_adiabatic_isothermal():
+    ''' An isothermal flash at the adiabatic drum temperature must need no heat, for liquid, two-phase and vapor feeds.'''
+    table = PropertyTable(['benzene', 'toluene', 'p-xylene'])
+    z = {'benzene': 0.3, 'toluene': 0.4, 'p-xylene': 0.3}
+
+    for Tf, Pf, P in ((300.0, 500.0, 50.0), (405.0, 200.0, 101.325), (420.0, 500.0, 150.0), (430.0, 150.0, 101.325)):
+
+        adiabatic = FlashDrum(engine = 'numpy')
+        adiabatic.setFeedStream(Stream('Feed', Tf, Pf, 10.0, z))
+        adiabatic.adiabatic(P, table)
+        isothermal = FlashDrum(engine = 'numpy')
+        isothermal.setFeedStream(Stream('Feed', Tf, Pf, 10.0, z))
+        isothermal.isothermal(adiabatic.Temperature, P, table, energy = True)
+        assert abs(isothermal.Heat) <= 1e-6
+        assert abs(isothermal.feed.getH() - adiabatic.feed.getH()) <= 1e-9
+
+    # A vapor feed just above its dew point lands between the two-phase and vapor enthalpies of the drum dew point.
+    adiabatic = FlashDrum(engine = 'numpy')
+    adiabatic.setFeedStream(Stream('Feed', 300.0, 100.0, 10.0, z))
+    adiabatic.setFeedStream(Stream('Feed', adiabatic.dewT(100.0, table) + 0.01, 100.0, 10.0, z))
+
+    with pytest.warns(RuntimeWarning):
+        adiabatic.adiabatic(101.325, table)
+
+    assert adiabatic.Temperature == adiabatic.dewT(101.325, table) and adiabatic.Heat > 0
+    isothermal = FlashDrum(engine = 'numpy')
+    isothermal.setFeedStream(Stream('Feed', adiabatic.feed.getT(), 100.0, 10.0, z))
+    isothermal.isothermal(adiabatic.Temperature, 101.325, table, energy = True)
+    assert abs(isothermal.Heat - adiabatic.Heat) <= 1e-6
+
+
+def test_phase_boundary_memo():
+    ''' bubbleT and dewT are memoized per pressure and a new feed clears the record.'''
+    table = PropertyTable(['benzene', 'toluene'])
+    drum = FlashDrum(engine = 'numpy')
+    drum.setFeedStream(Stream('Feed', 350.0, 101.325, 1.0, {'benzene': 0.3, 'toluene': 0.7}))
+    T_bubble = drum.bubbleT(101.325, table)
+    assert len(drum.boundaries) == 1 and drum.bubbleT(101.325, table) == T_bubble
+    # A parameters() dict has its own entry, keyed on the Antoine coefficients.
+    assert drum.bubbleT(101.325, parameters(['benzene', 'toluene'])) == T_bubble
+    drum.dewT(101.325, table)
+    assert len(drum.boundaries) == 3
+    drum.setFeedStream(Stream('Feed', 350.0, 101.325, 1.0, {'benzene': 0.7, 'toluene': 0.3}))
+    assert drum.boundaries == {}
+    assert drum.bubbleT(101.325, table) < T_bubble
+    assert abs(drum.bubbleT(101.325, table) - bubbleTnp(101.325, [0.7, 0.3], table)[0]) <= 1e-8
+
+
+def test_batch_resume(tmp_path):
+    ''' An interrupted batch resumes after its checkpoint and gives the same results as one run, from CSV and Parquet.'''
+    rng = np.random.default_rng(0)
+    N = 250
+    z = rng.dirichlet(np.ones(2), size = N)
+    cases = pd.DataFrame({'Tf': 350.0, 'Pf': 200.0, 'F': 1.0, 'T': rng.uniform(360.0, 380.0, N), 'P': 101.325,
+                          'z_benzene': z[:, 0], 'z_toluene': z[:, 1]})
+    cases.to_csv(tmp_path / 'cases.csv', index = False)
+    pq.write_table(pa.Table.from_pandas(cases), str(tmp_path / 'cases.parquet'), row_group_size = 64)
+    # A partial first chunk and whole skipped row groups.
+    assert np.allclose(next(readCases(str(tmp_path / 'cases.csv'), 100, 130))['T'], cases['T'][130:200])
+    assert np.allclose(next(readCases(str(tmp_path / 'cases.parquet'), 100, 130))['T'], cases['T'][130:228])
+
+    def interrupt(line):
+
+        raise KeyboardInterrupt
+
+    for name in ('cases.csv', 'cases.parquet'):
+
+        output = str(tmp_path / (name + '.out'))
+
+        try:
+            runBatch(str(tmp_path / name), output, chunksize = 100, progress = interrupt)
+        except KeyboardInterrupt:
+            pass
+
+        assert runBatch(str(tmp_path / name), output, chunksize = 100, progress = None) == N - 100
+        results = pd.read_parquet(output)
+        assert np.allclose(results['T'], cases['T'])
+        assert np.allclose(results['Q'], solveCases(cases, PropertyTable(['benzene', 'toluene']))['Q'])
+
+
+@pytest.mark.parametrize('kind', ['isothermal', 'bubbleT', 'dewT', 'adiabatic'])
+def test_numpy_gekko(kind):
+    ''' The numpy engine must give the GEKKO results, GEKKO rounds the bubble and dew temperatures to 0.01 K.'''
+    table = PropertyTable(['benzene', 'toluene', 'p-xylene'])
+    z = {'benzene': 0.3, 'toluene': 0.4, 'p-xylene': 0.3}
+    drums = {}
+
+    for engine in ('numpy', 'gekko'):
+
+        drum = FlashDrum(engine = engine)
+        drum.setFeedStream(Stream('Feed', 420.0, 500.0, 10.0, z))
+
+        if kind == 'isothermal':
+            drum.isothermal(380.0, 101.325, table, energy = True)
+        elif kind == 'adiabatic':
+            drum.adiabatic(101.325, table)
+        else:
+            drum.Temperature = getattr(drum, kind)(101.325, table)
+
+        drums[engine] = drum
+
+    fast, reference = drums['numpy'], drums['gekko']
+
+    if kind != 'isothermal':
+        assert abs(fast.Temperature - reference.Temperature) <= 0.01
+
+    if kind in ('isothermal', 'adiabatic'):
+
+        assert abs(fast.psi - reference.psi) <= 1e-5
+        assert abs(fast.Heat - reference.Heat) <= 1e-3
+
+        for key in z:
+            assert abs(fast.liquid.getmC(key) - reference.liquid.getmC(key)) <= 1e-5
+            assert abs(fast.vapor.getmC(key) - reference.vapor.getmC(key)) <= 1e-5
+
+
+def test_result_cache(tmp_path):
+    ''' Cached flashes restore the whole drum state, changed coefficients miss and a changed database drops the results.'''
+    data = tmp_path / 'compound_data.csv'
+    shutil.copy(COMPOUND_DATA, data)
+    cache = ResultCache(str(tmp_path / 'results.sqlite'), maxsize = 1000, data = str(data))
+    table = PropertyTable(['benzene', 'toluene'])
+    z = {'benzene': 0.4, 'toluene': 0.6}
+    drums = []
+
+    for _ in range(2):
+
+        drum = FlashDrum(engine = 'numpy', resultCache = cache)
+        drum.setFeedStream(Stream('Feed', 350.0, 200.0, 1.0, z))
+        drum.adiabatic(101.325, table)
+        drum.isothermal(368.0, 101.325, table, energy = True)
+        drums.append(drum)
+
+    # The bubble and dew temperatures at the feed and drum pressures and the isothermal flash.
+    assert cache.hits == 5 and cache.misses == 5
+    assert drums[1].saveResults() == drums[0].saveResults()
+    assert drums[1].Temperature == drums[0].Temperature and drums[1].iterations == drums[0].iterations
+    # Hits do not write until touch.
+    assert len(cache._used) == 5
+    cache.touch()
+    assert cache._used == {}
+    # Other coefficients are another key.
+    other = copy.copy(table)
+    other.Antoine = table.Antoine + [0.01, 0, 0, 0, 0]
+    drum = FlashDrum(engine = 'numpy', resultCache = cache)
+    drum.setFeedStream(Stream('Feed', 350.0, 200.0, 1.0, z))
+    drum.bubbleT(101.325, other)
+    assert cache.misses == 6 and len(cache) == 6
+
+    with open(data, mode = 'a') as csvfile:
+        csvfile.write('\n')
+
+    assert len(ResultCache(str(tmp_path / 'results.sqlite'), data = str(data))) == 0
+
+
+def test_surrogate():
+    ''' The Chebyshev surrogate matches the exact vapor pressures in its range, falls back to them outside it
+    and warns when tol is out of reach.'''
+    exact = PropertyTable(['benzene', 'toluene', 'p-xylene'])
+    table = copy.copy(exact)
+    fit = table.fitSurrogate(T_min = 250.0, T_max = 550.0)
+    assert fit['error'] <= 1e-8 and fit['error'] == max(fit['max_error'].values())
+    T = np.linspace(250.0, 550.0, SURROGATE_MIN)
+    assert np.abs(table.lnPsat(T) - exact.lnPsat(T)).max() <= 1e-8
+    assert np.abs(table.dlnPsat(T) - exact.dlnPsat(T)).max() <= 1e-5
+    T = np.concatenate([np.linspace(150.0, 249.0, SURROGATE_MIN // 2), np.linspace(551.0, 600.0, SURROGATE_MIN // 2)])
+    assert np.array_equal(table.lnPsat(T), exact.lnPsat(T))
+
+    with pytest.warns(RuntimeWarning):
+        fit = table.fitSurrogate(T_min = 50.0, tol = 1e-14)
+
+    assert fit['degree'] == 40 and fit['error'] > 1e-14
+
+
+def test_bubble_dew_batch():
+    ''' The batch bubbleTnp and dewTnp kernels match the GEKKO bubbleT and dewT of every feed.'''
+    table = PropertyTable(['benzene', 'toluene', 'p-xylene'])
+    z = np.array([[0.3, 0.4, 0.3], [0.8, 0.1, 0.1], [0.05, 0.15, 0.8]])
+    P = np.array([101.325, 50.0, 300.0])
+    T_bubble, converged_bubble = bubbleTnp(P, z, table)
+    T_dew, converged_dew = dewTnp(P, z, table)
+    assert converged_bubble.all() and converged_dew.all()
+    assert np.allclose(np.sum(z * table.K(T_bubble, P), axis = -1), 1.0, atol = 1e-10)
+    assert np.allclose(np.sum(z / table.K(T_dew, P), axis = -1), 1.0, atol = 1e-10)
+
+    for zi, Pi, Tb, Td in zip(z, P, T_bubble, T_dew):
+
+        drum = FlashDrum(engine = 'gekko')
+        drum.setFeedStream(Stream('Feed', 300.0, Pi, 1.0, dict(zip(table.compounds, zi))))
+        assert abs(drum.bubbleT(Pi, table) - Tb) <= 0.01
+        assert abs(drum.dewT(Pi, table) - Td) <= 0.01
+
+
+def test_antoine_inverse():
+    ''' AntoineInvnp inverts Psat for every compound and pressure, and matches the scalar AntoineInv.'''
+    table = PropertyTable(['benzene', 'toluene', 'p-xylene'])
+    P = np.geomspace(1.0, 2000.0, 50)
+    T, converged = AntoineInvnp(P, table)
+    assert T.shape == (50, 3) and converged.all()
+    assert np.allclose(np.log(table.Psat(T)[:, np.arange(3), np.arange(3)]), np.log(P)[:, None], rtol = 0, atol = 1e-10)
+    assert abs(T[10, 1] - AntoineInv(float(P[10]), **table['AntoineInv']['toluene'])) <= 1e-8
+
+
+def test_compound_store(tmp_path):
+    ''' A compound store converted from the CSV database gives the same coefficients, non-ASCII names are rejected.'''
+    store = CompoundStore(convertCSV(COMPOUND_DATA, str(tmp_path / 'store')))
+    data = readCompoundData(COMPOUND_DATA)
+    assert sorted(store.keys()) == sorted(data.keys())
+
+    for name in data:
+        assert store[name] == data[name]
+
+    assert 'benzène' not in store
+    rows = (tmp_path / 'names.csv')
+    rows.write_text('benzène' + open(COMPOUND_DATA).readline()[len('benzene'):], encoding = 'utf-8')
+
+    with pytest.raises(ValueError):
+        convertCSV(str(rows), str(tmp_path / 'other'))
+
+
+def test_envelope_curve():
+    ''' Every point of the bubble, dew and psi = 0.5 curves is a bubble point, dew point or flash with that vapor fraction.'''
+    table = PropertyTable(['benzene', 'toluene', 'p-xylene'])
+    z = np.array([0.3, 0.4, 0.3])
+    T, P, stats = envelopeCurve(z, table, 0.0, P_max = 1000.0)
+    assert stats['steps'] > 0 and abs(P[-1] - 1000.0) <= 1e-6 * 1000.0
+    assert np.allclose(T, bubbleTnp(P, z, table)[0], rtol = 0, atol = 1e-6)
+    T, P, stats = envelopeCurve(z, table, 1.0, P_max = 1000.0)
+    assert np.allclose(T, dewTnp(P, z, table)[0], rtol = 0, atol = 1e-6)
+    T, P, stats = envelopeCurve(z, table, 0.5, P_max = 1000.0)
+    assert np.allclose(rachfordRice(z, table.K(T, P)), 0.5, rtol = 0, atol = 1e-8)
+
+
+def test_response_table():
+    ''' The interpolated responses match a direct flash, Psi is 0 and 1 on the bubble and dew lines and
+    queries near the lines are solved exactly.'''
+    table = PropertyTable(['benzene', 'toluene', 'p-xylene'])
+    feed = Stream('Feed', 350.0, 300.0, 2.0, {'benzene': 0.3, 'toluene': 0.4, 'p-xylene': 0.3})
+    response = ResponseTable(feed, (320.0, 460.0), (50.0, 300.0), table, nT = 33, nP = 17)
+    rng = np.random.default_rng(1)
+    T = rng.uniform(320.0, 460.0, 1000)
+    P = np.exp(rng.uniform(np.log(50.0), np.log(300.0), 1000))
+    interpolated = response.query(T, P, margin = 0.0)
+    exact = isothermalBatch(T, P, response.z, table, 2.0, 350.0, 300.0, energy = True)
+    assert not interpolated['exact'].any()
+
+    for key, atol in (('Psi', 1e-3), ('x', 1e-3), ('y', 1e-3), ('Q', 0.05)):
+        assert np.abs(interpolated[key] - exact[key]).max() <= atol
+
+    assert np.all(np.abs(interpolated['Psi'] - exact['Psi']) <= interpolated['error']['Psi'] + 1e-12)
+    assert response.query(float(T[0]), float(P[0]), margin = 0.0)['Psi'] == interpolated['Psi'][0]
+    # Phase boundaries between the pressure rows.
+    P = np.array([60.0, 100.0, 250.0])
+    T_bubble = bubbleTnp(P, response.z, table)[0]
+    T_dew = dewTnp(P, response.z, table)[0]
+    assert np.all(response.query(T_bubble, P, margin = 0.0)['Psi'] <= 1e-6)
+    assert np.all(response.query(T_dew, P, margin = 0.0)['Psi'] >= 1 - 1e-6)
+    near = response.query(T_bubble + 0.01, P)
+    assert near['exact'].all()
+    assert np.allclose(near['Q'], isothermalBatch(T_bubble + 0.01, P, response.z, table, 2.0, 350.0, 300.0, energy = True)['Q'])
+
+
+def test_parallel_tables(tmp_path):
+    ''' The property tables of run_cases follow setCompoundData.'''
+    path = COMPOUND_DATA
+    case = {'kind': 'bubbleT', 'z': {'benzene': 0.5, 'toluene': 0.5}, 'P': 101.325}
+    T = run_cases([case], workers = 1)[0]
+    data = tmp_path / 'compound_data.csv'
+    # Twice the vapor pressure of every compound.
+    rows = [row.split(',') for row in open(path).read().splitlines() if row]
+    data.write_text('\n'.join(','.join(row[:7] + [repr(float(row[7]) + math.log(2.0))] + row[8:]) for row in rows) + '\n')
+
+    try:
+        setCompoundData(str(data))
+        assert run_cases([case], workers = 1)[0] < T - 1.0
+    finally:
+        setCompoundData(path)
+
+    assert run_cases([case], workers = 1)[0] == T
+    # compound_data of an in-process run does not change the database of the caller.
+    assert run_cases([case], workers = 1, compound_data = str(data))[0] < T - 1.0
+    assert flash.COMPOUND_DATA == path
+    assert run_cases([case], workers = 1)[0] == T
+
+
+def test_stream_composition():
+    ''' Compositions keep the dict interface, and StreamBatch packs and unpacks Stream objects.'''
+    stream = Stream('a', 300.0, 100.0, 1.0, {'a': 1.0, 'b': 3.0})
+    mC = stream.getmC()
+    assert list(mC.keys()) == ['a', 'b'] and list(mC.values()) == [1.0, 3.0] and list(mC.items()) == [('a', 1.0), ('b', 3.0)]
+    stream.setmC(4.0, 'c')
+    assert list(stream.getmC().keys()) == ['a', 'b', 'c'] and stream.getmC('c') == 4.0
+    stream.normalize()
+    assert dict(stream.getmC()) == {'a': 0.125, 'b': 0.375, 'c': 0.5}
+    # array() is a copy
+    stream.getmC().array()[0] = 9.0
+    assert stream.getmC('a') == 0.125
+    other = Stream('b', 310.0, 120.0, 2.0, {'c': 0.4, 'd': 0.6})
+    batch = StreamBatch.fromStreams([stream, other])
+    assert batch.index.names == ('a', 'b', 'c', 'd')
+    assert np.allclose(batch.mComposition, [[0.125, 0.375, 0.5, 0.0], [0.0, 0.0, 0.4, 0.6]])
+    streams = batch.toStreams()
+    assert [s.getT() for s in streams] == [300.0, 310.0] and [s.getmF() for s in streams] == [1.0, 2.0]
+    assert dict(streams[1].getmC()) == {'a': 0.0, 'b': 0.0, 'c': 0.4, 'd': 0.6}
+    assert dict(streams[0].getmC()) == dict(stream.getmC(), d = 0.0)
+
+
+def test_calculations():
+    ''' The cached app calculations take tuples of compounds and fractions, like flash_app builds from a feed Stream.'''
+    feed = Stream(mComposition = {'benzene': 1.0, 'toluene': 3.0})
+    feed.normalize()
+    compounds, z = (tuple(values) for values in zip(*feed.getmC().items()))
+    assert compounds == ('benzene', 'toluene') and z == (0.25, 0.75)
+    T_bubble = calculations.bubbleT(compounds, z, 101.325, engine = 'numpy')
+    assert abs(T_bubble - bubbleTnp(101.325, np.array(z), PropertyTable(compounds))[0]) <= 1e-8
+    assert abs(calculations.bubbleT(compounds, z, 101.325) - T_bubble) <= 0.01
+    T = 0.5 * (T_bubble + calculations.dewT(compounds, z, 101.325, engine = 'numpy'))
+    streams, results = calculations.isothermal(compounds, z, 350.0, 200.0, 10.0, T, 101.325, True, 'numpy')
+    assert 0 < results['Drum']['Psi'] < 1 and results['Drum']['Heat'] > 0
+    assert abs(results['Vapor']['Molar Flow'] + results['Liquid']['Molar Flow'] - 10.0) <= 1e-9
+    x, T_b, T_d = calculations.Txy('benzene', 'toluene', 101.325, 11)
+    assert len(x) == len(T_b) == len(T_d) and all(b <= d + 1e-9 for b, d in zip(T_b, T_d))
+    # Pure components at the ends of the diagram.
+    assert abs(T_b[0] - T_d[0]) <= 1e-8 and abs(T_b[-1] - T_d[-1]) <= 1e-8
+    x, P_b, P_d = calculations.Pxy('benzene', 'toluene', 370.0, 11)
+    assert len(x) == len(P_b) == len(P_d) and all(b >= d - 1e-9 for b, d in zip(P_b, P_d))
+
+
+def test_response_table_order(tmp_path):
+    ''' A property table in another order than the feed keeps the compounds labelled, also through save and load.'''
+    table = PropertyTable(['toluene', 'benzene'])
+    feed = Stream('Feed', 350.0, 300.0, 2.0, {'benzene': 0.3, 'toluene': 0.7})
+    response = ResponseTable(feed, (340.0, 400.0), (80.0, 200.0), table, nT = 9, nP = 5)
+    assert response.compounds == ('toluene', 'benzene')
+    assert dict(response.feedStream().getmC()) == {'toluene': 0.7, 'benzene': 0.3}
+    drum = FlashDrum(engine = 'numpy')
+    drum.setFeedStream(feed)
+    drum.isothermal(370.0, 101.325, table)
+    result = response.query(370.0, 101.325, margin = 0.0)
+    assert abs(result['x'][0, 1] - drum.liquid.getmC('benzene')) <= 1e-3
+    loaded = ResponseTable.load(response.save(str(tmp_path / 'table.npz')))
+    assert loaded.compounds == response.compounds
+    assert np.array_equal(loaded.table.Antoine, table.Antoine)
+    assert dict(loaded.feedStream().getmC()) == {'toluene': 0.7, 'benzene': 0.3}
+    assert np.allclose(loaded.query(370.0, 101.325, margin = 0.0)['x'], result['x'])
+    # Outside the rectangle the loaded table solves with the stored coefficients.
+    assert loaded.query(330.0, 101.325)['exact'].all()
+    assert np.allclose(loaded.query(330.0, 101.325)['Q'], response.query(330.0, 101.325)['Q'])
+
+    with pytest.raises(ValueError):
+        ResponseTable.load(str(tmp_path / 'table.npz'), PropertyTable(['benzene', 'toluene']))
+
+
+def test_instrumentation():
+    ''' instrument() counts the calls and nested spans of a flash, and instrument(False) restores the original functions.'''
+    isothermal = flash.FlashDrum.__dict__['isothermal']
+    rachford = flash.rachfordRice
+    table = PropertyTable(['benzene', 'toluene'])
+    drum = FlashDrum(engine = 'numpy')
+    drum.setFeedStream(Stream('Feed', 350.0, 200.0, 1.0, {'benzene': 0.4, 'toluene': 0.6}))
+
+    try:
+        profiler = instrument()
+        assert profiler.enabled and flash.FlashDrum.__dict__['isothermal'] is not isothermal
+        drum.isothermal(368.0, 101.325, table, energy = True)
+        report = profiler.report()
+    finally:
+        instrument(False, clear = False)
+
+    functions = report['functions']
+    assert functions['FlashDrum.isothermal']['calls'] == 1 and functions['rachfordRice']['calls'] == 1
+    # Bubble and dew temperatures at the feed and drum pressures.
+    assert functions['FlashDrum.bubbleT']['calls'] == 2 and functions['FlashDrum.dewT']['calls'] == 2
+    assert report['spans']['FlashDrum.isothermal/FlashDrum.bubbleT/bubbleTnp/_saturationT']['calls'] == 2
+    assert report['spans']['FlashDrum.isothermal/rachfordRice']['calls'] == 1
+    assert functions['FlashDrum.isothermal']['time'] >= functions['FlashDrum.isothermal']['self'] > 0
+    events = profiler.chromeTrace()['traceEvents']
+    assert len(events) == report['events'] > 0 and all(event['ph'] == 'X' for event in events)
+    assert not profiler.enabled
+    assert flash.FlashDrum.__dict__['isothermal'] is isothermal and flash.rachfordRice is rachford
+
+
+def test_thermo_cache():
+    ''' LRU eviction, statistics, invalidation by function, digits and symbolic arguments of a ThermoCache.'''
+    cache = ThermoCache(maxsize = 2, digits = 3)
+    calls = []
+
+    def square(T, c):
+
+        calls.append(T)
+        return T * T * c
+
+    def cube(T):
+
+        return T ** 3
+
+    assert cache.call(square, (0,), (1.0, 2.0), {}) == 2.0
+    assert cache.call(square, (0,), (2.0, 2.0), {}) == 8.0
+    # 1.0001 rounds to the key of 1.0, the hit makes 2.0 the least recently used entry.
+    assert cache.call(square, (0,), (1.0001, 2.0), {}) == 2.0
+    cache.call(square, (0,), (3.0, 2.0), {})
+    assert calls == [1.0, 2.0, 3.0]
+    cache.call(square, (0,), (1.0, 2.0), {})
+    cache.call(square, (0,), (2.0, 2.0), {})
+    assert calls == [1.0, 2.0, 3.0, 2.0]
+    assert cache.stats() == {'hits': 2, 'misses': 4, 'hit ratio': 2 / 6, 'size': 2, 'maxsize': 2}
+    # invalidate drops only the entries of one function.
+    cache.configure(maxsize = 10)
+    cache.call(cube, (0,), (2.0,), {})
+    cache.invalidate('square')
+    assert cache.stats()['size'] == 1
+    cache.call(cube, (0,), (2.0,), {})
+    assert cache.hits == 3
+    # A new number of digits clears the entries.
+    cache.configure(digits = 6)
+    assert cache.stats()['size'] == 0
+    cache.call(square, (0,), (1.0, 2.0), {})
+    cache.call(square, (0,), (1.0001, 2.0), {})
+    assert calls[-2:] == [1.0, 1.0001]
+    # Symbolic GEKKO arguments are evaluated and never stored.
+    m = GEKKO()
+    T = m.Var(value = 300.0)
+    size = cache.stats()['size']
+    assert cache.key('square', (0,), (T, 2.0), {}) is None
+    cache.call(square, (0,), (T, 2.0), {})
+    assert calls[-1] is T and cache.stats()['size'] == size
+
+
+def test_isothermal_batch():
+    ''' isothermalBatch matches FlashDrum.isothermal with energy for every combination of feed and outlet phases.'''
+    table = PropertyTable(['benzene', 'toluene'])
+    z = np.array([0.4, 0.6])
+    T_bubble, T_dew = bubbleTnp(101.325, z, table)[0], dewTnp(101.325, z, table)[0]
+    # Liquid, two-phase and vapor temperatures at 101.325 kPa, used for the feeds and the drum.
+    temperatures = (T_bubble - 20.0, 0.5 * (T_bubble + T_dew), T_dew + 20.0)
+    Tf, T = (np.array(values).ravel() for values in np.meshgrid(temperatures, temperatures, indexing = 'ij'))
+    batch = isothermalBatch(T, 101.325, z, table, 10.0, Tf, 101.325, energy = True)
+
+    for n in range(len(T)):
+
+        drum = FlashDrum(engine = 'numpy')
+        drum.setFeedStream(Stream('Feed', Tf[n], 101.325, 10.0, dict(zip(table.compounds, z))))
+        drum.isothermal(T[n], 101.325, table, energy = True)
+        assert abs(batch['Psi'][n] - drum.psi) <= 1e-10
+        assert abs(batch['Q'][n] - drum.Heat) <= 1e-8 * max(1.0, abs(drum.Heat))
+        assert abs(batch['hf'][n] - drum.feed.getH()) <= 1e-10
+        assert np.allclose(batch['x'][n], drum.liquid.getmC().array(table.compounds), rtol = 0, atol = 1e-10)
+        assert np.allclose(batch['y'][n], drum.vapor.getmC().array(table.compounds), rtol = 0, atol = 1e-10)
+
+    assert set(batch['Psi']) >= {0.0, 1.0} and ((batch['Psi'] > 0) & (batch['Psi'] < 1)).sum() == 3
+
+
+def test_flowsheet_recycle():
+    ''' Every tear method must close the mass balance of a recycle at the same solution, a recycle without
+    a steady state (D1 all vapor and D2 all liquid) must not converge.'''
+    table = PropertyTable(['benzene', 'toluene', 'p-xylene'])
+
+    def flowsheet(T2):
+
+        fs = Flowsheet(table)
+        fs.addFeed('F', Stream('F', 360.0, 101.325, 100.0, {'benzene': 0.3, 'toluene': 0.4, 'p-xylene': 0.3}))
+        fs.addUnit('D1', FlashDrum(engine = 'numpy'), T = 385.0, P = 101.325)
+        fs.addUnit('D2', FlashDrum(engine = 'numpy'), T = T2, P = 101.325)
+        fs.connect('F', 'D1')
+        fs.connect('D1', 'D2', 'vapor')
+        fs.connect('D2', 'D1', 'liquid')
+        return fs
+
+    recycles = []
+
+    for method in ('wegstein', 'broyden', 'direct'):
+
+        fs = flowsheet(375.0)
+        assert fs.solve(method)
+        outlets = fs.streams[('D1', 'liquid')][0] + fs.streams[('D2', 'vapor')][0]
+        assert np.all(np.abs(outlets - [30.0, 40.0, 30.0]) <= 1e-5)
+        recycles.append(fs.streams[('D2', 'liquid')][0])
+
+    assert np.all(np.abs(np.array(recycles) - recycles[0]) <= 1e-4)
+
+    for method in ('wegstein', 'broyden', 'direct'):
+        assert not flowsheet(372.0).solve(method)
+
+
+def test_flash_server():
+    ''' A malformed request gets 400 without failing the valid requests of its micro-batch,
+    the energy balance needs the feed conditions and close() ends the keep-alive connections.'''
+    z = {'benzene': 0.5, 'toluene': 0.5}
+
+    async def scenario():
+
+        server = await flash_server.FlashServer(port = 0, window = 0.05, workers = 1).start()
+        connections = [await asyncio.open_connection(server.host, server.port) for _ in range(4)]
+
+        async def post(connection, kind, case):
+
+            reader, writer = connection
+            body = json.dumps(case).encode()
+            writer.write("POST /{} HTTP/1.1\r\nContent-Length: {}\r\n\r\n".format(kind, len(body)).encode() + body)
+            await writer.drain()
+            line, headers, body = await flash_server.readMessage(reader)
+            return int(line.split(' ')[1]), json.loads(body)
+
+        responses = await asyncio.gather(post(connections[0], 'isothermal', {'z': z, 'T': 370.0, 'P': 101.325}),
+                                         post(connections[1], 'isothermal', {'z': z, 'T': 'abc', 'P': 101.325}),
+                                         post(connections[2], 'isothermal', {'z': z, 'T': 370.0, 'P': 101.325, 'energy': True}),
+                                         post(connections[3], 'isothermal', {'z': z, 'T': 370.0, 'P': 101.325, 'energy': True, 'feed': {'T': 350.0, 'P': 200.0}}))
+        await asyncio.wait_for(server.close(), 10)
+        return responses
+
+    (ok, valid), (bad, _), (no_feed, _), (energy, result) = asyncio.run(scenario())
+    assert (ok, bad, no_feed, energy) == (200, 400, 400, 200)
+    assert 0 < valid['Psi'] < 1 and 'Q' in result
+    # A case that fails in the worker only fails its own result.
+    results = flash_server.solveBatch('isothermal', ('benzene', 'toluene'), False, [{'z': z, 'T': 370.0, 'P': 101.325}, {'z': z, 'T': 'abc', 'P': 101.325}])
+    assert 'Psi' in results[0] and 'error' in results[1]
+
+
+def test_Txy_sweep():
+    ''' The sweep, also its refined points, must match bubbleTnp and dewTnp at every composition.'''
+    table = PropertyTable(['benzene', 'p-xylene'])
+    x, T_b, T_d = TxySweep(101.325, table, n = 21, atol = 0.01)
+    z = np.column_stack([x, 1 - x])
+    assert len(x) > 21 and np.all(np.diff(x) > 0)
+    assert np.all(np.abs(T_b - bubbleTnp(101.325, z, table)[0]) <= 1e-8)
+    assert np.all(np.abs(T_d - dewTnp(101.325, z, table)[0]) <= 1e-8)
+
 
 if __name__ == '__main__':
     flash = FlashDrum()
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from functools import wraps
+from numbers import Number
+from threading import Lock
+
+
+class ThermoCache():
+
+    def __init__(self, maxsize = 4096, digits = 6, enabled = True):
+        ''' Size-bounded LRU cache for the per-component thermodynamic functions of flash.py.
+         -> maxsize is the maximum number of stored results, the least recently used one is dropped first.
+         -> digits is the number of decimals the state variables (T, P) are rounded to in the key.
+         -> enabled turns the cache on and off, when it is off every call is evaluated.
+         The key of a result is the function name, the rounded state variables and the component
+         coefficients, so the same component at the same state always hits the same entry. '''
+        self.maxsize = maxsize
+        self.digits = digits
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+
+    def configure(self, maxsize = None, digits = None, enabled = None):
+        ''' Changes the cache settings, a change of digits clears the stored results.'''
+        with self._lock:
+
+            if maxsize is not None:
+                self.maxsize = maxsize
+
+            if digits is not None and digits != self.digits:
+                self.digits = digits
+                self._data.clear()
+
+            if enabled is not None:
+                self.enabled = enabled
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+
+    def key(self, name, state, args, kwargs, exact = False):
+        ''' Builds the key of a call, or returns None if the call can not be cached
+        (e.g. a state variable is a GEKKO variable). With exact the state variables are not rounded.'''
+        key = [name]
+
+        for i, arg in enumerate(args):
+
+            if i in state:
+
+                if not isinstance(arg, Number):
+                    return None
+
+                key.append(float(arg) if exact else round(float(arg), self.digits))
+
+            else:
+
+                key.append(arg)
+
+        key.append(tuple(sorted(kwargs.items())))
+        key = tuple(key)
+
+        try:
+            hash(key)
+        except TypeError:
+            return None
+
+        return key
+
+
+    def call(self, function, state, args, kwargs, exact = False):
+        ''' Returns the cached result of function(*args, **kwargs), evaluating it on a miss.'''
+        key = self.key(function.__name__, state, args, kwargs, exact) if self.enabled else None
+
+        if key is None:
+            return function(*args, **kwargs)
+
+        with self._lock:
+
+            if key in self._data:
+
+                self.hits += 1
+                self._data.move_to_end(key)
+                return self._data[key]
+
+            self.misses += 1
+
+        value = function(*args, **kwargs)
+
+        with self._lock:
+
+            self._data[key] = value
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+        return value
+
+
+    def invalidate(self, name = None):
+        ''' Drops the results of one function (by name) or all of them if name is None.'''
+        with self._lock:
+
+            if name is None:
+                self._data.clear()
+
+            else:
+
+                for key in [key for key in self._data.keys() if key[0] == name]:
+                    del self._data[key]
+
+
+    def clear(self):
+        ''' Drops every result and resets the statistics.'''
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+    def stats(self):
+        ''' Hit/miss statistics of the cache.'''
+        calls = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit ratio': self.hits / calls if calls else 0.0,
+                'size': len(self._data),
+                'maxsize': self.maxsize}
+
+
+thermoCache = ThermoCache()
+
+def memoized(*state, exact = False):
+    ''' Decorator that stores the results of a thermodynamic function in thermoCache.
+    state are the positions of the arguments that are state variables and get rounded in the key,
+    with exact they are keyed on their exact values.'''
+    def decorator(function):
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            return thermoCache.call(function, state, args, kwargs, exact)
+
+        return wrapper
+
+    return decorator